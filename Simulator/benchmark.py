@@ -0,0 +1,188 @@
+# benchmark.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Benchmark suite for focuser_position_per_filter against ccdciel_simulator
+# - script is installed with shared modules in temporary directory (like in
+#   CCDciel directory) for every wheel size, so every size starts with empty
+#   database
+# - CALCULATE, READ and RESET modes are run on filter wheels of different
+#   sizes, wall time, simulated telescope time and JSON-RPC calls are measured
+# - results are printed as table (median of runs) and optionally stored as JSON
+#
+# Usage:
+#   python3 benchmark.py [--filters <list of wheel sizes, default 5,8,12>] [--modes <list of modes, default CALCULATE,READ,RESET>]
+#                        [--runs <runs per mode, default 3>] [--realclock] [--timescale <factor>]
+#                        [--slottime <s>] [--focuserspeed <steps/s>] [--autofocustime <s>] [--latency <s>]
+#                        [--json <results file>] [--script <path to script>] [--verbose]
+#
+# By default simulator runs with virtual clock, runs take only time of script
+# itself and simulated time shows time which would be spent at telescope.
+#
+# List of changes:
+# [17-10-2026] Initial version, CALCULATE, READ and RESET modes on wheels of different sizes
+# [17-10-2026] CALCULATE and INCREMENTAL use first filter as reference filter, benchmark fails when INCREMENTAL
+#              falls back to calculation of all filters
+# ---------------------------------------------------------------------------- #
+#
+
+from ccdciel_simulator import Simulator, start_server
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+this_dir = os.path.dirname(os.path.abspath(__file__)) # Directory of benchmark
+repository_dir = os.path.dirname(this_dir) # Directory with scripts and shared modules
+
+# install_scripts - copy script, shared modules and simulator client to directory
+# @arguments
+# script - path to benchmarked script
+# directory - destination directory
+#
+# @return path to installed script
+def install_scripts(script, directory):
+   for f in glob.glob(os.path.join(repository_dir, '*.py')):
+      shutil.copy(f, directory)
+   shutil.copy(script, directory)
+   shutil.copy(os.path.join(this_dir, 'ccdciel.py'), directory)
+   return os.path.join(directory, os.path.basename(script))
+
+# run_script - run script in selected mode against simulator
+# CALCULATE and INCREMENTAL modes get initial focuser position near best focus,
+# focuser is at ZERO position after RESET, all filters are marked as in use and first
+# filter is reference filter. INCREMENTAL which calculated all filters is marked as fallback.
+# @arguments
+# simulator - simulator object
+# port - simulator port
+# script - path to installed script
+# mode - working mode of script
+#
+# @return result dictionary
+def run_script(simulator, port, script, mode):
+   env = dict(os.environ)
+   env['CCDCIEL_PORT'] = str(port)
+   env['CCDCIEL_HOST'] = 'localhost'
+   env['PYTHONDONTWRITEBYTECODE'] = '1'
+   arguments = [sys.executable, script, '-m', mode]
+   if mode in ('CALCULATE', 'INCREMENTAL'):
+      arguments += ['-f', str(simulator.best_focus(1) + simulator.INITIAL_FOCUS_DISTANCE), '-s', ','.join(str(i+1) for i in range(len(simulator.filters))), '-n', simulator.filters[0]]
+   simulator.reset_statistics()
+   start = time.perf_counter()
+   process = subprocess.run(arguments, cwd=os.path.dirname(script), env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+   wall_time = time.perf_counter() - start
+   stats = simulator.statistics()
+   log_calls = stats['calls'].get('LogMsg', 0)
+   fallback = mode == 'INCREMENTAL' and any('calculate all filters' in m for m in simulator.log)
+   return {'mode': mode, 'exit_code': process.returncode, 'wall_time': wall_time, 'simulated_time': stats['simulated_time'],
+           'total_calls': stats['total_calls'], 'device_calls': stats['total_calls'] - log_calls, 'log_calls': log_calls,
+           'requests': stats['requests'], 'batches': stats['batches'], 'calls': stats['calls'], 'fallback': fallback, 'stderr': process.stderr[-2000:]}
+
+# run_benchmark - run all modes on all wheel sizes
+# @arguments
+# options - benchmark options
+#
+# @return list of results
+def run_benchmark(options):
+   results = []
+   for filters in options['filters']:
+      directory = tempfile.mkdtemp(prefix='ccdciel_benchmark_')
+      try:
+         script = install_scripts(options['script'], directory)
+         simulator = Simulator(filters=filters, virtual_clock=options['virtual_clock'], time_scale=options['time_scale'], **options['simulator'])
+         server, port = start_server(simulator)
+         for run in range(options['runs']):
+            for mode in options['modes']:
+               result = run_script(simulator, port, script, mode)
+               result['filters'] = filters
+               result['run'] = run + 1
+               results.append(result)
+               if options['verbose'] or result['exit_code'] != 0:
+                  print('filters %d run %d %s: exit code %d wall %.2fs simulated %.1fs calls %d' % (filters, run + 1, mode, result['exit_code'], result['wall_time'], result['simulated_time'], result['total_calls']))
+                  if result['exit_code'] != 0:
+                     print(result['stderr'])
+               if result['fallback']:
+                  print('filters %d run %d %s: [ERROR] all filters calculated, reference filter not used' % (filters, run + 1, mode))
+         server.shutdown()
+         server.server_close()
+      finally:
+         shutil.rmtree(directory, ignore_errors=True)
+   return results
+
+# print_summary - print median of runs for every wheel size and mode
+def print_summary(results, options):
+   print('%7s %-11s %10s %12s %8s %8s %6s %8s %8s' % ('filters', 'mode', 'wall [s]', 'telescope[s]', 'calls', 'device', 'log', 'requests', 'batches'))
+   for filters in options['filters']:
+      for mode in options['modes']:
+         runs = [r for r in results if r['filters'] == filters and r['mode'] == mode]
+         if len(runs) == 0:
+            continue
+         print('%7d %-11s %10.3f %12.1f %8d %8d %6d %8d %8d' % (filters, mode,
+               statistics.median(r['wall_time'] for r in runs), statistics.median(r['simulated_time'] for r in runs),
+               statistics.median(r['total_calls'] for r in runs), statistics.median(r['device_calls'] for r in runs),
+               statistics.median(r['log_calls'] for r in runs), statistics.median(r['requests'] for r in runs),
+               statistics.median(r['batches'] for r in runs)))
+
+# arguments_parser - parse benchmark arguments
+# @return benchmark options
+def arguments_parser(args):
+   options = {'filters': [5, 8, 12], 'modes': ['CALCULATE', 'READ', 'RESET'], 'runs': 3, 'virtual_clock': True, 'time_scale': 1.0,
+              'json': None, 'script': os.path.join(repository_dir, 'focuser_position_per_filter.py'), 'verbose': False, 'simulator': {}}
+   usage = 'Usage: %s [--filters <5,8,12>] [--modes <CALCULATE,READ,RESET>] [--runs <n>] [--realclock] [--timescale <factor>] [--slottime <s>] [--focuserspeed <steps/s>] [--autofocustime <s>] [--latency <s>] [--json <file>] [--script <path>] [--verbose]' % (sys.argv[0])
+   simulator_values = {'--slottime': 'slot_time', '--focuserspeed': 'focuser_speed', '--autofocustime': 'autofocus_time', '--latency': 'latency'}
+   i = 0
+   while i < len(args):
+      a = args[i]
+      if a in ('--help', '-help'):
+         print(usage)
+         sys.exit(0)
+      elif a == '--realclock':
+         options['virtual_clock'] = False
+         i += 1
+      elif a == '--verbose':
+         options['verbose'] = True
+         i += 1
+      elif i + 1 < len(args) and (a in simulator_values or a in ('--filters', '--modes', '--runs', '--timescale', '--json', '--script')):
+         value = args[i+1]
+         try:
+            if a == '--filters':
+               options['filters'] = [int(v) for v in value.split(',')]
+            elif a == '--modes':
+               options['modes'] = [v.upper() for v in value.split(',')]
+            elif a == '--runs':
+               options['runs'] = int(value)
+            elif a == '--timescale':
+               options['time_scale'] = float(value)
+            elif a == '--json':
+               options['json'] = value
+            elif a == '--script':
+               options['script'] = os.path.abspath(value)
+            else:
+               options['simulator'][simulator_values[a]] = float(value)
+         except ValueError:
+            print('Error: invalid value for %s: %s' % (a, value))
+            print(usage)
+            sys.exit(1)
+         i += 2
+      else:
+         print('Error: unknown argument or missing value: %s' % (a))
+         print(usage)
+         sys.exit(1)
+   return options
+
+if __name__ == '__main__':
+   options = arguments_parser(sys.argv[1:])
+   results = run_benchmark(options)
+   print_summary(results, options)
+   if options['json'] != None:
+      with open(options['json'], 'w') as f:
+         json.dump({'options': {k: v for k,v in options.items() if k != 'json'}, 'results': results}, f, indent=1, sort_keys=True)
+   if any(r['exit_code'] != 0 or r['fallback'] for r in results):
+      sys.exit(1)
@@ -0,0 +1,48 @@
+# ccdciel.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# JSON-RPC client used in place of ccdciel module installed with CCDciel when
+# scripts are run outside CCDciel against ccdciel_simulator.py.
+# Server port is taken from CCDCIEL_PORT environment variable, host from
+# CCDCIEL_HOST, by default localhost:3277 is used.
+#
+# List of changes:
+# [17-10-2026] Initial version, JSON-RPC client for simulator
+# ---------------------------------------------------------------------------- #
+#
+
+import http.client
+import itertools
+import json
+import os
+import threading
+
+request_ids = itertools.count(1) # JSON-RPC request identifiers
+connections = threading.local() # Persistent HTTP connection per thread
+
+# ccdciel - call CCDciel JSON-RPC method
+# @arguments
+# method - method name
+# params - optional method parameters
+#
+# @return JSON-RPC response with 'result' or 'error'
+def ccdciel(method, params=None):
+   request = {'jsonrpc': '2.0', 'method': method, 'id': next(request_ids)}
+   if params is not None:
+      request['params'] = params if isinstance(params, (list, dict)) else [params]
+   connection = getattr(connections, 'connection', None)
+   if connection is None:
+      host = os.environ.get('CCDCIEL_HOST', 'localhost')
+      port = int(os.environ.get('CCDCIEL_PORT', '3277'))
+      connection = http.client.HTTPConnection(host, port, timeout=600)
+      connections.connection = connection
+   try:
+      connection.request('POST', '/jsonrpc', json.dumps(request), {'Content-Type': 'application/json'})
+      return json.loads(connection.getresponse().read())
+   except (OSError, http.client.HTTPException):
+      connection.close()
+      connections.connection = None
+      raise
@@ -0,0 +1,398 @@
+# ccdciel_simulator.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Local stand-in for CCDciel JSON-RPC server with simulated devices
+# - focuser with limited speed, filter wheel with rotation time per slot,
+#   autofocus with duration and best focus depending on filter and temperature,
+#   camera cooler, focuser temperature sensor, telescope
+# - focuser moved by difference of filters offsets after filter change, like
+#   CCDciel does
+# - injected faults: stuck focuser or filter wheel, failed autofocus,
+#   disconnected devices, random JSON-RPC errors, latency of requests
+# - virtual clock mode: polled device jumps clock to the end of its move, so
+#   runs take no real time and simulated time is deterministic
+# - statistics of calls per method, HTTP requests and batches
+#
+# Scripts are run against simulator with ccdciel.py module from this directory
+# (see benchmark.py), port is provided by CCDCIEL_PORT environment variable.
+#
+# Usage:
+#   python3 ccdciel_simulator.py [--port <port, default 3277>] [--filters <number of filters, default 5>]
+#                                [--focuserspeed <steps/s>] [--slottime <s>] [--autofocustime <s>]
+#                                [--virtualclock] [--timescale <factor>] [--latency <s>]
+#                                [--fault <fault>]... [--errorrate <probability>] [--seed <seed>] [--verbose]
+#   faults: focuser_stuck, wheel_stuck, autofocus_fail, focuser_disconnected, wheel_disconnected
+#
+# For more information and reference of the available methods see:
+# https://www.ap-i.net/ccdciel/en/documentation/jsonrpc_reference
+#
+# List of changes:
+# [17-10-2026] Initial version, simulated focuser, filter wheel, autofocus and camera with virtual clock
+# [17-10-2026] Focuser moved by difference of filters offsets at the end of filter change
+# ---------------------------------------------------------------------------- #
+#
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import random
+import sys
+import threading
+import time
+
+FILTER_NAMES = ['L', 'R', 'G', 'B', 'Ha', 'OIII', 'SII', 'UV/IR', 'Dark', 'Clear', 'CLS', 'Dual', 'Quad', 'NIR', 'U', 'V'] # Names of simulated filters
+FAULTS = ('focuser_stuck', 'wheel_stuck', 'autofocus_fail', 'focuser_disconnected', 'wheel_disconnected') # Supported faults
+
+# SimulatorClock - real clock (optionally scaled) or virtual clock
+#
+# Virtual clock does not run, it jumps to the end of device operation when
+# device is polled or blocking operation (autofocus) is executed.
+class SimulatorClock:
+   def __init__(self, virtual=False, scale=1.0):
+      self.virtual = virtual # Virtual clock mode
+      self.scale = scale # Real clock speed-up factor
+      self.start = time.monotonic() # Real time of clock start
+      self.virtual_time = 0.0 # Current time of virtual clock
+
+   # now - current simulated time in seconds
+   def now(self):
+      if self.virtual:
+         return self.virtual_time
+      return (time.monotonic() - self.start) * self.scale
+
+   # advance_to - wait until simulated time, virtual clock jumps
+   def advance_to(self, simulated_time):
+      if self.virtual:
+         self.virtual_time = max(self.virtual_time, simulated_time)
+         return
+      remaining = (simulated_time - self.now()) / self.scale
+      if remaining > 0:
+         time.sleep(remaining)
+
+# Simulator - simulated devices and JSON-RPC methods of CCDciel
+class Simulator:
+   DEFAULT_FOCUSER_SPEED = 1000.0 # Focuser speed in steps per second
+   DEFAULT_SLOT_TIME = 1.0 # Filter wheel rotation time per slot in seconds
+   DEFAULT_WHEEL_SETTLE_TIME = 0.5 # Filter wheel settle time in seconds
+   DEFAULT_AUTOFOCUS_TIME = 30.0 # Autofocus duration in seconds
+   DEFAULT_BEST_FOCUS = 25000 # Best focus of first filter at 0C in focuser steps
+   FILTER_FOCUS_STEP = 37 # Best focus difference between neighbour filters in focuser steps
+   INITIAL_FOCUS_DISTANCE = 150 # Focuser starts near best focus of first filter, like focused telescope
+   STEPS_PER_DEGREE = -12.0 # Best focus shift with temperature in focuser steps per C
+   CAMERA_TIME_CONSTANT = 60.0 # Camera temperature time constant in seconds
+   VERSION = ['0.9.92', '3900', '0.9.92-3900'] # Simulated CCDciel version
+
+   def __init__(self, filters=5, focuser_speed=DEFAULT_FOCUSER_SPEED, slot_time=DEFAULT_SLOT_TIME, autofocus_time=DEFAULT_AUTOFOCUS_TIME,
+                virtual_clock=False, time_scale=1.0, faults=(), error_rate=0.0, latency=0.0, seed=None, temperature=10.0, verbose=False):
+      self.lock = threading.RLock() # Lock for devices state and statistics
+      self.clock = SimulatorClock(virtual_clock, time_scale) # Simulated time
+      self.filters = [FILTER_NAMES[i] if i < len(FILTER_NAMES) else 'F%d' % (i+1) for i in range(filters)] # Names of filters in wheel
+      self.focuser_speed = focuser_speed # Focuser speed in steps per second
+      self.slot_time = slot_time # Filter wheel rotation time per slot in seconds
+      self.autofocus_time = autofocus_time # Autofocus duration in seconds
+      self.faults = set(faults) # Injected faults
+      self.error_rate = error_rate # Probability of JSON-RPC error for device methods
+      self.latency = latency # Latency of every HTTP request in seconds
+      self.random = random.Random(seed) # Random numbers for injected errors
+      self.temperature = temperature # Ambient (focuser) temperature in C
+      self.verbose = verbose # Print LogMsg messages
+      position = self.best_focus(1) + self.INITIAL_FOCUS_DISTANCE
+      self.focuser_move = [position, position, 0.0, 0.0] # Focuser move: start position, target position, start time, end time
+      self.wheel_move = [1, 1, 0.0, 0.0] # Filter wheel move: start slot, target slot, start time, end time
+      self.offsets = {} # Filter name -> offset
+      self.offset_move = None # Focuser move by offsets after filter change: end time of filter change, steps, None - no move
+      self.camera = [self.temperature, self.temperature, 0.0] # Camera temperature: start temperature, setpoint, start time
+      self.reset_statistics()
+
+   # reset_statistics - forget calls statistics and start new simulated time measurement
+   def reset_statistics(self):
+      with self.lock:
+         self.calls = {} # Method -> number of calls
+         self.requests = 0 # Number of HTTP requests
+         self.batches = 0 # Number of batch requests
+         self.errors = 0 # Number of injected errors
+         self.log = [] # Messages from LogMsg
+         if self.clock.virtual:
+            self.clock.advance_to(max(self.focuser_move[3], self.wheel_move[3]))
+         self.start_time = self.clock.now() # Simulated time of statistics start
+
+   # statistics - get calls statistics
+   # Simulated time lasts until devices finish moves started by client.
+   # @return dictionary with calls per method, total calls, HTTP requests, batches, injected errors and simulated time
+   def statistics(self):
+      with self.lock:
+         end_time = max(self.clock.now(), self.focuser_move[3], self.wheel_move[3])
+         return {'calls': dict(self.calls), 'total_calls': sum(self.calls.values()), 'requests': self.requests, 'batches': self.batches,
+                 'errors': self.errors, 'simulated_time': end_time - self.start_time}
+
+   # best_focus - best focus position for filter at current temperature
+   def best_focus(self, slot):
+      return int(round(self.DEFAULT_BEST_FOCUS + self.FILTER_FOCUS_STEP * (slot - 1) + self.STEPS_PER_DEGREE * self.temperature))
+
+   # focuser_position - focuser position at current simulated time, polled focuser waits for end of move in virtual clock
+   def focuser_position(self):
+      start, target, start_time, end_time = self.focuser_move
+      if self.clock.virtual:
+         self.clock.advance_to(end_time)
+      now = self.clock.now()
+      if now >= end_time:
+         return target
+      distance = int((now - start_time) * self.focuser_speed)
+      return start + distance if target > start else start - distance
+
+   # wheel_slot - filter wheel slot at current simulated time, during rotation previous slot is reported
+   def wheel_slot(self):
+      start, target, start_time, end_time = self.wheel_move
+      if self.clock.virtual:
+         self.clock.advance_to(end_time)
+      return target if self.clock.now() >= end_time else start
+
+   # move_focuser - start focuser move
+   def move_focuser(self, position):
+      current = self.focuser_position()
+      now = self.clock.now()
+      if 'focuser_stuck' in self.faults:
+         self.focuser_move = [current, current, now, now]
+      else:
+         self.focuser_move = [current, position, now, now + abs(position - current) / self.focuser_speed]
+
+   # move_wheel - start filter wheel rotation, wheel rotates by shortest way
+   def move_wheel(self, slot):
+      current = self.wheel_slot()
+      now = self.clock.now()
+      if 'wheel_stuck' in self.faults:
+         self.wheel_move = [current, current, now, now]
+         return
+      distance = abs(slot - current)
+      distance = min(distance, len(self.filters) - distance)
+      duration = distance * self.slot_time + (self.DEFAULT_WHEEL_SETTLE_TIME if distance > 0 else 0.0)
+      self.wheel_move = [current, slot, now, now + duration]
+
+   # apply_offset_move - move focuser by difference of filters offsets when filter change ended
+   # Move starts when request is served after end of filter change, move requested by
+   # client during filter change is replaced by it like in CCDciel.
+   def apply_offset_move(self):
+      if self.offset_move is None or self.clock.now() < self.offset_move[0]:
+         return
+      steps = self.offset_move[1]
+      self.offset_move = None
+      self.move_focuser(self.focuser_move[1] + steps)
+
+   # camera_temperature - camera temperature approaching setpoint exponentially
+   def camera_temperature(self):
+      start, setpoint, start_time = self.camera
+      elapsed = self.clock.now() - start_time
+      return round(setpoint + (start - setpoint) * math.exp(-elapsed / self.CAMERA_TIME_CONSTANT), 1)
+
+   # autofocus - run autofocus, focuser ends in best focus for current filter
+   # @return autofocus result
+   def autofocus(self):
+      with self.lock:
+         end_time = self.clock.now() + self.autofocus_time
+         slot = self.wheel_slot()
+      # Blocking call, other requests are served during autofocus in real clock mode
+      self.clock.advance_to(end_time)
+      with self.lock:
+         if 'autofocus_fail' in self.faults:
+            return {'status': 'Autofocus failed'}
+         position = self.best_focus(slot)
+         self.focuser_move = [position, position, self.clock.now(), self.clock.now()]
+         return {'status': 'OK'}
+
+   # call - execute JSON-RPC method
+   # @arguments
+   # method - method name
+   # params - method parameters, list or single value
+   #
+   # @return result or raises SimulatorError
+   def call(self, method, params):
+      value = params[0] if isinstance(params, list) and len(params) > 0 else params
+      with self.lock:
+         self.calls[method] = self.calls.get(method, 0) + 1
+         if self.error_rate > 0 and method not in ('LogMsg', 'Simulator_statistics', 'Simulator_reset') and self.random.random() < self.error_rate:
+            self.errors += 1
+            raise SimulatorError(-32000, 'Injected error for %s' % (method))
+         self.apply_offset_move()
+      if method in ('AutomaticAutofocus', 'Autofocus'):
+         return self.autofocus()
+      with self.lock:
+         if method == 'LogMsg':
+            self.log.append(str(value))
+            if self.verbose:
+               print('LOG: %s' % (value))
+            return {'status': 'OK'}
+         if method == 'CCDciel_Version':
+            return list(self.VERSION)
+         if method == 'Focuser_connected':
+            return 'focuser_disconnected' not in self.faults
+         if method == 'Wheel_connected':
+            return 'wheel_disconnected' not in self.faults
+         if method in ('Camera_connected', 'Telescope_Connected'):
+            return True
+         if method == 'Telescope_Parked':
+            return False
+         if method == 'Wheel_GetfiltersName':
+            return list(self.filters)
+         if method == 'Wheel_getfilter':
+            return {'status': str(self.wheel_slot())}
+         if method == 'Wheel_setfilter':
+            slot = int(value)
+            if slot < 1 or slot > len(self.filters):
+               raise SimulatorError(-32602, 'Invalid filter index %d' % (slot))
+            current = self.filters[self.wheel_slot() - 1]
+            self.move_wheel(slot)
+            steps = self.offsets.get(self.filters[slot - 1], 0) - self.offsets.get(current, 0)
+            self.offset_move = [self.wheel_move[3], steps] if steps != 0 else None
+            return {'status': 'OK'}
+         if method == 'FocuserPosition':
+            return self.focuser_position()
+         if method == 'Focuser_setposition':
+            self.move_focuser(int(value))
+            return {'status': 'OK'}
+         if method == 'Set_FilterOffset':
+            if not isinstance(params, list) or len(params) < 2:
+               raise SimulatorError(-32602, 'Set_FilterOffset needs filter and offset')
+            self.offsets[params[0]] = int(params[1])
+            return {'status': 'OK'}
+         if method == 'FocuserTemp':
+            return self.temperature
+         if method == 'CcdTemp':
+            return self.camera_temperature()
+         if method == 'Ccd_settemperature':
+            self.camera = [self.camera_temperature(), float(value), self.clock.now()]
+            return {'status': 'OK'}
+         if method == 'Simulator_statistics':
+            return self.statistics()
+         if method == 'Simulator_reset':
+            self.reset_statistics()
+            return {'status': 'OK'}
+      raise SimulatorError(-32601, 'Method not found: %s' % (method))
+
+   # handle - handle JSON-RPC request or batch
+   # @return response object, list of responses or None for batch of notifications
+   def handle(self, request):
+      with self.lock:
+         self.requests += 1
+         if isinstance(request, list):
+            self.batches += 1
+      if self.latency > 0:
+         time.sleep(self.latency)
+      if isinstance(request, list):
+         if len(request) == 0:
+            return {'jsonrpc': '2.0', 'error': {'code': -32600, 'message': 'Invalid Request'}, 'id': None}
+         responses = [self.handle_single(r) for r in request]
+         return [r for r in responses if r is not None]
+      return self.handle_single(request)
+
+   # handle_single - handle one JSON-RPC request
+   def handle_single(self, request):
+      if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+         return {'jsonrpc': '2.0', 'error': {'code': -32600, 'message': 'Invalid Request'}, 'id': None}
+      request_id = request.get('id')
+      try:
+         return {'jsonrpc': '2.0', 'result': self.call(request['method'], request.get('params')), 'id': request_id}
+      except SimulatorError as e:
+         return {'jsonrpc': '2.0', 'error': {'code': e.code, 'message': e.message}, 'id': request_id}
+      except (TypeError, ValueError) as e:
+         return {'jsonrpc': '2.0', 'error': {'code': -32602, 'message': str(e)}, 'id': request_id}
+
+# SimulatorError - JSON-RPC error returned by simulator
+class SimulatorError(Exception):
+   def __init__(self, code, message):
+      super(SimulatorError, self).__init__(message)
+      self.code = code # JSON-RPC error code
+      self.message = message # JSON-RPC error message
+
+# SimulatorRequestHandler - HTTP handler of JSON-RPC requests posted to /jsonrpc
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+   protocol_version = 'HTTP/1.1' # Persistent connections like CCDciel
+
+   def do_POST(self):
+      length = int(self.headers.get('Content-Length', 0))
+      try:
+         request = json.loads(self.rfile.read(length))
+      except ValueError:
+         response = {'jsonrpc': '2.0', 'error': {'code': -32700, 'message': 'Parse error'}, 'id': None}
+      else:
+         response = self.server.simulator.handle(request)
+      body = json.dumps(response).encode('utf-8')
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+   def log_message(self, format, *args):
+      pass
+
+# start_server - start simulator server in background thread
+# @arguments
+# simulator - simulator object
+# port - TCP port, 0 - free port is selected
+# host - listen address
+#
+# @return server, port used by server
+def start_server(simulator, port=0, host='localhost'):
+   server = ThreadingHTTPServer((host, port), SimulatorRequestHandler)
+   server.daemon_threads = True
+   server.simulator = simulator
+   threading.Thread(target=server.serve_forever, daemon=True).start()
+   return server, server.server_address[1]
+
+# arguments_parser - parse simulator arguments
+# @return simulator options and port
+def arguments_parser(args):
+   options = {'faults': []}
+   port = 3277
+   usage = 'Usage: %s [--port <port>] [--filters <number>] [--focuserspeed <steps/s>] [--slottime <s>] [--autofocustime <s>] [--virtualclock] [--timescale <factor>] [--latency <s>] [--fault <%s>]... [--errorrate <probability>] [--seed <seed>] [--verbose]' % (sys.argv[0], '|'.join(FAULTS))
+   values = {'--filters': ('filters', int), '--focuserspeed': ('focuser_speed', float), '--slottime': ('slot_time', float),
+             '--autofocustime': ('autofocus_time', float), '--timescale': ('time_scale', float), '--latency': ('latency', float),
+             '--errorrate': ('error_rate', float), '--seed': ('seed', int), '--temperature': ('temperature', float)}
+   i = 0
+   while i < len(args):
+      a = args[i]
+      if a in ('--help', '-help'):
+         print(usage)
+         sys.exit(0)
+      elif a == '--virtualclock':
+         options['virtual_clock'] = True
+         i += 1
+      elif a == '--verbose':
+         options['verbose'] = True
+         i += 1
+      elif (a in values or a in ('--port', '--fault')) and i + 1 < len(args):
+         try:
+            if a == '--port':
+               port = int(args[i+1])
+            elif a == '--fault':
+               if args[i+1] not in FAULTS:
+                  raise ValueError(args[i+1])
+               options['faults'].append(args[i+1])
+            else:
+               options[values[a][0]] = values[a][1](args[i+1])
+         except ValueError:
+            print('Error: invalid value for %s: %s' % (a, args[i+1]))
+            print(usage)
+            sys.exit(1)
+         i += 2
+      else:
+         print('Error: unknown argument or missing value: %s' % (a))
+         print(usage)
+         sys.exit(1)
+   return options, port
+
+if __name__ == '__main__':
+   options, port = arguments_parser(sys.argv[1:])
+   simulator = Simulator(**options)
+   server = ThreadingHTTPServer(('localhost', port), SimulatorRequestHandler)
+   server.daemon_threads = True
+   server.simulator = simulator
+   print('CCDciel simulator listening on port %d, filters: %s' % (port, ', '.join(simulator.filters)))
+   try:
+      server.serve_forever()
+   except KeyboardInterrupt:
+      pass
+   print('Statistics: %s' % (json.dumps(simulator.statistics(), sort_keys=True)))
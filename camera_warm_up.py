@@ -13,35 +13,90 @@
 #
 # List of changes:
 # [21-11-2025] Initial version, simple camera warm up script to 20C
+# [17-10-2026] Camera temperature changed by thermal ramp with limited rate, warm up and cooldown,
+#              completion time predicted from fitted exponential model, ends when temperature is stable,
+#              needs ccdciel_rpc.py and ccdciel_thermal.py modules
+# [17-10-2026] Optional per-method RPC metrics (CCDCIEL_METRICS or --metrics <file>), needs ccdciel_rpc.py module
+# [17-10-2026] Logs buffered and send in batches by background thread, DEBUG messages off by default, optional
+#              rotating log file (CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel, --logfile), needs ccdciel_log.py module
+# [17-10-2026] Messages worded by ramp direction (warm up or cooldown), log is flushed before exit on errors
 # ---------------------------------------------------------------------------- #
 #
 
 from ccdciel import ccdciel
+from ccdciel_rpc import enable_metrics
+from ccdciel_log import enable_log_sink, flush_log
+from ccdciel_thermal import ThermalRamp
 import sys
-import time
+
+# Enable RPC metrics when CCDCIEL_METRICS or --metrics <file> is provided
+ccdciel = enable_metrics(ccdciel)
+
+# Buffer logs, DEBUG level and local log file are enabled by CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel <level>, --logfile <file>
+ccdciel = enable_log_sink(ccdciel)
+
+# GLOBAL VARIABLES
+target_temperature = 20.0 # Camera target temperature in C, argument --temperature, -t
+ramp_rate = ThermalRamp.DEFAULT_RATE # Setpoint rate in C per minute, 0 - target set at once, argument --rate, -r
+tolerance = ThermalRamp.DEFAULT_TOLERANCE # Tolerance of final temperature in C, argument --tolerance, -o
+max_time = None # Timeout in seconds, None - twice planned time, argument --maxtime, -x
+
+# Parse arguments: [--temperature|-t <C>] [--rate|-r <C/min>] [--tolerance|-o <C>] [--maxtime|-x <s>]
+args = sys.argv[1:]
+i = 0
+while i < len(args):
+   a = args[i]
+   if a in ('--temperature', '-t', '--rate', '-r', '--tolerance', '-o', '--maxtime', '-x') and i + 1 < len(args):
+      try:
+         value = float(args[i+1])
+      except ValueError:
+         ccdciel('LogMsg','Invalid value for %s, must be number: %s' %(a, args[i+1]))
+         flush_log()
+         sys.exit(1)
+      if a in ('--temperature', '-t'):
+         target_temperature = value
+      elif a in ('--rate', '-r'):
+         ramp_rate = value
+      elif a in ('--tolerance', '-o'):
+         tolerance = value
+      else:
+         max_time = value
+      i += 2
+   else:
+      ccdciel('LogMsg','Unknown argument or missing value: %s' %(a))
+      flush_log()
+      sys.exit(1)
 
 connected = (ccdciel('Camera_connected')['result'])
 if not connected :
    ccdciel('LogMsg','Camera is not connected!')
+   flush_log()
    sys.exit(1)
 
-# Warm up the camera, setting the temperature to 20 C
+# Warm up (or cool down) the camera by thermal ramp
 # TODO: could be improved by taken ambient temperature into account
-ccdciel('Ccd_settemperature',20)
-ccdciel('LogMsg','Warming up the camera to 20 C...')
-
-# Loop until the camera temperature reaches 20 C or 5 minutes have passed
-start_time = time.time()
-while True:
-    ct = ccdciel('CcdTemp')['result']
-    if ct >= 20:
-        break
-    if time.time() - start_time > 300:
-        ccdciel('LogMsg','Timeout reached while warming up the camera.')
-        break
-    ccdciel('LogMsg','Curent main camera temperature = %lf C' %(ct))
-    time.sleep(5)
+ramp = ThermalRamp(target_temperature, rate=ramp_rate, tolerance=tolerance, max_time=max_time, client=ccdciel)
+start_temperature = ramp.read_temperature()
+if start_temperature is None:
+   ccdciel('LogMsg','Can not read camera temperature!')
+   flush_log()
+   sys.exit(1)
+
+# Messages are worded by ramp direction
+if target_temperature >= start_temperature:
+   operation, operation_name = 'warming up', 'warm up'
+else:
+   operation, operation_name = 'cooling down', 'cooldown'
+ccdciel('LogMsg','%s the camera from %.1f C to %.1f C...' %(operation.capitalize(), start_temperature, target_temperature))
+status, ct, elapsed = ramp.run(log=lambda message: ccdciel('LogMsg', message))
 
 # Final temperature log
-ct = ccdciel('CcdTemp')['result']
-ccdciel('LogMsg','Camera warm up completed. Current temperature = %lf C' %(ct))
+if status == 'ERROR':
+   ccdciel('LogMsg','Can not read camera temperature!')
+   flush_log()
+   sys.exit(1)
+if status == 'TIMEOUT':
+   ccdciel('LogMsg','Timeout reached while %s the camera.' %(operation))
+elif status == 'STABLE':
+   ccdciel('LogMsg','Camera temperature is stable but can not reach %.1f C' %(target_temperature))
+ccdciel('LogMsg','Camera %s completed. Current temperature = %lf C (%.0fs, %d temperature reads)' %(operation_name, ct, elapsed, ramp.polls))
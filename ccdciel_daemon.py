@@ -0,0 +1,156 @@
+# ccdciel_daemon.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Module with local request socket shared by scripts which can run as daemon
+# - daemon address: Unix socket next to script or TCP port on localhost
+# - request server, requests are JSON objects in lines served one at a time
+# - client which sends request to daemon and waits for response
+#
+# Module is not a script, it must be installed as *.py file next to scripts
+# in CCDCiel directory (see Makefile target 'modules').
+#
+# List of changes:
+# [17-10-2026] Initial version, local request socket for daemon mode
+# [17-10-2026] Read of request and write of response limited by timeout, client which does not send request
+#              does not block daemon
+# ---------------------------------------------------------------------------- #
+#
+
+import json
+import os
+import socket
+
+DEFAULT_TCP_PORT = 3279 # TCP port on localhost used when Unix sockets are not available
+CONNECT_TIMEOUT = 1.0 # Time in seconds to wait for connection to daemon
+REQUEST_TIMEOUT = 5.0 # Time in seconds to wait for request line from client and to send response
+
+# daemon_address - get address of daemon
+# Address is taken from environment variable as path to Unix socket or
+# host:port, by default Unix socket is used if it is supported by system,
+# otherwise DEFAULT_TCP_PORT on localhost.
+# @arguments
+# socket_path - default path to Unix socket
+# variable - name of environment variable with address
+#
+# @return address, path to Unix socket or [host, port]
+def daemon_address(socket_path, variable='CCDCIEL_DAEMON'):
+   address = os.environ.get(variable)
+   if address:
+      host, separator, port = address.rpartition(':')
+      if separator and port.isdigit() and os.sep not in address:
+         return [host if host else 'localhost', int(port)]
+      return address
+   if hasattr(socket, 'AF_UNIX'):
+      return socket_path
+   return ['localhost', DEFAULT_TCP_PORT]
+
+# address_name - address in human readable form
+def address_name(address):
+   if isinstance(address, str):
+      return address
+   return '%s:%d' % (address[0], address[1])
+
+# open_socket - create socket for address
+def open_socket(address):
+   if isinstance(address, str):
+      return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+   return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+# send_request - send request to daemon and wait for response
+# @arguments
+# address - address of daemon, see daemon_address()
+# request - request object
+#
+# @return response object or None when daemon is not running
+def send_request(address, request):
+   sock = open_socket(address)
+   try:
+      sock.settimeout(CONNECT_TIMEOUT)
+      try:
+         sock.connect(address if isinstance(address, str) else tuple(address))
+      except OSError:
+         return None
+      # Request can take as long as autofocus of all filters
+      sock.settimeout(None)
+      stream = sock.makefile('rwb')
+      try:
+         stream.write((json.dumps(request) + '\n').encode('utf-8'))
+         stream.flush()
+         line = stream.readline()
+      except OSError as e:
+         return {'status': 1, 'error': 'connection to daemon lost: %s' % (str(e))}
+      finally:
+         stream.close()
+      if not line:
+         return {'status': 1, 'error': 'daemon closed connection without response'}
+      try:
+         return json.loads(line.decode('utf-8'))
+      except ValueError:
+         return {'status': 1, 'error': 'invalid response from daemon'}
+   finally:
+      sock.close()
+
+# RequestServer - server for requests send by send_request()
+#
+# Requests are served one at a time in order of connections, so devices are
+# never used by two requests at once. Request {'command': 'stop'} ends
+# serve(). Unix socket left by daemon which does not run is removed. Client
+# which does not send request line in REQUEST_TIMEOUT is disconnected.
+class RequestServer:
+   def __init__(self, address, handler):
+      self.address = address # Address of daemon, see daemon_address()
+      self.handler = handler # Function called with request object, returns response object
+      self.sock = None # Listening socket
+
+   # start - bind address and listen for connections
+   # raise OSError when address is used by other daemon or can not be bound
+   def start(self):
+      if isinstance(self.address, str) and os.path.exists(self.address):
+         if send_request(self.address, {'command': 'ping'}) is not None:
+            raise OSError('daemon already running on %s' % (self.address))
+         os.remove(self.address)
+      self.sock = open_socket(self.address)
+      if not isinstance(self.address, str):
+         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      self.sock.bind(self.address if isinstance(self.address, str) else tuple(self.address))
+      self.sock.listen(8)
+
+   # serve - serve requests until stop request
+   def serve(self):
+      while True:
+         connection, peer = self.sock.accept()
+         command = None # Command of request
+         try:
+            connection.settimeout(REQUEST_TIMEOUT)
+            stream = connection.makefile('rwb')
+            line = stream.readline()
+            try:
+               request = json.loads(line.decode('utf-8'))
+            except ValueError:
+               request = {}
+            command = request.get('command') if isinstance(request, dict) else None
+            if command in ('stop', 'ping'):
+               response = {'status': 0}
+            else:
+               response = self.handler(request)
+            stream.write((json.dumps(response) + '\n').encode('utf-8'))
+            stream.flush()
+            stream.close()
+         except OSError:
+            # Client gone or silent (socket.timeout), request has been served or dropped
+            pass
+         finally:
+            connection.close()
+         if command == 'stop':
+            return
+
+   # close - close listening socket and remove Unix socket
+   def close(self):
+      if self.sock is not None:
+         self.sock.close()
+         self.sock = None
+         if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
@@ -0,0 +1,243 @@
+# ccdciel_indi.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Module with INDI client shared by scripts which control devices by INDI
+# - local mirror of devices properties updated by INDI callbacks, reads do not
+#   need round trip to INDI server
+# - "device ready" and "property equals" conditions, blocking and awaitable
+# - connections reused by all INDI operations in one script run
+#
+# Module is not a script, it must be installed as *.py file next to scripts
+# in CCDCiel directory (see Makefile target 'modules_indi').
+#
+# Module needs installed pyindi_client
+# sudo apt-get install swig libz3-dev libcfitsio-dev libnova-dev
+# pip3 install --user --break-system-packages pyindi-client
+#
+# List of changes:
+# [17-10-2026] Initial version, INDI client with properties mirror and conditions
+# [17-10-2026] Mirror read by state_reported() under lock
+# [17-10-2026] Maximal time of mount move to HOME position shared by scripts (HOME_MAX_TIME)
+# ---------------------------------------------------------------------------- #
+#
+
+import PyIndi
+import asyncio
+import threading
+import time
+
+DEFAULT_INDI_PORT = 7625 # Default INDI server port
+HOME_MAX_TIME = 300 # Maximal time in seconds of iEQ mount move to HOME position, shared by scripts which send mount HOME
+clients = {} # (host, port) -> connected client
+clients_lock = threading.Lock() # Lock for clients
+
+# IndiClient - INDI client with local mirror of devices properties
+#
+# Every property is stored in mirror as dictionary with:
+#   'state' - property state (PyIndi.IPS_IDLE, IPS_OK, IPS_BUSY, IPS_ALERT)
+#   'values' - element name -> value (number value, switch state or text)
+#   'states' - set of states reported since clear_states()
+# Mirror is updated from INDI callbacks, every update wakes up waiting conditions.
+class IndiClient(PyIndi.BaseClient):
+   def __init__(self):
+      super(IndiClient, self).__init__()
+      self.condition = threading.Condition() # Notified when mirror is updated
+      self.devices = {} # Device name -> device
+      self.properties = {} # (device name, property name) -> property mirror
+      self.async_waiters = [] # Waiting coroutines: [predicate, future, loop]
+      self.connected = False # Connection to INDI server state
+   def newDevice(self, d):
+      with self.condition:
+         self.devices[d.getDeviceName()] = d
+         self.notify()
+   def newProperty(self, p):
+      vector = None
+      if p.getType() == PyIndi.INDI_NUMBER:
+         vector = p.getNumber()
+      elif p.getType() == PyIndi.INDI_SWITCH:
+         vector = p.getSwitch()
+      elif p.getType() == PyIndi.INDI_TEXT:
+         vector = p.getText()
+      with self.condition:
+         entry = self.properties.setdefault((p.getDeviceName(), p.getName()), {'state': None, 'values': {}, 'states': set()})
+         if vector != None:
+            self.update(entry, vector)
+         self.notify()
+   def removeProperty(self, p):
+      with self.condition:
+         self.properties.pop((p.getDeviceName(), p.getName()), None)
+         self.notify()
+   def newBLOB(self, bp):
+      pass
+   def newSwitch(self, svp):
+      with self.condition:
+         self.update(self.properties.setdefault((svp.device, svp.name), {'state': None, 'values': {}, 'states': set()}), svp)
+         self.notify()
+   def newNumber(self, nvp):
+      with self.condition:
+         self.update(self.properties.setdefault((nvp.device, nvp.name), {'state': None, 'values': {}, 'states': set()}), nvp)
+         self.notify()
+   def newText(self, tvp):
+      with self.condition:
+         self.update(self.properties.setdefault((tvp.device, tvp.name), {'state': None, 'values': {}, 'states': set()}), tvp)
+         self.notify()
+   def newLight(self, lvp):
+      pass
+   def newMessage(self, d, m):
+      pass
+   def serverConnected(self):
+      with self.condition:
+         self.connected = True
+         self.notify()
+   def serverDisconnected(self, code):
+      with self.condition:
+         self.connected = False
+         self.notify()
+
+   # update - copy state and elements values of vector property to mirror entry
+   def update(self, entry, vector):
+      entry['state'] = vector.s
+      entry['states'].add(vector.s)
+      for e in vector:
+         if hasattr(e, 'value'):
+            entry['values'][e.name] = e.value
+         elif hasattr(e, 'text'):
+            entry['values'][e.name] = e.text
+         else:
+            entry['values'][e.name] = e.s
+
+   # notify - wake up blocking and awaiting conditions, must be called with condition acquired
+   def notify(self):
+      self.condition.notify_all()
+      for w in self.async_waiters:
+         w[2].call_soon_threadsafe(self.check_async_waiter, w)
+
+   # check_async_waiter - resolve awaiting condition if predicate is true, runs in waiter event loop
+   def check_async_waiter(self, waiter):
+      if waiter[1].done():
+         return
+      with self.condition:
+         result = waiter[0]()
+      if result:
+         waiter[1].set_result(result)
+
+   # get_state - get property state from mirror
+   # @return property state or None if property is not known
+   def get_state(self, device_name, property_name):
+      with self.condition:
+         entry = self.properties.get((device_name, property_name))
+         return entry['state'] if entry != None else None
+
+   # get_value - get element value from mirror
+   # @return element value or None if property or element is not known
+   def get_value(self, device_name, property_name, element_name):
+      with self.condition:
+         entry = self.properties.get((device_name, property_name))
+         return entry['values'].get(element_name) if entry != None else None
+
+   # clear_states - forget states reported for property, see state_reported()
+   def clear_states(self, device_name, property_name):
+      with self.condition:
+         entry = self.properties.get((device_name, property_name))
+         if entry != None:
+            entry['states'].clear()
+
+   # state_reported - check if property reported state since clear_states()
+   def state_reported(self, device_name, property_name, state):
+      with self.condition:
+         entry = self.properties.get((device_name, property_name))
+         return entry != None and state in entry['states']
+
+   # device_ready - condition: device and its property are known
+   # @return predicate for wait_for() and wait_for_async()
+   def device_ready(self, device_name, property_name=None):
+      if property_name == None:
+         return lambda: self.devices.get(device_name)
+      return lambda: self.devices.get(device_name) if (device_name, property_name) in self.properties else None
+
+   # property_equals - condition: property state and/or element value are equal to expected
+   # @arguments
+   # states - expected property state or tuple of states, None - any state
+   # element_name, value - expected element value, None - any value
+   # @return predicate for wait_for() and wait_for_async()
+   def property_equals(self, device_name, property_name, states=None, element_name=None, value=None):
+      if states != None and not isinstance(states, (tuple, list)):
+         states = (states,)
+      def predicate():
+         entry = self.properties.get((device_name, property_name))
+         if entry == None:
+            return False
+         if states != None and entry['state'] not in states:
+            return False
+         if element_name != None and entry['values'].get(element_name) != value:
+            return False
+         return True
+      return predicate
+
+   # wait_for - wait until predicate is true, predicate is checked after every mirror update
+   # @arguments
+   # predicate - function without arguments called with mirror locked
+   # max_time - timeout in seconds
+   # @return predicate result or None on timeout
+   def wait_for(self, predicate, max_time):
+      deadline = time.monotonic() + max_time
+      with self.condition:
+         while True:
+            result = predicate()
+            if result:
+               return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+               return None
+            self.condition.wait(remaining)
+
+   # wait_for_async - awaitable version of wait_for()
+   # @return predicate result or None on timeout
+   async def wait_for_async(self, predicate, max_time):
+      loop = asyncio.get_running_loop()
+      waiter = [predicate, loop.create_future(), loop]
+      with self.condition:
+         result = predicate()
+         if result:
+            return result
+         self.async_waiters.append(waiter)
+      try:
+         return await asyncio.wait_for(waiter[1], max_time)
+      except asyncio.TimeoutError:
+         return None
+      finally:
+         with self.condition:
+            self.async_waiters.remove(waiter)
+
+   # wait_device - wait until device (and its property) is known
+   # @return device or None on timeout
+   def wait_device(self, device_name, max_time, property_name=None):
+      return self.wait_for(self.device_ready(device_name, property_name), max_time)
+
+# get_client - get connected INDI client, connection is reused by all callers in script run
+# @arguments
+# port - INDI server port
+# host - INDI server host
+#
+# @return connected client or None if INDI server is not reachable
+def get_client(port=DEFAULT_INDI_PORT, host="localhost"):
+   with clients_lock:
+      client = clients.get((host, port))
+      if client != None and client.isServerConnected():
+         return client
+      client = IndiClient()
+      client.setServer(host, port)
+      if not client.connectServer():
+         return None
+      clients[(host, port)] = client
+      return client
+
+# disconnect_clients - disconnect all INDI clients
+def disconnect_clients():
+   with clients_lock:
+      for client in clients.values():
+         client.disconnectServer()
+      clients.clear()
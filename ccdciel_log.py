@@ -0,0 +1,298 @@
+# ccdciel_log.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Module with buffered log sink shared by scripts
+# - LogMsg calls are filtered by level taken from message prefix ([DEBUG],
+#   [INFO], [WARNING], [ERROR], [CRITICAL ERROR]), DEBUG is off by default
+# - messages are buffered, repeated lines are coalesced and send to CCDciel
+#   in JSON-RPC batch requests by background thread, so logging does not add
+#   latency to polling loops
+# - optional mirror of log in local rotating file
+# - level and file selected by CCDCIEL_LOG_LEVEL and CCDCIEL_LOG_FILE or
+#   --loglevel <level> and --logfile <file>
+#
+# Module is not a script, it must be installed as *.py file next to scripts
+# in CCDCiel directory (see Makefile target 'modules').
+# For more information and reference of the available methods see:
+# https://www.ap-i.net/ccdciel/en/documentation/jsonrpc_reference
+#
+# List of changes:
+# [17-10-2026] Initial version, buffered log sink with levels, coalescing and rotating file
+# [17-10-2026] Buffered messages can be flushed by script while background thread runs
+# [17-10-2026] Level and file of log sink can be read and changed, daemon uses options of script which sent request
+# ---------------------------------------------------------------------------- #
+#
+
+from ccdciel import ccdciel
+from ccdciel_rpc import BatchClient
+import atexit
+import os
+import sys
+import threading
+import time
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50} # Log level name -> value
+PREFIXES = (('[DEBUG]', 10), ('[INFO]', 20), ('[WARNING]', 30), ('[ERROR]', 40), ('[CRITICAL ERROR]', 50), ('[CRITILAC ERROR]', 50)) # Message prefix -> level, messages without prefix are INFO
+
+# message_level - get level of message from its prefix
+# @arguments
+# message - log message
+#
+# @return level value
+def message_level(message):
+   for prefix,level in PREFIXES:
+      if message.startswith(prefix):
+         return level
+   return LEVELS['INFO']
+
+# RotatingFile - log file rotated when it grows over max_bytes
+#
+# File 'name' is renamed to 'name.1', 'name.1' to 'name.2' and so on, the
+# oldest of backups files is removed.
+class RotatingFile:
+   def __init__(self, path, max_bytes=1048576, backups=3):
+      self.path = path # Path to log file
+      self.max_bytes = max_bytes # Maximal size of file in bytes
+      self.backups = backups # Number of kept rotated files
+      self.file = None # Opened log file
+
+   # write - write lines to file, file is rotated before when it is too big
+   # @arguments
+   # lines - list of lines without new line character
+   def write(self, lines):
+      if self.file is None:
+         self.file = open(self.path, 'a')
+      if self.file.tell() >= self.max_bytes:
+         self.rotate()
+      self.file.write(''.join(line + '\n' for line in lines))
+      self.file.flush()
+
+   # rotate - rotate files and open new file
+   def rotate(self):
+      self.file.close()
+      for idx in range(self.backups - 1, 0, -1):
+         if os.path.exists('%s.%d' % (self.path, idx)):
+            os.replace('%s.%d' % (self.path, idx), '%s.%d' % (self.path, idx + 1))
+      if self.backups > 0:
+         os.replace(self.path, self.path + '.1')
+      else:
+         os.remove(self.path)
+      self.file = open(self.path, 'a')
+
+   # close - close file
+   def close(self):
+      if self.file is not None:
+         self.file.close()
+         self.file = None
+
+# LogSink - buffered, level-filtered log sink
+#
+# Object can be used in place of ccdciel() function by intercept(): LogMsg
+# calls are put in buffer and return at once, all other methods are passed to
+# CCDciel. Background thread sends buffered messages every FLUSH_INTERVAL in
+# one batch request, WARNING and higher levels wake it at once. The same
+# message repeated one after another is send once with number of repeats.
+# When buffer is full the oldest messages below WARNING are dropped. All
+# buffered messages are send by close(), called at exit of script.
+class LogSink:
+   FLUSH_INTERVAL = 0.5 # Time in seconds between batches
+   MAX_BATCH = 100 # Maximal number of messages in one batch
+   MAX_BUFFER = 2000 # Maximal number of buffered messages
+   CLOSE_TIMEOUT = 10.0 # Time in seconds to wait for background thread at close
+
+   def __init__(self, client=ccdciel, level=LEVELS['INFO'], file_path=None):
+      self.client = client # JSON-RPC client function
+      self.level = level # Minimal level of logged messages
+      self.batch = BatchClient(client) # Client for sending messages as batch requests
+      self.file = RotatingFile(file_path) if file_path else None # Local mirror of log, None - disabled
+      self.buffer = [] # [message, level, time, number of repeats]
+      self.condition = threading.Condition() # Protects buffer, wakes background thread
+      self.send_lock = threading.RLock() # Keeps order of batches send by background thread and flush()
+      self.thread = None # Background thread, started with first message
+      self.closing = False # Sink is closed, background thread ends
+      self.urgent = False # Message with WARNING or higher level is buffered
+      self.dropped = 0 # Number of messages dropped when buffer was full
+
+   # log - put message in buffer, message below level is ignored
+   # @arguments
+   # message - log message
+   # level - message level, None - level taken from message prefix
+   def log(self, message, level=None):
+      message = str(message)
+      if level is None:
+         level = message_level(message)
+      if level < self.level:
+         return
+      with self.condition:
+         if len(self.buffer) > 0 and self.buffer[-1][0] == message:
+            self.buffer[-1][3] += 1
+            return
+         if len(self.buffer) >= self.MAX_BUFFER:
+            self.drop()
+         self.buffer.append([message, level, time.time(), 1])
+         if level >= LEVELS['WARNING']:
+            self.urgent = True
+            self.condition.notify()
+         if self.thread is None and not self.closing:
+            self.thread = threading.Thread(target=self.run, name='LogSink', daemon=True)
+            self.thread.start()
+
+   # drop - drop the oldest message below WARNING, or the oldest message
+   def drop(self):
+      for idx,item in enumerate(self.buffer):
+         if item[1] < LEVELS['WARNING']:
+            del self.buffer[idx]
+            self.dropped += 1
+            return
+      del self.buffer[0]
+      self.dropped += 1
+
+   # intercept - wrap client, LogMsg calls are buffered by sink
+   # @arguments
+   # client - JSON-RPC client function like ccdciel()
+   #
+   # @return client function
+   def intercept(self, client):
+      def intercepted(method, params=None):
+         if method == 'LogMsg':
+            self.log(params)
+            return {'result': {'status': 'OK'}}
+         return client(method) if params is None else client(method, params)
+      return intercepted
+
+   # take - take messages for next batch from buffer
+   # @return list of messages
+   def take(self):
+      with self.condition:
+         items = self.buffer[:self.MAX_BATCH]
+         del self.buffer[:self.MAX_BATCH]
+         if self.dropped > 0:
+            items.insert(0, ['[WARNING] %d log messages dropped, log buffer full' % (self.dropped), LEVELS['WARNING'], time.time(), 1])
+            self.dropped = 0
+         if len(self.buffer) == 0:
+            self.urgent = False
+         return items
+
+   # send - send messages to CCDciel in one batch and to log file
+   # @arguments
+   # items - list of buffered messages
+   def send(self, items):
+      messages = [item[0] if item[3] == 1 else '%s (repeated %d times)' % (item[0], item[3]) for item in items]
+      for message in messages:
+         self.batch.queue('LogMsg', message)
+      try:
+         self.batch.flush()
+      except Exception as e:
+         sys.stderr.write('Can not send log to CCDciel: %s\n' % (str(e)))
+      if self.file is not None:
+         names = dict((v, k) for k,v in LEVELS.items())
+         try:
+            self.file.write(['%s.%03d %-8s %s' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(item[2])), int(item[2] * 1000) % 1000, names.get(item[1], 'INFO'), messages[idx]) for idx,item in enumerate(items)])
+         except OSError as e:
+            sys.stderr.write('Can not write log file %s: %s\n' % (self.file.path, str(e)))
+            self.file = None
+
+   # run - background thread, send buffered messages in batches
+   def run(self):
+      while True:
+         with self.condition:
+            if not self.urgent and not self.closing:
+               self.condition.wait(self.FLUSH_INTERVAL)
+            if len(self.buffer) == 0 and self.dropped == 0:
+               if self.closing:
+                  return
+               continue
+         with self.send_lock:
+            self.send(self.take())
+
+   # flush - send all buffered messages now
+   def flush(self):
+      with self.send_lock:
+         while True:
+            items = self.take()
+            if len(items) == 0:
+               return
+            self.send(items)
+
+   # configure - change level and log file, buffered messages are send before change
+   # @arguments
+   # level - minimal level of logged messages
+   # file_path - path to log file, None - no log file
+   def configure(self, level, file_path):
+      with self.send_lock:
+         self.flush()
+         self.level = level
+         if file_path != (self.file.path if self.file is not None else None):
+            if self.file is not None:
+               self.file.close()
+            self.file = RotatingFile(file_path) if file_path else None
+
+   # close - send all buffered messages and stop background thread
+   def close(self):
+      with self.condition:
+         self.closing = True
+         self.condition.notify()
+      if self.thread is not None:
+         self.thread.join(self.CLOSE_TIMEOUT)
+      self.flush()
+      self.batch.close()
+      if self.file is not None:
+         self.file.close()
+
+log_sink = None # Log sink of current run, None - not enabled
+
+# enable_log_sink - enable buffered log sink, level is taken from CCDCIEL_LOG_LEVEL
+# environment variable or '--loglevel <level>' argument (DEBUG, INFO, WARNING,
+# ERROR, CRITICAL, default INFO), local log file from CCDCIEL_LOG_FILE or
+# '--logfile <file>'. Arguments are removed from sys.argv so scripts parse
+# their own arguments as before. Buffered messages are send at exit of script.
+# @arguments
+# client - JSON-RPC client function like ccdciel()
+#
+# @return client with buffered LogMsg calls
+def enable_log_sink(client=ccdciel):
+   global log_sink
+   options = {'--loglevel': os.environ.get('CCDCIEL_LOG_LEVEL', 'INFO'), '--logfile': os.environ.get('CCDCIEL_LOG_FILE')}
+   for option in options:
+      if option in sys.argv[1:]:
+         ida = sys.argv.index(option, 1)
+         if ida + 1 < len(sys.argv):
+            options[option] = sys.argv[ida+1]
+            del sys.argv[ida:ida+2]
+         else:
+            del sys.argv[ida]
+   level = LEVELS.get(str(options['--loglevel']).upper(), LEVELS['INFO'])
+   log_sink = LogSink(client, level, options['--logfile'])
+   atexit.register(log_sink.close)
+   if str(options['--loglevel']).upper() not in LEVELS:
+      log_sink.log('[WARNING] Unknown log level %s, INFO is used' % (options['--loglevel']))
+   return log_sink.intercept(client)
+
+# flush_log - send all messages buffered by log sink now
+def flush_log():
+   if log_sink is not None:
+      log_sink.flush()
+
+# log_options - get level and file of log sink
+# @return level name and path to log file (None - no log file), None when log sink is not enabled
+def log_options():
+   if log_sink is None:
+      return None
+   names = dict((v, k) for k,v in LEVELS.items())
+   return [names.get(log_sink.level, 'INFO'), log_sink.file.path if log_sink.file is not None else None]
+
+# set_log_options - change level and file of log sink, buffered messages are send before change
+# @arguments
+# level - level name (DEBUG, INFO, WARNING, ERROR, CRITICAL), unknown level - INFO
+# file_path - path to log file, None - no log file
+#
+# @return previous level name and path to log file, None when log sink is not enabled
+def set_log_options(level, file_path):
+   previous = log_options()
+   if log_sink is None:
+      return previous
+   log_sink.configure(LEVELS.get(str(level).upper(), LEVELS['INFO']), file_path)
+   return previous
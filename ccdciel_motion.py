@@ -0,0 +1,290 @@
+# ccdciel_motion.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Module with focuser and filter wheel motion helpers shared by scripts
+# - kinematics model learned from recorded moves, used for moves timeouts
+#   and poll schedules
+# - planner of visit order which minimises total cost of moves
+# - concurrent executor for independent moves of devices
+#
+# Module is not a script, it must be installed as *.py file next to scripts
+# in CCDCiel directory (see Makefile target 'modules').
+#
+# List of changes:
+# [17-10-2026] Initial version, focuser and filter wheel kinematics model
+# [17-10-2026] Recorded moves stored by shared database connection with writers lock
+# [17-10-2026] Added visit order planner and moves time estimation with default speeds
+# [17-10-2026] Added concurrent executor for filter wheel and focuser moves
+# ---------------------------------------------------------------------------- #
+#
+
+from focuser_position_database import WriterLock, get_database
+from concurrent.futures import ThreadPoolExecutor, wait
+import sqlite3
+import time
+
+# KinematicsModel - focuser and filter wheel kinematics learned from recorded moves
+#
+# Duration of every move is recorded with distance (focuser steps or filter
+# wheel slots) in 'device_moves' table. Model fits for each device:
+#   duration = settle_time + distance * time_per_unit
+# where time_per_unit is inverse of focuser speed (steps per second) or
+# rotation time per filter wheel slot. Until enough moves are recorded
+# default timeouts are used.
+class KinematicsModel:
+   DEVICES = ('focuser', 'wheel') # Supported devices
+   DEFAULT_MAX_TIME = {'focuser': [120,240], 'wheel': [30,60]} # Default max operation time [normal,restore]
+   DEFAULT_TIME_PER_UNIT = {'focuser': 0.002, 'wheel': 1.0} # Time per focuser step or filter wheel slot used for estimations when model is not fitted
+   MIN_SAMPLES = 5 # Minimal number of recorded moves to use fitted model
+   FIT_SAMPLES = 100 # Number of latest moves used to fit model
+   KEEP_SAMPLES = 1000 # Number of latest moves kept in database for each device
+   SAFETY_FACTOR = 2.0 # Timeout is expected time multiplied by this factor
+   SAFETY_MARGIN = 5.0 # and increased by this margin in seconds
+   MIN_MAX_TIME = 10.0 # Minimal timeout in seconds
+   SAVE_LOCK_TIMEOUT = 0.5 # Recorded moves are not stored when other writer holds database longer
+
+   def __init__(self, db_path):
+      self.db_path = db_path # Path to database file
+      self.fitted = {} # Device -> [settle time, time per unit, number of samples]
+      self.pending = [] # Recorded moves not stored in database yet
+
+   # load - read recorded moves from database and fit model
+   # @return status
+   # 0 - success
+   # 31 - can not open database
+   def load(self):
+      try:
+         conn = get_database(self.db_path)
+         self.create_table(conn.cursor())
+         conn.commit()
+         for device in self.DEVICES:
+            rows = conn.execute('SELECT distance, duration FROM device_moves WHERE device = ? ORDER BY timestamp DESC LIMIT ?', (device, self.FIT_SAMPLES)).fetchall()
+            self.fit(device, rows)
+      except sqlite3.Error:
+         return 31
+      return 0
+
+   # create_table - create table for recorded moves if it does not exist
+   def create_table(self, cursor):
+      cursor.execute('''CREATE TABLE IF NOT EXISTS device_moves (
+                        timestamp REAL,
+                        device TEXT,
+                        distance INTEGER,
+                        duration REAL
+                     )''')
+      cursor.execute('CREATE INDEX IF NOT EXISTS device_moves_device_timestamp ON device_moves (device, timestamp)')
+
+   # fit - fit model for device using least squares
+   # @arguments
+   # device - 'focuser' or 'wheel'
+   # rows - list of [distance, duration]
+   def fit(self, device, rows):
+      rows = [r for r in rows if r[0] > 0 and r[1] >= 0]
+      if len(rows) < self.MIN_SAMPLES:
+         self.fitted.pop(device, None)
+         return
+      n = float(len(rows))
+      mean_x = sum(r[0] for r in rows) / n
+      mean_y = sum(r[1] for r in rows) / n
+      var_x = sum((r[0] - mean_x) ** 2 for r in rows)
+      cov_xy = sum((r[0] - mean_x) * (r[1] - mean_y) for r in rows)
+      if var_x > 0 and cov_xy > 0:
+         time_per_unit = cov_xy / var_x
+         settle_time = max(0.0, mean_y - time_per_unit * mean_x)
+      else:
+         # All moves with the same distance, no settle time can be separated
+         time_per_unit = mean_y / mean_x
+         settle_time = 0.0
+      self.fitted[device] = [settle_time, time_per_unit, len(rows)]
+
+   # record - record finished move, moves are stored in database by save()
+   # @arguments
+   # device - 'focuser' or 'wheel'
+   # distance - move distance in focuser steps or filter wheel slots
+   # duration - move duration in seconds
+   def record(self, device, distance, duration):
+      if distance > 0:
+         self.pending.append([time.time(), device, int(distance), float(duration)])
+
+   # save - store recorded moves in database in one transaction
+   # Script never waits long for other writer only to store recorded moves.
+   # @return status
+   # 0 - success
+   # 31 - can not open database
+   def save(self):
+      if len(self.pending) == 0:
+         return 0
+      try:
+         conn = get_database(self.db_path)
+         with WriterLock(self.db_path, self.SAVE_LOCK_TIMEOUT), conn:
+            self.create_table(conn.cursor())
+            conn.executemany('INSERT INTO device_moves (timestamp, device, distance, duration) VALUES (?, ?, ?, ?)', self.pending)
+            for device in self.DEVICES:
+               conn.execute('DELETE FROM device_moves WHERE device = ? AND timestamp < (SELECT timestamp FROM device_moves WHERE device = ? ORDER BY timestamp DESC LIMIT 1 OFFSET ?)', (device, device, self.KEEP_SAMPLES-1))
+      except sqlite3.Error:
+         return 31
+      self.pending = []
+      return 0
+
+   # expected_time - expected move duration
+   # @arguments
+   # device - 'focuser' or 'wheel'
+   # distance - move distance in focuser steps or filter wheel slots
+   #
+   # @return expected time in seconds or None if model is not fitted for device
+   def expected_time(self, device, distance):
+      if device not in self.fitted:
+         return None
+      return self.fitted[device][0] + abs(distance) * self.fitted[device][1]
+
+   # estimate_time - estimated move duration, default speed is used when model is not fitted
+   # @arguments
+   # device - 'focuser' or 'wheel'
+   # distance - move distance in focuser steps or filter wheel slots
+   #
+   # @return estimated time in seconds
+   def estimate_time(self, device, distance):
+      if distance == 0:
+         return 0.0
+      expected = self.expected_time(device, distance)
+      if expected is None:
+         return abs(distance) * self.DEFAULT_TIME_PER_UNIT[device]
+      return expected
+
+   # max_time - timeout for move
+   # @arguments
+   # device - 'focuser' or 'wheel'
+   # distance - move distance in focuser steps or filter wheel slots
+   # restore - 0 - normal operation, 1 - restore operation
+   #
+   # @return timeout in seconds
+   def max_time(self, device, distance, restore=0):
+      expected = self.expected_time(device, distance)
+      if expected is None:
+         return self.DEFAULT_MAX_TIME[device][restore]
+      max_time = max(self.MIN_MAX_TIME, expected * self.SAFETY_FACTOR + self.SAFETY_MARGIN)
+      if restore == 1:
+         max_time = max_time * 2
+      return max_time
+
+   # description - describe fitted model for log
+   # @return text with model parameters
+   def description(self):
+      text = []
+      if 'focuser' in self.fitted:
+         m = self.fitted['focuser']
+         text.append('focuser %.1f steps/s settle %.1fs (%d moves)' % (1.0/m[1] if m[1] > 0 else 0.0, m[0], m[2]))
+      else:
+         text.append('focuser not fitted')
+      if 'wheel' in self.fitted:
+         m = self.fitted['wheel']
+         text.append('filter wheel %.2fs per slot settle %.1fs (%d moves)' % (m[1], m[0], m[2]))
+      else:
+         text.append('filter wheel not fitted')
+      return ', '.join(text)
+
+# VISIT_ORDER_EXACT_LIMIT - maximal number of nodes for which exact visit order is calculated
+VISIT_ORDER_EXACT_LIMIT = 12
+
+# path_cost - total cost of visiting nodes in selected order
+# @arguments
+# order - list of nodes in visit order
+# cost - function cost(a, b) of move from node a to node b
+# start - start node
+# end - end node, None - path ends at last visited node
+#
+# @return total cost
+def path_cost(order, cost, start, end=None):
+   total = 0.0
+   previous = start
+   for node in order:
+      total += cost(previous, node)
+      previous = node
+   if end is not None:
+      total += cost(previous, end)
+   return total
+
+# plan_visit_order - order visits of nodes to minimise total cost (travelling salesman path)
+# For up to VISIT_ORDER_EXACT_LIMIT nodes exact order is calculated by dynamic
+# programming (Held-Karp), for more nodes nearest neighbour order is improved by 2-opt.
+# @arguments
+# nodes - list of nodes to visit
+# cost - function cost(a, b) of move from node a to node b
+# start - start node
+# end - end node, None - path ends at last visited node
+#
+# @return list of nodes in visit order
+def plan_visit_order(nodes, cost, start, end=None):
+   nodes = list(nodes)
+   n = len(nodes)
+   if n <= 1:
+      return nodes
+   if n <= VISIT_ORDER_EXACT_LIMIT:
+      # best[mask][i] - minimal cost of visiting nodes in mask starting from start and ending in node i
+      best = [[None] * n for _ in range(1 << n)]
+      parent = [[None] * n for _ in range(1 << n)]
+      for i in range(n):
+         best[1 << i][i] = cost(start, nodes[i])
+      for mask in range(1, 1 << n):
+         for i in range(n):
+            current = best[mask][i]
+            if current is None:
+               continue
+            for j in range(n):
+               if mask & (1 << j):
+                  continue
+               next_mask = mask | (1 << j)
+               candidate = current + cost(nodes[i], nodes[j])
+               if best[next_mask][j] is None or candidate < best[next_mask][j]:
+                  best[next_mask][j] = candidate
+                  parent[next_mask][j] = i
+      full = (1 << n) - 1
+      last = min(range(n), key=lambda i: best[full][i] + (cost(nodes[i], end) if end is not None else 0.0))
+      order = []
+      mask = full
+      while last is not None:
+         order.append(nodes[last])
+         mask, last = mask & ~(1 << last), parent[mask][last]
+      order.reverse()
+      return order
+
+   # Nearest neighbour order
+   order = []
+   remaining = list(nodes)
+   previous = start
+   while len(remaining) > 0:
+      nearest = min(remaining, key=lambda node: cost(previous, node))
+      remaining.remove(nearest)
+      order.append(nearest)
+      previous = nearest
+   # 2-opt improvement, cost function does not have to be symmetric so whole path is evaluated
+   improved = True
+   order_cost = path_cost(order, cost, start, end)
+   while improved:
+      improved = False
+      for i in range(n - 1):
+         for j in range(i + 1, n):
+            candidate = order[:i] + order[i:j+1][::-1] + order[j+1:]
+            candidate_cost = path_cost(candidate, cost, start, end)
+            if candidate_cost < order_cost:
+               order, order_cost, improved = candidate, candidate_cost, True
+   return order
+
+# run_concurrently - run independent operations (e.g. moves of different devices) at the same time
+# Every operation runs in own thread with own deadline and restore procedure. Function
+# waits until all operations are finished, then exception raised by any operation
+# (also SystemExit raised by exit() on critical error) is raised again.
+# @arguments
+# operations - list of functions without arguments
+#
+# @return list of results of operations in the same order
+def run_concurrently(operations):
+   if len(operations) == 1:
+      return [operations[0]()]
+   with ThreadPoolExecutor(max_workers=len(operations)) as executor:
+      futures = [executor.submit(operation) for operation in operations]
+      wait(futures)
+   return [future.result() for future in futures]
@@ -0,0 +1,507 @@
+# ccdciel_rpc.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Module with helpers shared by scripts which use the CCDciel JSON-RPC interface
+# - device metadata cache in front of ccdciel() calls
+# - batched JSON-RPC dispatch for bursts of calls (offsets, logs)
+# - wait engine for focuser and filter wheel moves
+# - per-method metrics of JSON-RPC calls (counts, latency histograms, errors,
+#   payload sizes) enabled by CCDCIEL_METRICS or --metrics <file>
+#
+# Module is not a script, it must be installed as *.py file next to scripts
+# in CCDCiel directory (see Makefile target 'modules').
+# For more information and reference of the available methods see:
+# https://www.ap-i.net/ccdciel/en/documentation/jsonrpc_reference
+#
+# List of changes:
+# [17-10-2026] Initial version, device metadata cache
+# [17-10-2026] Added batched JSON-RPC dispatch with fallback to sequence of calls
+# [17-10-2026] Added deadline based wait engine with adaptive polling
+# [17-10-2026] Wait engine can follow expected move duration from kinematics model
+# [17-10-2026] Added per-method metrics of JSON-RPC calls
+# ---------------------------------------------------------------------------- #
+#
+
+from ccdciel import ccdciel
+import atexit
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+
+# ccdciel_address - get host and port of CCDciel JSON-RPC server
+# Port is taken from CCDCIEL_PORT environment variable like in ccdciel module,
+# host from CCDCIEL_HOST, by default localhost:3277 is used.
+# @return host, port
+def ccdciel_address():
+   host = os.environ.get('CCDCIEL_HOST', 'localhost')
+   try:
+      port = int(os.environ.get('CCDCIEL_PORT', '3277'))
+   except ValueError:
+      port = 3277
+   return host, port
+
+# DeviceCache - per-run cache of static device metadata
+#
+# Object can be used in place of ccdciel() function, methods listed in
+# STATIC_METHODS are send to CCDciel only once per run, all other methods
+# are passed to CCDciel without caching.
+# Cache must be invalidated by invalidate() when filter wheel is reconfigured.
+class DeviceCache:
+   # Methods which result does not change during script run
+   STATIC_METHODS = ('CCDciel_Version', 'Wheel_GetfiltersName')
+
+   def __init__(self, client=ccdciel):
+      self.client = client # JSON-RPC client function
+      self.hits = 0 # Number of requests served from cache
+      self.misses = 0 # Number of requests send to CCDciel
+      self.entries = {} # Cached responses and derived values
+      self.filters_index = None # Filter name -> slot index (1..N) map
+
+   # __call__ - call CCDciel method, result of static methods is cached
+   # @arguments
+   # method - JSON-RPC method name
+   # params - optional method parameters
+   #
+   # @return response from CCDciel like from ccdciel() function
+   def __call__(self, method, params=None):
+      if method not in self.STATIC_METHODS or params is not None:
+         if params is None:
+            return self.client(method)
+         return self.client(method, params)
+      return self.memoize(method, lambda: self.client(method))
+
+   # memoize - return cached value for key or compute it by function
+   # @arguments
+   # key - cache key
+   # function - function without arguments which computes value
+   #
+   # @return cached or computed value
+   def memoize(self, key, function):
+      if key in self.entries:
+         self.hits += 1
+         return self.entries[key]
+      self.misses += 1
+      value = function()
+      self.entries[key] = value
+      return value
+
+   # invalidate - remove entries from cache
+   # @arguments
+   # key - cache key to remove, None remove all entries
+   def invalidate(self, key=None):
+      if key is None:
+         self.entries.clear()
+         self.filters_index = None
+         return
+      self.entries.pop(key, None)
+      if key == 'Wheel_GetfiltersName':
+         self.filters_index = None
+
+   # filters_names - get list of filters in filter wheel
+   # @return list of filters names
+   def filters_names(self):
+      return self('Wheel_GetfiltersName')['result']
+
+   # filter_index - get slot index of filter in filter wheel
+   # @arguments
+   # filter_name - filter name
+   #
+   # @return filter slot index (1..N) or 0 if filter not found
+   def filter_index(self, filter_name):
+      for attempt in range(2):
+         list_of_filters = self.filters_names()
+         if self.filters_index is None:
+            self.filters_index = {}
+            for idf,f in enumerate(list_of_filters):
+               self.filters_index.setdefault(f, idf+1)
+         if filter_name in self.filters_index:
+            return self.filters_index[filter_name]
+         # Filter not found, filter wheel could be reconfigured so read list once again
+         if attempt == 0:
+            self.invalidate('Wheel_GetfiltersName')
+      return 0
+
+   # filter_name - get name of filter in selected slot
+   # @arguments
+   # filter_index - filter slot index (1..N)
+   #
+   # @return filter name or None if slot not exist
+   def filter_name(self, filter_index):
+      list_of_filters = self.filters_names()
+      if 1 <= filter_index <= len(list_of_filters):
+         return list_of_filters[filter_index-1]
+      return None
+
+   # version - get CCDciel version
+   # @return main version, short revision, full revision stored in array
+   def version(self):
+      return self('CCDciel_Version')['result']
+
+   # log_statistics - log cache hits and misses
+   def log_statistics(self):
+      self.client('LogMsg', '[INFO] Device cache hits: %d misses: %d' % (self.hits, self.misses))
+
+# BatchClient - queue CCDciel calls and send them together
+#
+# Queued calls are send as one JSON-RPC 2.0 batch request by flush(). When
+# CCDciel does not accept batch request the calls are send one after another
+# over single HTTP connection, if it is not possible ccdciel() function is
+# used for every call. Support for batch requests is checked only once.
+class BatchClient:
+   def __init__(self, client=ccdciel, address=None):
+      self.client = client # JSON-RPC client function used as last resort
+      self.address = address if address is not None else ccdciel_address() # Host and port of JSON-RPC server
+      self.calls = [] # Queued calls [method, params]
+      self.batch_supported = None # None - unknown, True - supported, False - not supported
+      self.connection = None # Persistent HTTP connection
+      self.http_available = True # False when direct HTTP connection to CCDciel fails
+
+   # queue - add call to queue
+   # @arguments
+   # method - JSON-RPC method name
+   # params - optional method parameters
+   def queue(self, method, params=None):
+      self.calls.append([method, params])
+
+   # flush - send all queued calls
+   # @return list of responses in order of queued calls, every response like from ccdciel() function
+   def flush(self):
+      calls = self.calls
+      self.calls = []
+      if len(calls) == 0:
+         return []
+
+      responses = None
+      if self.batch_supported != False and self.http_available and len(calls) > 1:
+         responses = self.send_batch(calls)
+      if responses is None:
+         responses = self.send_sequence(calls)
+      return responses
+
+   # request - build JSON-RPC 2.0 request object
+   def request(self, request_id, method, params):
+      request = {'jsonrpc': '2.0', 'method': method, 'id': request_id}
+      if params is not None:
+         request['params'] = params if isinstance(params, (list, dict)) else [params]
+      return request
+
+   # post - send JSON payload to CCDciel over persistent connection
+   # Request is recorded in RPC metrics under method name, batch as 'batch'.
+   # @return decoded JSON response
+   def post(self, payload):
+      if self.connection is None:
+         self.connection = http.client.HTTPConnection(self.address[0], self.address[1], timeout=60)
+      request = json.dumps(payload)
+      method = payload['method'] if isinstance(payload, dict) else 'batch'
+      start = time.perf_counter()
+      try:
+         self.connection.request('POST', '/jsonrpc', request, {'Content-Type': 'application/json'})
+         response = self.connection.getresponse()
+         body = response.read()
+      except (OSError, http.client.HTTPException):
+         self.close()
+         if metrics != None:
+            metrics.record(method, time.perf_counter() - start, True, len(request), 0)
+         raise
+      if metrics != None:
+         metrics.record(method, time.perf_counter() - start, response.status != 200, len(request), len(body))
+      if response.status != 200:
+         raise http.client.HTTPException('HTTP status %d' % (response.status))
+      return json.loads(body)
+
+   # send_batch - send calls as one batch request
+   # @return list of responses or None if batch is not supported
+   def send_batch(self, calls):
+      payload = [self.request(idc+1, c[0], c[1]) for idc,c in enumerate(calls)]
+      try:
+         answer = self.post(payload)
+      except OSError:
+         # CCDciel not reachable directly, ccdciel() function will be used
+         self.http_available = False
+         return None
+      except (ValueError, http.client.HTTPException):
+         self.batch_supported = False
+         return None
+      if not isinstance(answer, list):
+         # Server reject batch request, nothing has been executed
+         self.batch_supported = False
+         return None
+      self.batch_supported = True
+      answers_by_id = {}
+      for a in answer:
+         if isinstance(a, dict):
+            answers_by_id[a.get('id')] = a
+      responses = []
+      for idc,c in enumerate(calls):
+         responses.append(answers_by_id.get(idc+1, {'error': {'code': -32603, 'message': 'No response for %s in batch' % (c[0])}}))
+      return responses
+
+   # send_sequence - send calls one after another
+   # @return list of responses
+   def send_sequence(self, calls):
+      responses = []
+      for idc,c in enumerate(calls):
+         response = None
+         if self.http_available:
+            try:
+               response = self.post(self.request(idc+1, c[0], c[1]))
+            except (OSError, ValueError, http.client.HTTPException):
+               self.http_available = False
+         if response is None:
+            response = self.client(c[0]) if c[1] is None else self.client(c[0], c[1])
+         responses.append(response)
+      return responses
+
+   # close - close persistent connection
+   def close(self):
+      if self.connection is not None:
+         self.connection.close()
+         self.connection = None
+
+# response_error - get error message from response
+# @arguments
+# response - response like from ccdciel() function
+#
+# @return error message or None if call succeeded
+def response_error(response):
+   if not isinstance(response, dict):
+      return 'invalid response'
+   error = response.get('error')
+   if error is None:
+      return None
+   if isinstance(error, dict):
+      return str(error.get('message', error))
+   return str(error)
+
+# wait_for_value - wait until device reports target value
+# Time is measured by monotonic clock, so slow RPC calls do not extend the
+# timeout. Device is polled often at the beginning and the interval grows
+# with every poll up to max_interval, wait ends as soon as target is reached.
+# When expected move time is known the device is polled rarely until the move
+# should be finished (every poll halves the remaining time) and often after it.
+# @arguments
+# read_value - function without arguments which reads current value from device
+# target - expected value
+# max_time - timeout in seconds
+# first_interval - first poll interval in seconds
+# max_interval - maximal poll interval in seconds
+# backoff - poll interval multiplier
+# on_poll - optional function called after each poll with value and elapsed time
+# expected_time - optional expected move time in seconds
+#
+# @return reached flag, last read value, elapsed time in seconds
+def wait_for_value(read_value, target, max_time, first_interval=0.1, max_interval=1.0, backoff=1.5, on_poll=None, expected_time=None):
+   start = time.monotonic()
+   deadline = start + max_time
+   interval = first_interval
+   value = read_value()
+   while value != target:
+      now = time.monotonic()
+      if now >= deadline:
+         return False, value, now - start
+      if expected_time != None and now - start + first_interval < expected_time:
+         sleep_time = (expected_time - (now - start)) / 2.0
+         if sleep_time < first_interval:
+            sleep_time = first_interval
+      else:
+         sleep_time = interval
+         interval = min(interval * backoff, max_interval)
+      sleep_time = min(sleep_time, deadline - now)
+      time.sleep(sleep_time)
+      if metrics != None:
+         metrics.record_sleep(sleep_time)
+      value = read_value()
+      if on_poll != None:
+         on_poll(value, time.monotonic() - start)
+   return True, value, time.monotonic() - start
+
+# RpcMetrics - per-method metrics of JSON-RPC calls
+#
+# For every method number of calls, errors, latency (total, min, max and
+# histogram) and sizes of request and response payloads are recorded.
+# Time of polling sleeps in wait_for_value() is recorded separately, so run
+# time can be split into RPC calls (with autofocus), sleeps and local work.
+# Metrics are enabled by enable_metrics(), at the end of run summary is logged
+# and metrics are stored in JSON file (list of runs) or SQLite database
+# (file with .db, .sqlite or .sqlite3 extension, table 'rpc_metrics').
+class RpcMetrics:
+   HISTOGRAM_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0) # Upper bounds of latency histogram buckets in seconds, last bucket is unlimited
+   SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3') # Metrics file extensions stored as SQLite database
+
+   def __init__(self, path, script=None):
+      self.path = path # Metrics file path
+      self.script = script if script is not None else os.path.basename(sys.argv[0]) # Script name stored with metrics
+      self.lock = threading.Lock() # Lock for metrics, calls are done from many threads
+      self.methods = {} # Method -> [calls, errors, total time, min time, max time, request bytes, response bytes, histogram]
+      self.sleep_time = 0.0 # Time of polling sleeps in seconds
+      self.start = time.monotonic() # Run start
+      self.timestamp = time.time() # Run start wall clock time
+
+   # record - record one call
+   # @arguments
+   # method - JSON-RPC method name
+   # latency - call time in seconds
+   # error - True if call failed
+   # request_bytes, response_bytes - payload sizes
+   def record(self, method, latency, error, request_bytes, response_bytes):
+      bucket = len(self.HISTOGRAM_BOUNDS)
+      for idb,b in enumerate(self.HISTOGRAM_BOUNDS):
+         if latency <= b:
+            bucket = idb
+            break
+      with self.lock:
+         m = self.methods.get(method)
+         if m is None:
+            m = [0, 0, 0.0, latency, latency, 0, 0, [0] * (len(self.HISTOGRAM_BOUNDS) + 1)]
+            self.methods[method] = m
+         m[0] += 1
+         m[1] += 1 if error else 0
+         m[2] += latency
+         m[3] = min(m[3], latency)
+         m[4] = max(m[4], latency)
+         m[5] += request_bytes
+         m[6] += response_bytes
+         m[7][bucket] += 1
+
+   # record_sleep - record polling sleep
+   def record_sleep(self, seconds):
+      with self.lock:
+         self.sleep_time += seconds
+
+   # instrument - wrap JSON-RPC client function, every call is recorded
+   # @arguments
+   # client - function like ccdciel()
+   #
+   # @return function with the same arguments as client
+   def instrument(self, client):
+      def instrumented(method, params=None):
+         request_bytes = len(method) + (len(json.dumps(params)) if params is not None else 0)
+         start = time.perf_counter()
+         try:
+            response = client(method) if params is None else client(method, params)
+         except Exception:
+            self.record(method, time.perf_counter() - start, True, request_bytes, 0)
+            raise
+         latency = time.perf_counter() - start
+         try:
+            response_bytes = len(json.dumps(response))
+         except (TypeError, ValueError):
+            response_bytes = 0
+         self.record(method, latency, response_error(response) is not None, request_bytes, response_bytes)
+         return response
+      instrumented.uninstrumented = client
+      return instrumented
+
+   # percentile - estimate latency percentile from histogram
+   # @return upper bound of bucket with percentile, max time for last bucket
+   def percentile(self, method, fraction):
+      m = self.methods[method]
+      limit = fraction * m[0]
+      count = 0
+      for idb,c in enumerate(m[7]):
+         count += c
+         if count >= limit and c > 0:
+            return min(self.HISTOGRAM_BOUNDS[idb], m[4]) if idb < len(self.HISTOGRAM_BOUNDS) else m[4]
+      return m[4]
+
+   # summary - summary of run for log
+   # @return list of lines
+   def summary(self):
+      with self.lock:
+         run_time = time.monotonic() - self.start
+         rpc_time = sum(m[2] for m in self.methods.values())
+         lines = ['[METRICS] Run %.2fs: RPC %.2fs in %d calls, polling sleeps %.2fs, other %.2fs' % (run_time, rpc_time, sum(m[0] for m in self.methods.values()), self.sleep_time, max(0.0, run_time - rpc_time - self.sleep_time))]
+         for method in sorted(self.methods, key=lambda k: -self.methods[k][2]):
+            m = self.methods[method]
+            lines.append('[METRICS] %s: calls %d errors %d total %.3fs mean %.1fms p50 %.1fms p95 %.1fms max %.1fms bytes %d/%d' % (method, m[0], m[1], m[2], 1000.0 * m[2] / m[0], 1000.0 * self.percentile(method, 0.5), 1000.0 * self.percentile(method, 0.95), 1000.0 * m[4], m[5], m[6]))
+         return lines
+
+   # as_dict - metrics of run as dictionary
+   def as_dict(self):
+      with self.lock:
+         methods = {}
+         for method,m in self.methods.items():
+            methods[method] = {'calls': m[0], 'errors': m[1], 'total_time': m[2], 'min_time': m[3], 'max_time': m[4],
+                               'request_bytes': m[5], 'response_bytes': m[6], 'histogram': list(m[7])}
+         return {'script': self.script, 'timestamp': self.timestamp, 'run_time': time.monotonic() - self.start, 'sleep_time': self.sleep_time,
+                 'histogram_bounds': list(self.HISTOGRAM_BOUNDS), 'methods': methods}
+
+   # save - store metrics of run in metrics file
+   # @return status
+   # 0 - success
+   # 31 - cannot open or write metrics file
+   def save(self):
+      run = self.as_dict()
+      if os.path.splitext(self.path)[1].lower() in self.SQLITE_EXTENSIONS:
+         return self.save_sqlite(run)
+      runs = []
+      try:
+         with open(self.path) as f:
+            runs = json.load(f)
+         if not isinstance(runs, list):
+            runs = [runs]
+      except (OSError, ValueError):
+         runs = []
+      runs.append(run)
+      try:
+         with open(self.path, 'w') as f:
+            json.dump(runs, f, indent=1)
+      except OSError:
+         return 31
+      return 0
+
+   # save_sqlite - store metrics of run in SQLite database, one row per method
+   def save_sqlite(self, run):
+      import sqlite3
+      try:
+         conn = sqlite3.connect(self.path, timeout=5.0)
+         with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS rpc_metrics (timestamp REAL, script TEXT, run_time REAL, sleep_time REAL, method TEXT, calls INTEGER, errors INTEGER, total_time REAL, min_time REAL, max_time REAL, request_bytes INTEGER, response_bytes INTEGER, histogram TEXT)')
+            conn.executemany('INSERT INTO rpc_metrics VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                             [(run['timestamp'], run['script'], run['run_time'], run['sleep_time'], method, m['calls'], m['errors'], m['total_time'], m['min_time'], m['max_time'], m['request_bytes'], m['response_bytes'], json.dumps(m['histogram']))
+                              for method,m in run['methods'].items()])
+         conn.close()
+      except sqlite3.Error:
+         return 31
+      return 0
+
+   # finish - log summary and store metrics, called at exit of script
+   # @arguments
+   # log - function used to log summary lines
+   def finish(self, log):
+      for line in self.summary():
+         log(line)
+      if self.save() != 0:
+         log('[WARNING] Can not store RPC metrics in %s' % (self.path))
+
+metrics = None # Metrics of current run, None - metrics disabled
+
+# enable_metrics - enable RPC metrics when CCDCIEL_METRICS environment variable
+# or '--metrics <file>' argument is provided, argument is removed from
+# sys.argv so scripts parse their own arguments as before. Summary is logged
+# and metrics are stored at exit of script.
+# @arguments
+# client - JSON-RPC client function like ccdciel()
+#
+# @return instrumented client when metrics are enabled, otherwise client
+def enable_metrics(client=ccdciel):
+   global metrics
+   path = os.environ.get('CCDCIEL_METRICS')
+   if '--metrics' in sys.argv[1:]:
+      ida = sys.argv.index('--metrics', 1)
+      if ida + 1 < len(sys.argv):
+         path = sys.argv[ida+1]
+         del sys.argv[ida:ida+2]
+      else:
+         del sys.argv[ida]
+   if not path:
+      return client
+   metrics = RpcMetrics(path)
+   atexit.register(metrics.finish, lambda message: client('LogMsg', message))
+   return metrics.instrument(client)
@@ -0,0 +1,232 @@
+# ccdciel_thermal.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Module with camera thermal helpers shared by scripts
+# - thermal ramp controller, camera setpoint changed with limited rate in
+#   C per minute for warm up and cooldown
+# - exponential approach model fitted from observed temperatures, used for
+#   completion time prediction (ETA) and poll schedule
+#
+# Module is not a script, it must be installed as *.py file next to scripts
+# in CCDCiel directory (see Makefile target 'modules').
+# For more information and reference of the available methods see:
+# https://www.ap-i.net/ccdciel/en/documentation/jsonrpc_reference
+#
+# List of changes:
+# [17-10-2026] Initial version, camera thermal ramp controller
+# ---------------------------------------------------------------------------- #
+#
+
+from ccdciel import ccdciel
+from ccdciel_rpc import response_error
+import math
+import time
+
+# ThermalRamp - camera temperature ramp with limited rate
+#
+# Setpoint goes from current camera temperature to target by STEP every
+# STEP/rate minutes, ramp holds while camera lags behind setpoint more than
+# MAX_LAG, so sensor never sees thermal shock. After last step camera
+# approaches target exponentially:
+#   temperature = asymptote + (temperature0 - asymptote) * exp(-t / time_constant)
+# Model is fitted from observed temperatures, asymptote differs from target
+# when cooler can not reach it (e.g. warm up above ambient temperature).
+# Camera is polled once per ramp step and during approach following the
+# prediction (every poll halves the predicted remaining time). Ramp ends when
+# temperature is stable within tolerance of target or of fitted asymptote.
+class ThermalRamp:
+   DEFAULT_RATE = 3.0 # Default setpoint rate in C per minute
+   DEFAULT_TOLERANCE = 0.5 # Default tolerance of final temperature in C
+   DEFAULT_TIME_CONSTANT = 60.0 # Time constant of exponential approach in seconds used until model is fitted
+   STEP = 1.0 # Setpoint step in C
+   MAX_LAG = 2.0 # Maximal difference between setpoint and camera temperature in C before ramp holds
+   MIN_POLL_INTERVAL = 5.0 # Minimal poll interval in seconds
+   MAX_POLL_INTERVAL = 60.0 # Maximal poll interval in seconds
+   FIT_SAMPLES = 8 # Number of latest temperatures used to fit approach model
+   MIN_FIT_TIME_CONSTANT = 1.0 # Fitted time constants out of range are rejected as noise
+   MAX_FIT_TIME_CONSTANT = 3600.0
+
+   def __init__(self, target, rate=DEFAULT_RATE, tolerance=DEFAULT_TOLERANCE, max_time=None, client=ccdciel):
+      self.target = float(target) # Target temperature in C
+      self.rate = rate # Setpoint rate in C per minute, 0 - target is set at once
+      self.tolerance = tolerance # Tolerance of final temperature in C
+      self.max_time = max_time # Timeout in seconds, None - twice planned time
+      self.client = client # Function used for JSON-RPC calls
+      self.setpoint = None # Current camera setpoint in C
+      self.time_constant = self.DEFAULT_TIME_CONSTANT # Time constant of exponential approach in seconds
+      self.asymptote = None # Fitted final temperature in C, None - model not fitted
+      self.samples = [] # [elapsed time, temperature] observed after last setpoint change
+      self.held = False # Ramp holds, camera lags behind setpoint
+      self.polls = 0 # Number of temperature reads
+
+   # read_temperature - read camera temperature
+   # @return temperature in C or None on error
+   def read_temperature(self):
+      self.polls += 1
+      response = self.client('CcdTemp')
+      if response_error(response) is not None or response.get('result') is None:
+         return None
+      return float(response['result'])
+
+   # set_setpoint - set camera setpoint
+   # @arguments
+   # setpoint - temperature in C
+   def set_setpoint(self, setpoint):
+      self.setpoint = setpoint
+      self.samples = []
+      self.asymptote = None
+      self.client('Ccd_settemperature', round(setpoint, 1))
+
+   # step_time - time between ramp steps in seconds
+   def step_time(self):
+      return 60.0 * self.STEP / self.rate if self.rate > 0 else 0.0
+
+   # planned_time - time of ramp and approach to target planned before model is fitted
+   # @arguments
+   # temperature - starting camera temperature
+   #
+   # @return planned time in seconds
+   def planned_time(self, temperature):
+      distance = abs(self.target - temperature)
+      ramp_time = 60.0 * distance / self.rate if self.rate > 0 else 0.0
+      lag = min(distance, self.STEP) if self.rate > 0 else distance
+      settle_time = self.DEFAULT_TIME_CONSTANT * math.log(lag / self.tolerance) if lag > self.tolerance else 0.0
+      return ramp_time + settle_time
+
+   # fit - fit exponential approach from observed temperatures
+   # Rate of change is linear function of temperature:
+   #   dT/dt = (asymptote - T) / time_constant
+   # so it is fitted by least squares of finite differences of latest samples.
+   def fit(self):
+      samples = self.samples[-self.FIT_SAMPLES:]
+      if len(samples) < 3:
+         return
+      points = []
+      for s1, s2 in zip(samples, samples[1:]):
+         if s2[0] > s1[0]:
+            points.append([(s1[1] + s2[1]) / 2.0, (s2[1] - s1[1]) / (s2[0] - s1[0])])
+      if len(points) < 2:
+         return
+      mean_t = sum(p[0] for p in points) / len(points)
+      mean_r = sum(p[1] for p in points) / len(points)
+      stt = sum((p[0] - mean_t) ** 2 for p in points)
+      if stt == 0:
+         return
+      slope = sum((p[0] - mean_t) * (p[1] - mean_r) for p in points) / stt
+      if slope >= 0:
+         return
+      time_constant = -1.0 / slope
+      if time_constant < self.MIN_FIT_TIME_CONSTANT or time_constant > self.MAX_FIT_TIME_CONSTANT:
+         return
+      self.time_constant = time_constant
+      self.asymptote = mean_t + mean_r * time_constant
+
+   # final_temperature - temperature expected when camera settles at current setpoint
+   # @return setpoint or fitted asymptote when setpoint is not reachable
+   def final_temperature(self):
+      if self.asymptote is None or abs(self.asymptote - self.setpoint) <= self.tolerance:
+         return self.setpoint
+      return self.asymptote
+
+   # eta - predict remaining time of ramp and approach
+   # @arguments
+   # temperature - current camera temperature
+   # elapsed_step - time since last ramp step in seconds
+   #
+   # @return predicted remaining time in seconds
+   def eta(self, temperature, elapsed_step=0.0):
+      ramp_time = 0.0
+      if self.setpoint != self.target and self.rate > 0 and not self.held:
+         # Camera follows ramp with lag, after last step it settles from about one step
+         ramp_time = max(0.0, 60.0 * abs(self.target - self.setpoint) / self.rate - elapsed_step)
+         distance = min(abs(self.setpoint - temperature) + self.STEP, self.MAX_LAG)
+         margin = self.tolerance
+      else:
+         final_temperature = self.asymptote if self.asymptote is not None else self.setpoint
+         distance = abs(temperature - final_temperature)
+         margin = self.tolerance - abs(final_temperature - self.setpoint)
+         if margin <= 0:
+            margin = self.tolerance
+      settle_time = self.time_constant * math.log(distance / margin) if distance > margin else 0.0
+      return ramp_time + settle_time
+
+   # stable - check if temperature is stable within tolerance of final temperature
+   # Last two polls after setpoint change must be within tolerance and model
+   # must not predict further change bigger than tolerance.
+   def stable(self):
+      if len(self.samples) < 2:
+         return False
+      final_temperature = self.final_temperature()
+      if abs(self.samples[-1][1] - final_temperature) > self.tolerance or abs(self.samples[-2][1] - final_temperature) > self.tolerance:
+         return False
+      return self.asymptote is None or abs(self.samples[-1][1] - self.asymptote) <= self.tolerance
+
+   # run - run ramp and wait until camera temperature is stable
+   # @arguments
+   # log - function called with messages for log, None - messages are not logged
+   #
+   # @return status, last camera temperature, elapsed time in seconds
+   # status:
+   # 'REACHED' - temperature is stable within tolerance of target
+   # 'STABLE' - temperature is stable out of tolerance of setpoint, target is not reachable
+   # 'TIMEOUT' - temperature is not stable during max_time
+   # 'ERROR' - camera temperature can not be read
+   def run(self, log=None):
+      start = time.monotonic()
+      temperature = self.read_temperature()
+      if temperature is None:
+         return 'ERROR', None, 0.0
+      max_time = self.max_time if self.max_time is not None else 2.0 * self.planned_time(temperature) + 120.0
+      deadline = start + max_time
+      direction = 1.0 if self.target > temperature else -1.0
+      self.held = False
+      if self.rate > 0 and abs(self.target - temperature) > self.STEP:
+         self.setpoint = temperature
+      else:
+         self.set_setpoint(self.target)
+      if log != None:
+         log('Camera temperature ramp from %.1f C to %.1f C at %.1f C/min, ETA %ds' %(temperature, self.target, self.rate, self.planned_time(temperature)))
+      last_step = None
+      while True:
+         now = time.monotonic()
+         # Next ramp step when camera follows setpoint
+         if self.setpoint != self.target and (last_step is None or now - last_step >= self.step_time()):
+            if abs(self.setpoint - temperature) <= self.MAX_LAG:
+               setpoint = self.setpoint + direction * self.STEP
+               if direction * (setpoint - self.target) >= 0:
+                  setpoint = self.target
+               self.set_setpoint(setpoint)
+               last_step = now
+               if self.held and log != None:
+                  log('Camera temperature ramp resumed at %.1f C' %(temperature))
+               self.held = False
+               if setpoint == self.target and log != None:
+                  log('Camera setpoint %.1f C reached by ramp, camera %.1f C, ETA %ds' %(setpoint, temperature, self.eta(temperature)))
+            elif not self.held:
+               self.held = True
+               if log != None:
+                  log('Camera temperature ramp held, camera %.1f C lags behind setpoint %.1f C' %(temperature, self.setpoint))
+         # Camera settled at target or can not reach setpoint
+         if (self.setpoint == self.target or self.held) and self.stable():
+            final_temperature = self.final_temperature()
+            if final_temperature == self.target:
+               return 'REACHED', temperature, now - start
+            if final_temperature != self.setpoint:
+               return 'STABLE', temperature, now - start
+         if now >= deadline:
+            return 'TIMEOUT', temperature, now - start
+         # Poll once per ramp step, during approach follow the prediction
+         if self.setpoint != self.target and not self.held:
+            sleep_time = self.step_time() - (now - last_step)
+         else:
+            sleep_time = self.eta(temperature) / 2.0
+         sleep_time = min(max(sleep_time, self.MIN_POLL_INTERVAL), self.MAX_POLL_INTERVAL)
+         time.sleep(min(sleep_time, max(deadline - now, 0.0)))
+         value = self.read_temperature()
+         if value is not None:
+            temperature = value
+            self.samples.append([time.monotonic() - start, temperature])
+            self.fit()
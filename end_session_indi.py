@@ -10,6 +10,12 @@
 #   - set filter wheel on first position and reset all offsets
 #   - set focuser on position ZERO
 #   - set iEQ (iOptron CEM-60-EC) in ZERO position (use INDI commands: iEQ)
+#   - optional: warm up the camera (argument --warmup)
+#   - optional: switch off dew heaters (automatic dew control and dew A/B power) of Pegasus Astro Saddle Power Box (argument --dew)
+# Operations are independent and run at the same time, each with own deadline,
+# result of every operation is reported as soon as it ends or its deadline expires.
+#
+# Usage: end_session_indi.py [<INDI port>] [--warmup] [--dew]
 #
 # Example of Python program that use the CCDciel JSON-RPC interface.
 # For more information and reference of the available methods see: 
@@ -21,79 +27,102 @@
 #
 # List of changes:
 # [22-11-2025] Working version
+# [17-10-2026] Filters offsets reset send as JSON-RPC batch request, needs ccdciel_rpc.py module
+# [17-10-2026] Focuser and filter wheel moves use shared wait engine with adaptive polling
+# [17-10-2026] Shutdown operations run concurrently by asyncio with deadline and result report for each operation,
+#              added optional camera warm up and dew heaters switch off
+# [17-10-2026] Completion of HOME operation detected from HOME state and mount coordinates reported by INDI callbacks,
+#              fixed 60s wait removed
+# [17-10-2026] Shared INDI client with properties mirror and connection reused by stages, needs ccdciel_indi.py module
+# [17-10-2026] Camera warm up by thermal ramp with limited rate, needs ccdciel_thermal.py module
+# [17-10-2026] Optional per-method RPC metrics (CCDCIEL_METRICS or --metrics <file>), needs ccdciel_rpc.py module
+# [17-10-2026] Logs buffered and send in batches by background thread, DEBUG messages off by default, optional
+#              rotating log file (CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel, --logfile), needs ccdciel_log.py module
+# [17-10-2026] Fingerprint of offsets applied by focuser_position_per_filter script is removed from its database before
+#              offsets are reset, when focuser_position_database.py module is installed
+# [17-10-2026] Stages run in daemon threads or as coroutines, result of stage reported as soon as stage ends or its deadline
+#              expires and stage which does not respond does not delay end of script, HOME completion awaited in event loop,
+#              stage deadlines have margin over timeouts used inside stages, HOME_MAX_TIME shared with iEQ_scope_go_home_indi
+#              script (ccdciel_indi.py module), dew heaters switch off sets dew A/B power to zero and waits for confirmation
 # ---------------------------------------------------------------------------- #
 #
 
 from ccdciel import ccdciel
+from ccdciel_rpc import BatchClient, enable_metrics, response_error, wait_for_value
+from ccdciel_log import enable_log_sink
+from ccdciel_indi import DEFAULT_INDI_PORT, HOME_MAX_TIME, disconnect_clients, get_client
+from ccdciel_thermal import ThermalRamp
 import PyIndi
+import asyncio
+import os
 import sys
+import threading
 import time
 
-# INDI CLIENT CLASS
-class IndiClient(PyIndi.BaseClient):
-    def __init__(self):
-        super(IndiClient, self).__init__()
-    def newDevice(self, d):
-        pass
-    def newProperty(self, p):
-        pass
-    def removeProperty(self, p):
-        pass
-    def newBLOB(self, bp):
-        global blobEvent
-        print("new BLOB ", bp.name)
-        blobEvent.set()
-        pass
-    def newSwitch(self, svp):
-        pass
-    def newNumber(self, nvp):
-        pass
-    def newText(self, tvp):
-        pass
-    def newLight(self, lvp):
-        pass
-    def newMessage(self, d, m):
-        pass
-    def serverConnected(self):
-        pass
-    def serverDisconnected(self, code):
-        pass
-
-def processing_indi_commands_iEQ():
+try:
+    from focuser_position_database import forget_applied_offsets
+except ImportError:
+    forget_applied_offsets = None
+
+# Enable RPC metrics when CCDCIEL_METRICS or --metrics <file> is provided
+ccdciel = enable_metrics(ccdciel)
+
+# Buffer logs, DEBUG level and local log file are enabled by CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel <level>, --logfile <file>
+ccdciel = enable_log_sink(ccdciel)
+
+# GLOBAL VARIABLES
+indi_port = DEFAULT_INDI_PORT # INDI server port, can be provided as first argument
+warm_up_camera = False # Warm up the camera, argument --warmup
+dew_heaters_off = False # Switch off dew heaters, argument --dew
+camera_warm_up_temperature = 20 # Camera warm up temperature in C
+pa_spb = "Pegasus SPB" # Pegasus Astro Saddle Power Box device name
+focuser_position_database_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'focuser_position_per_filter.db') # Database of focuser_position_per_filter script
+
+HOME_DEC_TOLERANCE = 0.1 # Maximal distance in degrees of DEC from pole in HOME position
+DEVICE_MAX_TIME = 30 # Maximal time in seconds of waiting for INDI device and its property
+FOCUSER_MAX_TIME = 120 # Maximal time in seconds of focuser move to ZERO position
+WHEEL_MAX_TIME = 30 # Maximal time in seconds of filter wheel move to first position
+CAMERA_WARM_UP_MAX_TIME = 1080 # Maximal time in seconds of camera warm up
+DEW_MAX_TIME = 30 # Maximal time in seconds of dew heaters switch off confirmation
+STAGE_DEADLINE_MARGIN = 60 # Stage deadline margin in seconds over the timeouts used inside stage
+
+# home_operation_finished - condition for end of HOME operation, mount reports Ok/Idle state of HOME
+# after it has been busy or when it points to the pole (DEC +/-90)
+# @return predicate for wait_for_async(), predicate returns
+# 'HOME' - mount at home, 'ALERT' - HOME operation failed, None - HOME operation in progress
+def home_operation_finished(indiclient, mount):
+    home_failed=indiclient.property_equals(mount,"HOME",PyIndi.IPS_ALERT)
+    home_finished=indiclient.property_equals(mount,"HOME",(PyIndi.IPS_OK,PyIndi.IPS_IDLE))
+    def predicate():
+       if home_failed():
+          return 'ALERT'
+       if home_finished():
+          dec=indiclient.get_value(mount,"EQUATORIAL_EOD_COORD","DEC")
+          if indiclient.state_reported(mount,"HOME",PyIndi.IPS_BUSY) or (dec != None and abs(abs(dec)-90.0) < HOME_DEC_TOLERANCE):
+             return 'HOME'
+       return None
+    return predicate
+
+async def processing_indi_commands_iEQ():
     # Monitore iEQ 'iOptron CEM60-EC' mount
     mount="iEQ"
     device_mount=None
-    mount_connected=None
-
-    # Get INDI on port
-    default_indi_port=7625
-    indi_port=default_indi_port
-    if len(sys.argv) > 1:
-       indi_port=int(sys.argv[1])
 
-    # Trying connect to INDI
-    indiclient=IndiClient()
-    indiclient.setServer("localhost",indi_port)
+    # Trying connect to INDI, connection is shared by all INDI operations
+    indiclient=await run_in_daemon_thread(lambda: get_client(indi_port))
 
     # Check is INDI connected
-    if (not(indiclient.connectServer())):
+    if indiclient == None:
        ccdciel('LogMsg',"INDI client is not connected on port %d" %(indi_port))
        return -1
     else:
        ccdciel('LogMsg',"INDI client is connected on port %d" %(indi_port))
 
-    # Connect to iEQ mount
-    max_time=30
-    cur_time=0
-    sleep_time=0.5
-    device_mount=indiclient.getDevice(mount)
-    while not(device_mount):
-          if cur_time == max_time:
-               ccdciel('LogMsg',"iEQ mount not connected during %d, something goes wrong!!!" %(max_time))
-               sys.exit(1)
-          time.sleep(sleep_time)
-          device_mount=indiclient.getDevice(mount)
-          cur_time=cur_time+sleep_time
+    # Wait for iEQ mount and its HOME property
+    device_mount=await indiclient.wait_for_async(indiclient.device_ready(mount,"HOME"),DEVICE_MAX_TIME)
+    if not(device_mount):
+       ccdciel('LogMsg',"iEQ mount not connected during %d, something goes wrong!!!" %(DEVICE_MAX_TIME))
+       return -1
 
     # iEQ go to HOME
     mount_home_operation=device_mount.getSwitch("HOME")
@@ -103,15 +132,23 @@ def processing_indi_commands_iEQ():
     # mount_home_operation[0].s -  SET CURRENT POSITION AS HOME
     # mount_home_operation[1].s -  GO HOME
     # mount_home_operation[2].s -  FIND HOME
+    indiclient.clear_states(mount,"HOME")
     mount_home_operation[1].s=1
     indiclient.sendNewSwitch(mount_home_operation)
-    sleep_time=60
-    time.sleep(sleep_time)
 
-    return 0
+    # Wait until mount reports HOME operation finished at home position
+    start_time=time.monotonic()
+    if await indiclient.wait_for_async(home_operation_finished(indiclient,mount),HOME_MAX_TIME) != 'HOME':
+       if indiclient.get_state(mount,"HOME") == PyIndi.IPS_ALERT:
+          ccdciel('LogMsg',"[ERROR] iEQ mount reported failure of HOME operation")
+       else:
+          ccdciel('LogMsg',"[ERROR] iEQ mount not in HOME position during %ds, HOME state: %s DEC: %s" %(HOME_MAX_TIME,indiclient.get_state(mount,"HOME"),indiclient.get_value(mount,"EQUATORIAL_EOD_COORD","DEC")))
+       return -1
+    ccdciel('LogMsg',"INDI iEQ in home position after %.1fs" %(time.monotonic()-start_time))
 
+    return 0
 
-def TelescopeGoToHomePosition():
+def UnparkTelescope():
     connected = (ccdciel('Telescope_Connected')['result'])
     if not connected :
        ccdciel('LogMsg','Telescope not connected!')
@@ -123,7 +160,14 @@ def TelescopeGoToHomePosition():
        r = (ccdciel('Telescope_Park',False)['result']['status'])
        ccdciel('LogMsg','Telescope status parked %r' %(r))
 
-    return processing_indi_commands_iEQ()
+    return 0
+
+async def TelescopeGoToHomePosition():
+    # JSON-RPC calls block, they run in stage thread
+    if await run_in_daemon_thread(UnparkTelescope) != 0:
+       return -1
+
+    return await processing_indi_commands_iEQ()
 
 def SetFocuserToZeroPosition():
     connected = (ccdciel('Focuser_connected')['result'])
@@ -137,19 +181,13 @@ def SetFocuserToZeroPosition():
     ccdciel('LogMsg','Focuser before setting to ZERO position=%d' %(fp))
 
     # Set position to 0
-    max_time=120
-    cur_time=0
+    max_time=FOCUSER_MAX_TIME
     new_pos=0
     if fp > new_pos:
        ccdciel('Focuser_setposition',new_pos)
-       fp = ccdciel('FocuserPosition')['result']
-       while fp != new_pos:
-             if cur_time == max_time:
-                ccdciel('LogMsg', 'Focuser not set in position %d during %ds something goes wrong!!!' %(new_pos,max_time))
-                break
-             time.sleep(1)
-             fp = ccdciel('FocuserPosition')['result']
-             cur_time=cur_time+1
+       reached, fp, cur_time = wait_for_value(lambda: ccdciel('FocuserPosition')['result'], new_pos, max_time)
+       if not reached:
+          ccdciel('LogMsg', 'Focuser not set in position %d during %ds something goes wrong!!!' %(new_pos,max_time))
 
     # Print the focuser position
     fp = ccdciel('FocuserPosition')['result']
@@ -172,25 +210,30 @@ def SetFilterToFirst():
     cur_pos=int(fp.get('status'))-1
     ccdciel('LogMsg','Current filter is %s' %(filters[cur_pos]))
 
+    # Offsets applied by focuser_position_per_filter script are not valid after reset
+    if forget_applied_offsets != None and forget_applied_offsets(focuser_position_database_file) != 0:
+       ccdciel('LogMsg','Can not remove applied filters offsets from database %s' %(focuser_position_database_file))
+
     # Reset filters offsets
+    rpc_batch = BatchClient(ccdciel)
+    for idf,f in enumerate(filters):
+       rpc_batch.queue('Set_FilterOffset',[f,0])
+    responses = rpc_batch.flush()
+    rpc_batch.close()
     for idf,f in enumerate(filters):
-       ccdciel('Set_FilterOffset',[f,0])
+       error = response_error(responses[idf])
+       if error != None:
+          ccdciel('LogMsg','Can not reset offset for filter %s: %s' %(f,error))
 
     # Set filter position to first
-    max_time=30
-    cur_time=0
+    max_time=WHEEL_MAX_TIME
     new_pos=0
     cur_pos=int(fp.get('status'))-1
     if cur_pos != new_pos:
        ccdciel('Wheel_setfilter',(new_pos+1))
-       while cur_pos != new_pos:
-             if cur_time == max_time:
-                ccdciel('LogMsg', 'Filter wheel not set in first position %s during %ds something goes wrong!!!' %(filters[new_pos],max_time))
-                break
-             time.sleep(1)
-             fp = ccdciel('Wheel_getfilter')['result']
-             cur_pos=int(fp.get('status'))-1
-             cur_time=cur_time+1
+       reached, cur_pos, cur_time = wait_for_value(lambda: int(ccdciel('Wheel_getfilter')['result'].get('status'))-1, new_pos, max_time)
+       if not reached:
+          ccdciel('LogMsg', 'Filter wheel not set in first position %s during %ds something goes wrong!!!' %(filters[new_pos],max_time))
 
     # Print the final filter position
     fp = ccdciel('Wheel_getfilter')['result']
@@ -199,24 +242,168 @@ def SetFilterToFirst():
 
     return 0
 
+def CameraWarmUp():
+    connected = (ccdciel('Camera_connected')['result'])
+    if not connected :
+       return -1
+
+    # Warm up the camera by thermal ramp, timeout is shorter than stage deadline
+    ccdciel('LogMsg','Warming up the camera to %d C...' %(camera_warm_up_temperature))
+    ramp=ThermalRamp(camera_warm_up_temperature,max_time=CAMERA_WARM_UP_MAX_TIME,client=ccdciel)
+    status,ct,elapsed=ramp.run(log=lambda message: ccdciel('LogMsg',message))
+    if status == 'ERROR':
+       return -1
+    if status == 'TIMEOUT':
+       ccdciel('LogMsg','Timeout reached while warming up the camera.')
+
+    ccdciel('LogMsg','Camera warm up completed. Current temperature = %lf C' %(ct))
+    return 0
+
+# dew_heaters_switched_off - condition: Pegasus SPB reports automatic dew control disabled and dew outputs at zero
+# @arguments
+# dew_auto_disabled - DISABLED element name of DEWAUTO switch
+# dew_outputs - elements names of DEW_PWM number (dew A and B outputs)
 #
-# MAIN PROGRAM
-#
-if SetFocuserToZeroPosition() == -1:
-   ccdciel('LogMsg','Focuser not connected!')
-else:
-   ccdciel('LogMsg','Focuser position has been set to ZERO')
+# @return predicate for wait_for_async()
+def dew_heaters_switched_off(indiclient, dew_auto_disabled, dew_outputs):
+    conditions=[indiclient.property_equals(pa_spb,"DEWAUTO",PyIndi.IPS_OK,dew_auto_disabled,PyIndi.ISS_ON)]
+    for name in dew_outputs:
+       conditions.append(indiclient.property_equals(pa_spb,"DEW_PWM",PyIndi.IPS_OK,name,0))
+    return lambda: all(c() for c in conditions)
+
+async def DewHeatersOff():
+    # Trying connect to INDI, connection is shared by all INDI operations
+    indiclient=await run_in_daemon_thread(lambda: get_client(indi_port))
+    if indiclient == None:
+       ccdciel('LogMsg',"INDI client is not connected on port %d" %(indi_port))
+       return -1
 
-if SetFilterToFirst() == -1:
-   ccdciel('LogMsg','Filters wheel not connected!')
-else:
-   ccdciel('LogMsg','Position in filter wheel has been set to FIRST')
+    # Wait for 'Pegasus SPB' and its DEWAUTO and DEW_PWM properties
+    device_ready=indiclient.device_ready(pa_spb,"DEWAUTO")
+    dew_pwm_ready=indiclient.device_ready(pa_spb,"DEW_PWM")
+    device_pa_spb=await indiclient.wait_for_async(lambda: dew_pwm_ready() and device_ready(),DEVICE_MAX_TIME)
+    if not(device_pa_spb):
+       ccdciel('LogMsg',"Pegasus Astro Saddle Power Box not connected during %d, something goes wrong!!!" %(DEVICE_MAX_TIME))
+       return -1
+
+    # Disable automatic dew control
+    # dew_auto[0] - ENABLED
+    # dew_auto[1] - DISABLED
+    dew_auto=device_pa_spb.getSwitch("DEWAUTO")
+    dew_auto[0].setState(0)
+    dew_auto[1].setState(1)
+    indiclient.sendNewSwitch(dew_auto)
+
+    # Set power of dew A and B outputs to zero
+    dew_pwm=device_pa_spb.getNumber("DEW_PWM")
+    for e in dew_pwm:
+       e.value=0
+    indiclient.sendNewNumber(dew_pwm)
+
+    # Wait until Pegasus SPB confirms new state of dew heaters
+    if not(await indiclient.wait_for_async(dew_heaters_switched_off(indiclient,dew_auto[1].name,[e.name for e in dew_pwm]),DEW_MAX_TIME)):
+       ccdciel('LogMsg',"[ERROR] Pegasus Astro Saddle Power Box dew heaters not switched off during %ds, DEWAUTO state: %s DEW_PWM state: %s" %(DEW_MAX_TIME,indiclient.get_state(pa_spb,"DEWAUTO"),indiclient.get_state(pa_spb,"DEW_PWM")))
+       return -1
+    ccdciel('LogMsg',"Pegasus Astro Saddle Power Box automatic dew control disabled, dew A and B power set to zero")
 
+    return 0
 
-if TelescopeGoToHomePosition() == -1:
-    ccdciel('LogMsg','Can not move mount iEQ into HOME position!')
-else:
-    ccdciel('LogMsg','The iEQ mount has been moved into HOME position')
+# run_in_daemon_thread - run blocking function in daemon thread
+# Script does not wait for daemon thread at exit, so stage which does not respond can not delay end of script.
+# sys.exit() called by function ends only the thread, not whole script.
+# @return future with return value of function (-1 on sys.exit())
+def run_in_daemon_thread(function):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    def set_result(result, error):
+       if future.done():
+          return
+       if error != None:
+          future.set_exception(error)
+       else:
+          future.set_result(result)
+    def worker():
+       result = None
+       error = None
+       try:
+          result = function()
+       except SystemExit:
+          result = -1
+       except Exception as e:
+          error = e
+       try:
+          loop.call_soon_threadsafe(set_result, result, error)
+       except RuntimeError:
+          # Event loop is already closed, stage has been reported as not finished
+          pass
+    threading.Thread(target=worker, daemon=True).start()
+    return future
+
+# report_stage - report result of stage
+def report_stage(stage, status, elapsed):
+    if status == 'TIMEOUT':
+       ccdciel('LogMsg','[ERROR] Stage %s not finished during %ds' %(stage[0],stage[2]))
+    elif status == -1:
+       ccdciel('LogMsg','%s (stage %s, %.1fs)' %(stage[4],stage[0],elapsed))
+    else:
+       ccdciel('LogMsg','%s (stage %s, %.1fs)' %(stage[3],stage[0],elapsed))
+
+# run_stage - run stage with deadline and report its result as soon as it is known,
+# coroutine stage runs in event loop, blocking stage runs in daemon thread
+# @return stage name, status (return value of stage function or 'TIMEOUT'), elapsed time
+async def run_stage(stage):
+    start = time.monotonic()
+    if asyncio.iscoroutinefunction(stage[1]):
+       awaitable = stage[1]()
+    else:
+       awaitable = run_in_daemon_thread(stage[1])
+    try:
+       status = await asyncio.wait_for(awaitable, stage[2])
+    except asyncio.TimeoutError:
+       status = 'TIMEOUT'
+    elapsed = time.monotonic() - start
+    report_stage(stage, status, elapsed)
+    return [stage[0], status, elapsed]
+
+# end_session - run all stages at the same time
+# @return list of stages results
+async def end_session(stages):
+    return await asyncio.gather(*[run_stage(s) for s in stages])
+
+#
+# MAIN PROGRAM
+#
+
+# Parse arguments: [<INDI port>] [--warmup] [--dew]
+for a in sys.argv[1:]:
+    if a == '--warmup':
+       warm_up_camera = True
+    elif a == '--dew':
+       dew_heaters_off = True
+    else:
+       try:
+          indi_port = int(a)
+       except ValueError:
+          ccdciel('LogMsg','Unknown argument: %s' %(a))
+          sys.exit(1)
+
+# Stages: name, function, deadline in seconds, message on success, message on error
+# Deadline is timeouts used inside stage with margin, it ends waiting for stage which does not respond
+stages = [
+    ['focuser', SetFocuserToZeroPosition, FOCUSER_MAX_TIME + STAGE_DEADLINE_MARGIN, 'Focuser position has been set to ZERO', 'Focuser not connected!'],
+    ['filter wheel', SetFilterToFirst, WHEEL_MAX_TIME + STAGE_DEADLINE_MARGIN, 'Position in filter wheel has been set to FIRST', 'Filters wheel not connected!'],
+    ['mount', TelescopeGoToHomePosition, DEVICE_MAX_TIME + HOME_MAX_TIME + STAGE_DEADLINE_MARGIN, 'The iEQ mount has been moved into HOME position', 'Can not move mount iEQ into HOME position!'],
+]
+if warm_up_camera:
+    stages.append(['camera warm up', CameraWarmUp, CAMERA_WARM_UP_MAX_TIME + STAGE_DEADLINE_MARGIN, 'Camera has been warmed up', 'Camera is not connected!'])
+if dew_heaters_off:
+    stages.append(['dew heaters', DewHeatersOff, DEVICE_MAX_TIME + DEW_MAX_TIME + STAGE_DEADLINE_MARGIN, 'Dew heaters have been switched off', 'Can not switch off dew heaters!'])
+
+# Run stages concurrently, result of every stage is reported when stage ends or its deadline expires
+asyncio.run(end_session(stages))
+
+# Close INDI connection shared by stages
+disconnect_clients()
 
 
 
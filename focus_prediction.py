@@ -0,0 +1,155 @@
+# focus_prediction.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Module with temperature-compensated focus prediction shared by scripts
+# - linear model of focuser position against temperature fitted per filter
+#   from focus history, updated online by new autofocus results
+# - prediction with standard error used as confidence
+#
+# NumPy is optional, least squares are solved by numpy.linalg.lstsq when
+# NumPy is installed, otherwise by closed form solution in pure Python.
+#
+# Module is not a script, it must be installed as *.py file next to scripts
+# in CCDCiel directory (see Makefile target 'modules').
+#
+# List of changes:
+# [17-10-2026] Initial version, temperature-compensated focus prediction per filter
+# [17-10-2026] Focus history read for rig profile
+# ---------------------------------------------------------------------------- #
+#
+
+from focuser_position_database import DEFAULT_PROFILE, FocusHistory
+import math
+import time
+
+try:
+   import numpy
+except ImportError:
+   numpy = None
+
+# FocusPredictor - focuser position per filter predicted from temperature
+#
+# For each filter model is fitted from latest autofocus results:
+#   focuser_position = position_at_zero + temperature * steps_per_degree
+# Prediction is trusted only when enough results cover sufficient range of
+# temperatures, current temperature is close to this range and standard
+# error of prediction is not bigger than max_error.
+class FocusPredictor:
+   FIT_SAMPLES = 50 # Number of latest autofocus results used to fit model for each filter
+   MAX_AGE_DAYS = 180 # Older autofocus results are not used
+   MIN_SAMPLES = 5 # Minimal number of autofocus results to use model
+   MIN_TEMPERATURE_SPAN = 2.0 # Minimal range of temperatures in autofocus results in degrees
+   TEMPERATURE_MARGIN = 3.0 # Allowed extrapolation out of temperatures range in degrees
+   DEFAULT_MAX_ERROR = 20.0 # Default maximal standard error of prediction in focuser steps
+
+   def __init__(self, db_path, max_error=DEFAULT_MAX_ERROR, profile=DEFAULT_PROFILE):
+      self.db_path = db_path # Path to database file
+      self.profile = profile # Rig profile of focus history
+      self.max_error = max_error # Maximal standard error of trusted prediction in focuser steps
+      self.samples = {} # Filter name -> list of [temperature, focuser position]
+      self.fitted = {} # Filter name -> [position at zero, steps per degree, residual error, mean temperature, sum of squared deviations, min temperature, max temperature, number of samples]
+
+   # load - read autofocus results from focus history and fit models
+   # @return status
+   # 0 - success
+   # 32 - can not read focus history
+   def load(self):
+      status, rows = FocusHistory(self.db_path, profile=self.profile).query(start=time.time() - self.MAX_AGE_DAYS * 86400.0)
+      if status != 0:
+         return status
+      self.samples = {}
+      for r in rows:
+         # ambient_temperature is used, CCD temperature is regulated by cooler
+         if r[2] is None or r[7] is None:
+            continue
+         self.samples.setdefault(r[1], []).append([float(r[7]), float(r[2])])
+      for filter_name in self.samples:
+         self.samples[filter_name] = self.samples[filter_name][-self.FIT_SAMPLES:]
+         self.fit(filter_name)
+      return 0
+
+   # update - add new autofocus result and fit model for filter again
+   # @arguments
+   # filter_name - filter name
+   # temperature - temperature during autofocus, None - result is ignored
+   # focuser_position - focuser position found by autofocus
+   def update(self, filter_name, temperature, focuser_position):
+      if temperature is None or focuser_position is None:
+         return
+      samples = self.samples.setdefault(filter_name, [])
+      samples.append([float(temperature), float(focuser_position)])
+      del samples[:-self.FIT_SAMPLES]
+      self.fit(filter_name)
+
+   # fit - fit linear model for filter using least squares
+   # @arguments
+   # filter_name - filter name
+   def fit(self, filter_name):
+      samples = self.samples.get(filter_name, [])
+      n = len(samples)
+      if n < self.MIN_SAMPLES:
+         self.fitted.pop(filter_name, None)
+         return
+      temperatures = [s[0] for s in samples]
+      positions = [s[1] for s in samples]
+      mean_t = sum(temperatures) / n
+      sxx = sum((t - mean_t) ** 2 for t in temperatures)
+      if sxx == 0:
+         self.fitted.pop(filter_name, None)
+         return
+      if numpy is not None:
+         a = numpy.column_stack((numpy.ones(n), numpy.array(temperatures)))
+         solution = numpy.linalg.lstsq(a, numpy.array(positions), rcond=None)[0]
+         position_at_zero, steps_per_degree = float(solution[0]), float(solution[1])
+      else:
+         mean_p = sum(positions) / n
+         steps_per_degree = sum((t - mean_t) * (p - mean_p) for t,p in zip(temperatures, positions)) / sxx
+         position_at_zero = mean_p - steps_per_degree * mean_t
+      residuals = sum((p - position_at_zero - steps_per_degree * t) ** 2 for t,p in zip(temperatures, positions))
+      residual_error = math.sqrt(residuals / (n - 2)) if n > 2 else 0.0
+      self.fitted[filter_name] = [position_at_zero, steps_per_degree, residual_error, mean_t, sxx, min(temperatures), max(temperatures), n]
+
+   # predict - predict focuser position for filter
+   # @arguments
+   # filter_name - filter name
+   # temperature - current temperature
+   #
+   # @return predicted focuser position and standard error in focuser steps or None, None if model is not fitted
+   def predict(self, filter_name, temperature):
+      if temperature is None or filter_name not in self.fitted:
+         return None, None
+      m = self.fitted[filter_name]
+      position = m[0] + m[1] * temperature
+      error = m[2] * math.sqrt(1.0 + 1.0 / m[7] + (temperature - m[3]) ** 2 / m[4])
+      return int(round(position)), error
+
+   # trusted - check if prediction for filter can be used instead of stored position
+   # @arguments
+   # filter_name - filter name
+   # temperature - current temperature
+   #
+   # @return True if prediction can be used
+   def trusted(self, filter_name, temperature):
+      position, error = self.predict(filter_name, temperature)
+      if position is None:
+         return False
+      m = self.fitted[filter_name]
+      if m[6] - m[5] < self.MIN_TEMPERATURE_SPAN:
+         return False
+      if temperature < m[5] - self.TEMPERATURE_MARGIN or temperature > m[6] + self.TEMPERATURE_MARGIN:
+         return False
+      return error <= self.max_error
+
+   # description - describe fitted model for filter for log
+   # @arguments
+   # filter_name - filter name
+   #
+   # @return text with model parameters
+   def description(self, filter_name):
+      if filter_name not in self.fitted:
+         return '%s not fitted (%d results)' % (filter_name, len(self.samples.get(filter_name, [])))
+      m = self.fitted[filter_name]
+      return '%s %.1f steps/C residual %.1f steps temperatures %.1f..%.1fC (%d results)' % (filter_name, m[1], m[2], m[5], m[6], m[7])
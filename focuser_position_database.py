@@ -0,0 +1,833 @@
+# focuser_position_database.py
+# SPDX-FileCopyrightText: 2025 Jan Bielanski
+# SPDX-License-Identifier: GPL-3.0-or-later
+# https://github.com/JBielanski/CCDCiel_Scripts
+#
+# ---------------------------------------------------------------------------- #
+# Module with database of focuser positions per filter used by
+# focuser_position_per_filter script
+# - repository which loads whole 'filters_focuser_position' table once per run
+# - bulk upsert of calculated positions in one transaction
+# - streaming writer with group commit
+# - database opened in WAL mode with busy timeout, connection reused during run
+# - cross-process advisory lock which queues writers
+# - append-only history of autofocus results with retention policy
+# - timing spans of run phases stored per run with duration statistics
+# - fingerprint of filters offsets applied in CCDciel per instance and filters
+# - rig profiles, focus table and focus history rows keyed by (profile, filter)
+# - version of database changed by other processes for long running users
+#
+# Module is not a script, it must be installed as *.py file next to scripts
+# in CCDCiel directory (see Makefile target 'modules').
+#
+# List of changes:
+# [17-10-2026] Initial version, focus table repository
+# [17-10-2026] Added bulk upsert in one transaction and group commit writer
+# [17-10-2026] Added WAL mode, busy timeout, reusable connection and writers lock
+# [17-10-2026] Added focus history table
+# [17-10-2026] Added time of latest autofocus per filter read from focus history
+# [17-10-2026] Added mean autofocus duration per filter read from focus history
+# [17-10-2026] Added timing spans of run phases in runs tables with p50/p95 statistics
+# [17-10-2026] Added fingerprint of applied filters offsets
+# [17-10-2026] Added rig profiles in focus table and focus history, database upgrade
+# [17-10-2026] Removed group commit writer without users, rows of run are stored in one transaction
+# [17-10-2026] Added database version changed by commits of other connections and by replaced database file
+# [17-10-2026] Fingerprint of applied offsets trusted for limited time, fingerprints removed by other writers of offsets
+# [17-10-2026] Group commit writer restored, rows are buffered and every group is stored in one transaction,
+#              writer is used by bulk upsert of focus table and by focus history
+# ---------------------------------------------------------------------------- #
+#
+
+import json
+import os
+import sqlite3
+import time
+
+BUSY_TIMEOUT = 30.0 # Time in seconds to wait for locked database
+WRITER_LOCK_TIMEOUT = 600.0 # Time in seconds to wait for other writer
+DEFAULT_PROFILE = 'default' # Rig profile of rows stored by script without profiles
+connections = {} # Database path -> reusable connection
+connections_files = {} # Database path -> inode of file opened by reusable connection
+
+# open_database - open new connection to database in WAL mode
+# In WAL mode readers are not blocked by active writer and writer is not
+# blocked by readers. Filesystems which do not support WAL (e.g. network
+# shares) keep default journal mode.
+# @arguments
+# db_path - path to database file
+#
+# @return connection
+# raise sqlite3.Error when database can not be opened
+def open_database(db_path):
+   conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+   try:
+      conn.execute('PRAGMA journal_mode=WAL')
+      conn.execute('PRAGMA synchronous=NORMAL')
+   except sqlite3.Error:
+      pass
+   return conn
+
+# get_database - get reusable connection to database
+# @arguments
+# db_path - path to database file
+#
+# @return connection
+# raise sqlite3.Error when database can not be opened
+def get_database(db_path):
+   conn = connections.get(db_path)
+   if conn is None:
+      conn = open_database(db_path)
+      connections[db_path] = conn
+      connections_files[db_path] = file_inode(db_path)
+   return conn
+
+# file_inode - get inode of file, None when file does not exist
+def file_inode(path):
+   try:
+      return os.stat(path).st_ino
+   except OSError:
+      return None
+
+# database_version - get version of database changed by other connections
+# Version changes when other connection (other process, sqlite3 shell) commits
+# changes to database or when database file is replaced, reusable connection
+# to replaced file is opened again. Changes committed by reusable connection
+# do not change version, so data kept in memory by its users stays valid.
+# @arguments
+# db_path - path to database file
+#
+# @return version, None when database can not be read
+def database_version(db_path):
+   if db_path in connections and connections_files.get(db_path) != file_inode(db_path):
+      try:
+         connections.pop(db_path).close()
+      except sqlite3.Error:
+         pass
+   try:
+      conn = get_database(db_path)
+      return (connections_files.get(db_path), conn.execute('PRAGMA data_version').fetchone()[0])
+   except sqlite3.Error:
+      return None
+
+# close_databases - close all reusable connections
+def close_databases():
+   for db_path in list(connections.keys()):
+      try:
+         connections.pop(db_path).close()
+      except sqlite3.Error:
+         pass
+   connections_files.clear()
+
+# table_columns - get columns of table
+# @arguments
+# conn - connection to database
+# table - table name
+#
+# @return list of columns names, empty list if table does not exist
+def table_columns(conn, table):
+   return [c[1] for c in conn.execute('PRAGMA table_info(%s)' % (table)).fetchall()]
+
+# upgrade_database - upgrade tables created by older version of script
+# Focus table keyed by filter name is rebuilt with (profile, filter) key and
+# profile column is added to focus history, existing rows belong to
+# DEFAULT_PROFILE. Database is changed only when upgrade is needed.
+# @arguments
+# db_path - path to database file
+#
+# @return status
+# 0 - success
+# 31 - can not open or upgrade database
+def upgrade_database(db_path):
+   try:
+      conn = get_database(db_path)
+      focus_columns = table_columns(conn, 'filters_focuser_position')
+      history_columns = table_columns(conn, 'focus_history')
+      if (len(focus_columns) == 0 or 'profile' in focus_columns) and (len(history_columns) == 0 or 'profile' in history_columns):
+         return 0
+      with WriterLock(db_path), conn:
+         cursor = conn.cursor()
+         cursor.execute('BEGIN IMMEDIATE')
+         # Columns are read again, database could be upgraded by other writer
+         focus_columns = table_columns(conn, 'filters_focuser_position')
+         if len(focus_columns) > 0 and 'profile' not in focus_columns:
+            cursor.execute('ALTER TABLE filters_focuser_position RENAME TO filters_focuser_position_old')
+            FocusRepository(db_path).create_table(cursor)
+            selected = ['filter_name'] + [c if c in focus_columns else 'NULL' for c in FocusRepository.COLUMNS]
+            cursor.execute('INSERT INTO filters_focuser_position (profile, filter_name, %s) SELECT ?, %s FROM filters_focuser_position_old'
+                           % (', '.join(FocusRepository.COLUMNS), ', '.join(selected)), (DEFAULT_PROFILE,))
+            cursor.execute('DROP TABLE filters_focuser_position_old')
+         history_columns = table_columns(conn, 'focus_history')
+         if len(history_columns) > 0 and 'profile' not in history_columns:
+            cursor.execute("ALTER TABLE focus_history ADD COLUMN profile TEXT NOT NULL DEFAULT '%s'" % (DEFAULT_PROFILE))
+            cursor.execute('DROP INDEX IF EXISTS focus_history_filter_timestamp')
+            FocusHistory(db_path).create_table(cursor)
+   except sqlite3.Error:
+      return 31
+   return 0
+
+# WriterLock - cross-process advisory lock for database writers
+#
+# Lock is taken on '<database>.lock' file. Writer waits in queue until other
+# writer finish instead of failing on locked database. Readers do not take
+# the lock. Used as context manager:
+#   with WriterLock(db_path):
+#      ...
+class WriterLock:
+   def __init__(self, db_path, timeout=WRITER_LOCK_TIMEOUT):
+      self.lock_path = db_path + '.lock' # Path to lock file
+      self.timeout = timeout # Time in seconds to wait for lock
+      self.lock_file = None # Opened lock file
+
+   def __enter__(self):
+      self.acquire()
+      return self
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      self.release()
+      return False
+
+   # acquire - wait for lock
+   # raise sqlite3.OperationalError when lock can not be taken during timeout
+   def acquire(self):
+      try:
+         self.lock_file = open(self.lock_path, 'a+')
+      except OSError as e:
+         raise sqlite3.OperationalError('can not open lock file %s: %s' % (self.lock_path, str(e)))
+      deadline = time.monotonic() + self.timeout
+      interval = 0.05
+      while True:
+         try:
+            self.try_lock()
+            return
+         except OSError:
+            if time.monotonic() >= deadline:
+               self.lock_file.close()
+               self.lock_file = None
+               raise sqlite3.OperationalError('database writer lock %s not released during %ds' % (self.lock_path, self.timeout))
+            time.sleep(interval)
+            interval = min(interval * 2, 1.0)
+
+   # try_lock - take lock without waiting
+   # raise OSError when lock is taken by other process
+   def try_lock(self):
+      if os.name == 'nt':
+         import msvcrt
+         self.lock_file.seek(0)
+         msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+      else:
+         import fcntl
+         fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+   # release - release lock
+   def release(self):
+      if self.lock_file is None:
+         return
+      try:
+         if os.name == 'nt':
+            import msvcrt
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+         else:
+            import fcntl
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+      finally:
+         self.lock_file.close()
+         self.lock_file = None
+
+# GroupCommitWriter - stream rows into database with group commit
+#
+# Rows are buffered as soon as they are provided and every group_size rows
+# are stored by one executemany() in one transaction, so rows of group share
+# one disk synchronization. Rows left in buffer are stored by close(). Writer
+# lock and database write lock are held only while group is stored, not
+# between writes.
+class GroupCommitWriter:
+   def __init__(self, db_path, statement, group_size=32, prepare=None):
+      self.db_path = db_path # Path to database file
+      self.statement = statement # SQL statement with parameters for one row
+      self.group_size = group_size # Number of rows in one transaction, 0 - all rows in one transaction stored by close()
+      self.prepare = prepare # Function called with cursor in every transaction before rows are stored, e.g. create table
+      self.rows = [] # Rows not stored yet
+
+   # write - write one row, group is stored when it is complete
+   # @arguments
+   # row - parameters for SQL statement
+   #
+   # @return status
+   # 0 - success
+   # 31 - can not open database or store group
+   def write(self, row):
+      self.rows.append(tuple(row))
+      if self.group_size > 0 and len(self.rows) >= self.group_size:
+         return self.commit()
+      return 0
+
+   # commit - store buffered rows in one transaction
+   # Rows are kept in buffer when they can not be stored.
+   # @return status, see write()
+   def commit(self):
+      if len(self.rows) == 0:
+         return 0
+      try:
+         conn = get_database(self.db_path)
+         with WriterLock(self.db_path), conn:
+            cursor = conn.cursor()
+            if self.prepare is not None:
+               self.prepare(cursor)
+            cursor.executemany(self.statement, self.rows)
+      except sqlite3.Error:
+         return 31
+      self.rows = []
+      return 0
+
+   # close - store rows left in buffer
+   # @return status, see write()
+   def close(self):
+      return self.commit()
+
+# FocusRepository - in-memory copy of 'filters_focuser_position' table for rig profile
+#
+# Rows are keyed by (profile, filter name). Rows of profile are read by one
+# query and kept as dictionary:
+#   filter name -> [focuser position, reference flag, offset, usage flag]
+# Rows can be indexed by filter wheel slot by slots().
+class FocusRepository:
+   COLUMNS = ('focuser_position', 'reference_flag', 'offset_for_filter', 'usage_flag') # Columns with filter data
+
+   def __init__(self, db_path, profile=DEFAULT_PROFILE):
+      self.db_path = db_path # Path to database file
+      self.profile = profile # Rig profile
+      self.rows = None # Filter name -> [focuser position, reference flag, offset, usage flag], None - not loaded
+      self.usage_flag_column = True # False for old databases without usage flag column
+
+   # load - read rows of profile from database
+   # @return status
+   # 0 - success
+   # 31 - can not open database
+   # 32 - can not read table
+   def load(self):
+      self.rows = {}
+      try:
+         conn = get_database(self.db_path)
+      except sqlite3.Error:
+         return 31
+      try:
+         columns = table_columns(conn, 'filters_focuser_position')
+         if len(columns) == 0:
+            return 32
+         self.usage_flag_column = 'usage_flag' in columns
+         selected = ['filter_name'] + [c if c in columns else 'NULL' for c in self.COLUMNS]
+         for r in conn.execute('SELECT %s FROM filters_focuser_position WHERE profile = ?' % (', '.join(selected)), (self.profile,)):
+            self.rows[r[0]] = list(r[1:])
+      except sqlite3.Error:
+         return 32
+      return 0
+
+   # profiles - read filters names of all profiles
+   # @return status, profile -> list of filters names
+   # 0 - success
+   # 31 - can not open database
+   # 32 - can not read table
+   def profiles(self):
+      try:
+         conn = get_database(self.db_path)
+      except sqlite3.Error:
+         return 31, {}
+      try:
+         if len(table_columns(conn, 'filters_focuser_position')) == 0:
+            return 0, {}
+         profiles = {} # Profile -> list of filters names
+         for r in conn.execute('SELECT profile, filter_name FROM filters_focuser_position ORDER BY profile, filter_name'):
+            profiles.setdefault(r[0], []).append(r[1])
+      except sqlite3.Error:
+         return 32, {}
+      return 0, profiles
+
+   # get - get data for selected filter
+   # @arguments
+   # filter_name - name of filter
+   #
+   # @return status, array with: focuser_position, reference flag, filter offset and filter usage flag
+   # 0 - no error / success
+   # 32 - no data for selected filter
+   # 33 - no focuser position for selected filter
+   # 34 - no reference flag for selected filter
+   # 35 - no offset for selected filter
+   # 36 - no reference flag and offset for selected filter
+   def get(self, filter_name):
+      row = self.rows.get(filter_name) if self.rows is not None else None
+      if row is None:
+         return 32, [0, 0, 0, 0]
+
+      data = [0 if v is None else v for v in row]
+      if row[3] is None:
+         data[3] = 1 # Filter without usage flag is in use
+
+      if row[0] is None and row[1] is None and row[2] is None:
+         status = 32
+      elif row[1] is None and row[2] is None:
+         status = 36
+      elif row[0] is None:
+         status = 33
+      elif row[1] is None:
+         status = 34
+      elif row[2] is None:
+         status = 35
+      else:
+         status = 0
+      return status, data
+
+   # create_table - create focus table if it does not exist
+   def create_table(self, cursor):
+      cursor.execute('''CREATE TABLE IF NOT EXISTS filters_focuser_position (
+                        profile TEXT NOT NULL DEFAULT '%s',
+                        filter_name TEXT NOT NULL,
+                        focuser_position INTEGER,
+                        reference_flag INTEGER,
+                        offset_for_filter INTEGER,
+                        usage_flag INTEGER,
+                        PRIMARY KEY (profile, filter_name)
+                     )''' % (DEFAULT_PROFILE))
+
+   # prepare_table - create focus table and upgrade table created by older version of script
+   def prepare_table(self, cursor):
+      self.create_table(cursor)
+      columns = table_columns(cursor.connection, 'filters_focuser_position')
+      if 'usage_flag' not in columns:
+         cursor.execute('ALTER TABLE filters_focuser_position ADD COLUMN usage_flag INTEGER')
+
+   # store_all - insert or update data for all filters in one transaction
+   # Either all rows are stored or none of them, so data from two different
+   # runs are never mixed in database.
+   # @arguments
+   # rows - list with filter name, focuser position, reference flag, offset and usage flag for each filter
+   #
+   # @return status
+   # 0 - success
+   # 31 - can not open database or store data
+   def store_all(self, rows):
+      # All rows are one group, group is stored by close()
+      writer = GroupCommitWriter(self.db_path, '''INSERT INTO filters_focuser_position (profile, filter_name, focuser_position, reference_flag, offset_for_filter, usage_flag)
+                                                  VALUES (?, ?, ?, ?, ?, ?)
+                                                  ON CONFLICT(profile, filter_name) DO UPDATE SET focuser_position=excluded.focuser_position,
+                                                                                                  reference_flag=excluded.reference_flag,
+                                                                                                  offset_for_filter=excluded.offset_for_filter,
+                                                                                                  usage_flag=excluded.usage_flag''',
+                                 group_size=0, prepare=self.prepare_table)
+      for r in rows:
+         writer.write([self.profile] + list(r[0:5]))
+      if writer.close() != 0:
+         return 31
+
+      # Keep data in memory up to date
+      self.usage_flag_column = True
+      for r in rows:
+         self.put(r[0], r[1:5])
+      return 0
+
+   # put - update data for selected filter after it has been stored in database
+   # @arguments
+   # filter_name - name of filter
+   # data - array with: focuser_position, reference flag, filter offset and filter usage flag
+   def put(self, filter_name, data):
+      if self.rows is None:
+         self.rows = {}
+      self.rows[filter_name] = list(data)
+
+   # slots - get data indexed by filter wheel slots
+   # @arguments
+   # list_of_filters - list of filters names in filter wheel
+   #
+   # @return list with status and data for each slot, see get()
+   def slots(self, list_of_filters):
+      return [self.get(f) for f in list_of_filters]
+
+# FocusHistory - append-only history of autofocus results
+#
+# Every autofocus result is stored in 'focus_history' table with time,
+# temperatures and autofocus duration for rig profile. Table has index on
+# (profile, filter, time) for fast time range queries per filter. Rows older
+# than retention time are removed when new rows are added.
+class FocusHistory:
+   COLUMNS = ('timestamp', 'filter_name', 'focuser_position', 'offset_for_filter', 'reference_filter', 'autofocus_type', 'ccd_temperature', 'ambient_temperature', 'duration') # Columns of history row
+   DEFAULT_RETENTION_DAYS = 3650 # Default retention time in days, 0 - keep all rows
+
+   def __init__(self, db_path, retention_days=DEFAULT_RETENTION_DAYS, profile=DEFAULT_PROFILE):
+      self.db_path = db_path # Path to database file
+      self.retention_days = retention_days # Retention time in days
+      self.profile = profile # Rig profile
+
+   # create_table - create history table and indexes if they do not exist
+   def create_table(self, cursor):
+      cursor.execute('''CREATE TABLE IF NOT EXISTS focus_history (
+                        timestamp REAL NOT NULL,
+                        filter_name TEXT NOT NULL,
+                        focuser_position INTEGER,
+                        offset_for_filter INTEGER,
+                        reference_filter TEXT,
+                        autofocus_type TEXT,
+                        ccd_temperature REAL,
+                        ambient_temperature REAL,
+                        duration REAL,
+                        profile TEXT NOT NULL DEFAULT '%s'
+                     )''' % (DEFAULT_PROFILE))
+      cursor.execute('CREATE INDEX IF NOT EXISTS focus_history_profile_filter_timestamp ON focus_history (profile, filter_name, timestamp)')
+      cursor.execute('CREATE INDEX IF NOT EXISTS focus_history_timestamp ON focus_history (timestamp)')
+
+   # prepare_table - create history table and apply retention policy
+   def prepare_table(self, cursor):
+      self.create_table(cursor)
+      if self.retention_days > 0:
+         cursor.execute('DELETE FROM focus_history WHERE timestamp < ?', (time.time() - self.retention_days * 86400.0,))
+
+   # writer - streaming writer of history rows with group commit
+   # @arguments
+   # group_size - number of rows in one transaction, see GroupCommitWriter
+   #
+   # @return writer, rows written by writer are lists with values for COLUMNS
+   # preceded by profile
+   def writer(self, group_size=32):
+      return GroupCommitWriter(self.db_path, 'INSERT INTO focus_history (profile, %s) VALUES (?, %s)' % (', '.join(self.COLUMNS), ', '.join(['?'] * len(self.COLUMNS))),
+                               group_size=group_size, prepare=self.prepare_table)
+
+   # append_all - append rows to history with group commit and apply retention policy
+   # @arguments
+   # rows - list of rows with values for COLUMNS, rows are stored for profile
+   #
+   # @return status
+   # 0 - success
+   # 31 - can not open database or store data
+   def append_all(self, rows):
+      writer = self.writer()
+      for r in rows:
+         if writer.write([self.profile] + list(r)) != 0:
+            return 31
+      return writer.close()
+
+   # query - read history rows of profile
+   # @arguments
+   # filter_name - name of filter, None - all filters
+   # start - begin of time range (seconds since epoch), None - no limit
+   # end - end of time range (seconds since epoch), None - no limit
+   #
+   # @return status, list of rows with values for COLUMNS ordered by time
+   # 0 - success
+   # 32 - can not read history
+   def query(self, filter_name=None, start=None, end=None):
+      conditions = ['profile = ?']
+      params = [self.profile]
+      if filter_name is not None:
+         conditions.append('filter_name = ?')
+         params.append(filter_name)
+      if start is not None:
+         conditions.append('timestamp >= ?')
+         params.append(start)
+      if end is not None:
+         conditions.append('timestamp <= ?')
+         params.append(end)
+      sql = 'SELECT %s FROM focus_history WHERE %s ORDER BY timestamp' % (', '.join(self.COLUMNS), ' AND '.join(conditions))
+      try:
+         conn = get_database(self.db_path)
+         if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'focus_history'").fetchone() is None:
+            return 0, []
+         return 0, [list(r) for r in conn.execute(sql, params)]
+      except sqlite3.Error:
+         return 32, []
+
+   # latest - read time of latest autofocus result for each filter of profile
+   # @return status, filter name -> time of latest result (seconds since epoch)
+   # 0 - success
+   # 32 - can not read history
+   def latest(self):
+      try:
+         conn = get_database(self.db_path)
+         if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'focus_history'").fetchone() is None:
+            return 0, {}
+         return 0, dict(conn.execute('SELECT filter_name, MAX(timestamp) FROM focus_history WHERE profile = ? GROUP BY filter_name', (self.profile,)).fetchall())
+      except sqlite3.Error:
+         return 32, {}
+
+   # mean_durations - read mean autofocus duration for each filter of profile
+   # @arguments
+   # start - begin of time range (seconds since epoch), None - no limit
+   #
+   # @return status, filter name -> mean autofocus duration in seconds
+   # 0 - success
+   # 32 - can not read history
+   def mean_durations(self, start=None):
+      try:
+         conn = get_database(self.db_path)
+         if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'focus_history'").fetchone() is None:
+            return 0, {}
+         return 0, dict(conn.execute('SELECT filter_name, AVG(duration) FROM focus_history WHERE profile = ? AND duration IS NOT NULL AND timestamp >= ? GROUP BY filter_name', (self.profile, start if start is not None else 0)).fetchall())
+      except sqlite3.Error:
+         return 32, {}
+
+# percentile - percentile of values with linear interpolation
+# @arguments
+# values - list of numbers
+# fraction - percentile as fraction (0.5 - median)
+#
+# @return percentile or None for empty list
+def percentile(values, fraction):
+   if len(values) == 0:
+      return None
+   values = sorted(values)
+   position = fraction * (len(values) - 1)
+   lower = int(position)
+   upper = min(lower + 1, len(values) - 1)
+   return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+# RunSpan - timing span of one phase, see RunSpans.begin()
+class RunSpan:
+   def __init__(self, runs, phase, filter_name):
+      self.runs = runs # Owner of span
+      self.phase = phase # Phase name
+      self.filter_name = filter_name # Filter label, None - phase not related to filter
+      self.start = time.monotonic() # Start of span
+      self.ended = False # Span recorded
+
+   # end - end span and record its duration
+   # @arguments
+   # status - outcome status code of phase
+   #
+   # @return status
+   def end(self, status=0):
+      if not self.ended:
+         self.ended = True
+         self.runs.record(self.phase, self.filter_name, self.start, time.monotonic() - self.start, status)
+      return status
+
+# RunSpans - timing spans of run phases
+#
+# Every phase of run (preflight, database read, filter change, focuser move,
+# autofocus, offsets application, database write) is recorded as span with
+# duration, filter label and outcome status code:
+#   0 - success, 1 - failed without own error code (autofocus, offsets),
+#   11-36 - error codes of script
+# Spans are kept in memory and stored by save() in one transaction: one row
+# in 'runs' table and rows for spans in 'run_spans' table. Run which ended
+# by critical error is stored with completed flag 0. Statistics of phases
+# (p50/p95 duration per phase and filter) are read across runs by statistics().
+class RunSpans:
+   PHASES = ('preflight', 'db_read', 'filter_change', 'focuser_move', 'autofocus', 'offsets', 'db_write') # Recorded phases in run order
+   RECENT_RUNS = 10 # Number of latest runs used for recent median in statistics
+   SAVE_LOCK_TIMEOUT = 5.0 # Spans are not stored when other writer holds database longer
+
+   def __init__(self, db_path, mode=None):
+      self.db_path = db_path # Path to database file
+      self.mode = mode # Working mode of run
+      self.timestamp = time.time() # Start of run (seconds since epoch)
+      self.start = time.monotonic() # Start of run
+      self.spans = [] # [phase, filter name, start offset, duration, status]
+      self.status = 0 # Latest failed status of spans
+      self.saved = False # Run stored in database
+
+   # begin - start span of phase
+   # @arguments
+   # phase - phase name, one of PHASES
+   # filter_name - filter label, None - phase not related to filter
+   #
+   # @return span, finished by span.end(status)
+   def begin(self, phase, filter_name=None):
+      return RunSpan(self, phase, filter_name)
+
+   # record - record finished span, spans can be recorded by concurrent moves
+   def record(self, phase, filter_name, start, duration, status):
+      self.spans.append([phase, filter_name, start - self.start, duration, status])
+      if status != 0:
+         self.status = status
+
+   # create_table - create runs and spans tables if they do not exist
+   def create_table(self, cursor):
+      cursor.execute('''CREATE TABLE IF NOT EXISTS runs (
+                        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        timestamp REAL NOT NULL,
+                        mode TEXT,
+                        duration REAL,
+                        status INTEGER,
+                        completed INTEGER
+                     )''')
+      cursor.execute('''CREATE TABLE IF NOT EXISTS run_spans (
+                        run_id INTEGER NOT NULL,
+                        phase TEXT NOT NULL,
+                        filter_name TEXT,
+                        start REAL,
+                        duration REAL,
+                        status INTEGER
+                     )''')
+      cursor.execute('CREATE INDEX IF NOT EXISTS run_spans_phase ON run_spans (phase, filter_name, run_id)')
+
+   # save - store run and its spans in one transaction, run is stored only once
+   # @arguments
+   # completed - 1 - run finished normally, 0 - run ended by critical error
+   #
+   # @return status
+   # 0 - success
+   # 31 - can not open database or store data
+   def save(self, completed=0):
+      if self.saved or len(self.spans) == 0:
+         return 0
+      try:
+         conn = get_database(self.db_path)
+         with WriterLock(self.db_path, self.SAVE_LOCK_TIMEOUT), conn:
+            cursor = conn.cursor()
+            self.create_table(cursor)
+            cursor.execute('INSERT INTO runs (timestamp, mode, duration, status, completed) VALUES (?, ?, ?, ?, ?)',
+                           (self.timestamp, self.mode, time.monotonic() - self.start, self.status, completed))
+            run_id = cursor.lastrowid
+            cursor.executemany('INSERT INTO run_spans (run_id, phase, filter_name, start, duration, status) VALUES (?, ?, ?, ?, ?, ?)',
+                               [tuple([run_id] + s) for s in self.spans])
+      except sqlite3.Error:
+         return 31
+      self.saved = True
+      return 0
+
+   # statistics - duration statistics of phases across runs
+   # @arguments
+   # start - begin of time range (seconds since epoch), None - all runs
+   #
+   # @return status, list of [phase, filter name, runs, spans, failed spans, p50, p95, max, recent p50]
+   #         ordered by phase and filter, filter name None for all filters of phase,
+   #         recent p50 is median of latest RECENT_RUNS runs
+   # 0 - success
+   # 32 - can not read spans
+   def statistics(self, start=None):
+      try:
+         conn = get_database(self.db_path)
+         if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'run_spans'").fetchone() is None:
+            return 0, []
+         rows = conn.execute('''SELECT s.run_id, s.phase, s.filter_name, s.duration, s.status FROM run_spans s JOIN runs r ON r.run_id = s.run_id
+                                WHERE r.timestamp >= ? ORDER BY s.run_id''', (start if start is not None else 0,)).fetchall()
+      except sqlite3.Error:
+         return 32, []
+
+      groups = {} # (phase, filter name) -> rows of spans
+      for r in rows:
+         groups.setdefault((r[1], None), []).append(r)
+         if r[2] is not None:
+            groups.setdefault((r[1], r[2]), []).append(r)
+      statistics = []
+      order = lambda k: (self.PHASES.index(k[0]) if k[0] in self.PHASES else len(self.PHASES), k[0], k[1] is not None, k[1] or '')
+      for key in sorted(groups.keys(), key=order):
+         spans = groups[key]
+         durations = [s[3] for s in spans]
+         recent_runs = sorted(set(s[0] for s in spans))[-self.RECENT_RUNS:]
+         recent = [s[3] for s in spans if s[0] >= recent_runs[0]]
+         statistics.append([key[0], key[1], len(set(s[0] for s in spans)), len(spans), len([s for s in spans if s[4] != 0]),
+                            percentile(durations, 0.5), percentile(durations, 0.95), max(durations), percentile(recent, 0.5)])
+      return 0, statistics
+
+# AppliedOffsets - fingerprint of filters offsets applied in CCDciel
+#
+# Offsets set by script are stored in 'applied_offsets' table with CCDciel
+# instance and filters names as key, so next run sends only offsets which
+# differ from applied ones. Offset which could not be set is forgotten and
+# sent again by next run. Offsets changed in CCDciel by hand or by restart of
+# CCDciel are not known, fingerprint is trusted for MAX_AGE since it was
+# started and writers of offsets which do not keep it call
+# forget_applied_offsets().
+class AppliedOffsets:
+   MAX_AGE = 43200.0 # Time in seconds after which fingerprint is not trusted and all offsets are set again
+
+   def __init__(self, db_path, instance, filters):
+      self.db_path = db_path # Path to database file
+      self.instance = instance # CCDciel instance (version and JSON-RPC address)
+      self.filters = list(filters) # Filters names in filter wheel order
+      self.offsets = {} # Filter name -> applied offset
+      self.timestamp = None # Time when fingerprint was started, None - not stored
+
+   # create_table - create applied offsets table if it does not exist
+   def create_table(self, cursor):
+      cursor.execute('''CREATE TABLE IF NOT EXISTS applied_offsets (
+                        instance TEXT NOT NULL,
+                        filters TEXT NOT NULL,
+                        offsets TEXT,
+                        timestamp REAL,
+                        PRIMARY KEY (instance, filters)
+                     )''')
+
+   # load - read applied offsets for instance and filters
+   # @return status
+   # 0 - success, no offsets known when fingerprint is not stored or is older than MAX_AGE
+   # 31 - can not open database
+   # 32 - can not read fingerprint
+   def load(self):
+      self.offsets = {}
+      self.timestamp = None
+      try:
+         conn = get_database(self.db_path)
+      except sqlite3.Error:
+         return 31
+      try:
+         if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'applied_offsets'").fetchone() is None:
+            return 0
+         row = conn.execute('SELECT offsets, timestamp FROM applied_offsets WHERE instance = ? AND filters = ?', (self.instance, json.dumps(self.filters))).fetchone()
+         if row is not None and row[0] is not None and row[1] is not None and time.time() - row[1] < self.MAX_AGE:
+            self.offsets = dict((k, int(v)) for k,v in json.loads(row[0]).items())
+            self.timestamp = row[1]
+      except (sqlite3.Error, ValueError, AttributeError):
+         return 32
+      return 0
+
+   # changed - select offsets which differ from applied ones
+   # @arguments
+   # filters_offsets - list with filter index, name and offset for each filter
+   #
+   # @return list of items from filters_offsets which must be sent
+   def changed(self, filters_offsets):
+      return [item for item in filters_offsets if self.offsets.get(item[1]) != item[2]]
+
+   # update - record result of offset application
+   # @arguments
+   # filter_name - filter name
+   # offset - applied offset, None - offset not known
+   def update(self, filter_name, offset):
+      if offset is None:
+         self.offsets.pop(filter_name, None)
+      else:
+         self.offsets[filter_name] = int(offset)
+
+   # save - store applied offsets, time when fingerprint was started is kept
+   # @return status
+   # 0 - success
+   # 31 - can not open database or store data
+   def save(self):
+      if self.timestamp is None:
+         self.timestamp = time.time()
+      try:
+         conn = get_database(self.db_path)
+         with WriterLock(self.db_path), conn:
+            cursor = conn.cursor()
+            self.create_table(cursor)
+            cursor.execute('''INSERT INTO applied_offsets (instance, filters, offsets, timestamp) VALUES (?, ?, ?, ?)
+                              ON CONFLICT(instance, filters) DO UPDATE SET offsets=excluded.offsets, timestamp=excluded.timestamp''',
+                           (self.instance, json.dumps(self.filters), json.dumps(self.offsets, sort_keys=True), self.timestamp))
+      except sqlite3.Error:
+         return 31
+      return 0
+
+# forget_applied_offsets - remove fingerprints of applied offsets of all CCDciel instances
+# Called by writers of filters offsets which do not keep fingerprint (reset of offsets,
+# full application of offsets, end of session), so next run sets all offsets. Database
+# which does not exist is not created and database without fingerprints is not changed.
+# @arguments
+# db_path - path to database file
+#
+# @return status
+# 0 - success
+# 31 - can not open database or remove data
+def forget_applied_offsets(db_path):
+   if not os.path.exists(db_path):
+      return 0
+   try:
+      conn = get_database(db_path)
+      if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'applied_offsets'").fetchone() is None:
+         return 0
+      if conn.execute('SELECT 1 FROM applied_offsets LIMIT 1').fetchone() is None:
+         return 0
+      with WriterLock(db_path), conn:
+         conn.execute('DELETE FROM applied_offsets')
+   except sqlite3.Error:
+      return 31
+   return 0
@@ -12,6 +12,11 @@
 # -- 'CALCULATE' [default] calculate focuser position for all filters in filter wheel and store in database
 # -- 'READ' read configuration for focuser and filters from database
 # -- 'RESET' reset focuser position to 0, set first filter in filters wheel, remove all offsets for filters
+# -- 'INCREMENTAL' calculate focuser position for reference filter and only for filters which moved or have old data
+# -- 'REPORT' log p50/p95 duration of run phases per filter from previous runs
+# - rig profiles, several telescopes share one database, profile selected by argument or detected from filters in filter wheel
+# - optional daemon mode (--daemon) which keeps database, models and device information warm,
+#   script started later with --usedaemon sends its arguments to daemon over local socket
 # Script use the CCDciel JSON-RPC interface.
 # For more information and reference of the available methods see: 
 # https://www.ap-i.net/ccdciel/en/documentation/jsonrpc_reference
@@ -53,11 +58,63 @@
 # - selection reference filter by name and index can not be use together, use: --filtername, -n <filter name> OR --filterid, -i <filter index>
 # [15-11-2025]
 # - RESET - remove all offsets, set filter wheel on FIRST position, set focuser on ZERO position
+# [17-10-2026]
+# - added per-run device metadata cache (filters names, filter index, CCDciel version), needs ccdciel_rpc.py module
+# - filters offsets and related logs are send to CCDciel as JSON-RPC batch requests
+# - focuser and filter wheel moves use shared wait engine with monotonic deadlines and adaptive polling
+# - fixed restoring initial filter when filter wheel can not be set
+# - duration of focuser and filter wheel moves is recorded in database, learned kinematics model sets moves timeouts and poll schedules, needs ccdciel_motion.py module
+# - focus table is read from database by one query once per run, needs focuser_position_database.py module
+# - calculated positions for all filters are stored in database in one transaction
+# - database opened in WAL mode with busy timeout and reused connection, writers queued by cross-process lock
+# - every autofocus result is appended to focus history in database with time, temperatures and autofocus duration
+# - fixed autofocus type provided by --focustype, -t argument
+# - focuser position predicted from temperature by model fitted per filter from focus history is used in READ mode and
+#   when filter is selected, maximal standard error of used prediction: --predictionerror, -e <focuser steps, 0 - disabled>,
+#   needs focus_prediction.py module, NumPy is used when installed
+# - added working mode INCREMENTAL: autofocus only reference filter, other filters in use are calculated only when
+#   reference filter moved more than --tolerance, -o <focuser steps> or their latest autofocus is older than
+#   --maxage, -a <days>, for other filters stored positions are shifted and offsets carried forward
+# - filters are visited in order planned to minimise filter wheel rotation and focuser travel, reference filter first,
+#   estimated savings against filter wheel order are logged
+# - focuser final approach from one direction: --approach, -p <OUT (default), IN> with overshoot for backlash:
+#   --backlash, -b <focuser steps, 0 - disabled (default)>, focuser moves before autofocus are deferred and
+#   back-to-back moves are merged
+# - filter wheel rotation and focuser move are done at the same time, restore of initial positions is kept for both
+# [17-10-2026] Optional per-method RPC metrics (CCDCIEL_METRICS or --metrics <file>), needs ccdciel_rpc.py module
+# [17-10-2026] Logs buffered and send in batches by background thread, DEBUG messages off by default, optional
+#              rotating log file (CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel, --logfile), needs ccdciel_log.py module
+# [17-10-2026] Lazy startup, --help and invalid arguments end script without any RPC and without import of database
+#              modules (sqlite3, NumPy), CCDciel version read when it is needed first time
+# [17-10-2026] Added daemon mode: --daemon runs script as focus manager daemon with local request socket, script
+#              forwards its arguments to running daemon, --local runs script without daemon, --stopdaemon stops
+#              daemon, needs ccdciel_daemon.py module
+# [17-10-2026] READ mode sets only offsets which differ from offsets applied by previous run, fingerprint of applied
+#              offsets stored in database per CCDciel instance and filters names, offsets are reset only for
+#              current and selected filter before filter change
+# [17-10-2026] Rig profiles in one database: focus table and focus history keyed by (profile, filter), profile selected
+#              by --profile, -r or detected from filters in filter wheel, database created by older version upgraded
+# [17-10-2026] Timing spans of run phases with filter labels and status codes stored in database (runs, run_spans),
+#              added working mode REPORT with p50/p95 duration of phases across runs
+# [17-10-2026] INCREMENTAL mode without reference filter flagged in database uses filter with most recent autofocus
+#              or current filter as reference filter instead of calculating all filters
+# [17-10-2026] Daemon reads focus table, applied offsets and models again when database was changed by other process
+# [17-10-2026] Arguments are forwarded to running daemon only with --usedaemon, script runs without daemon by default,
+#              daemon rejects request for other CCDciel instance and logs run with log level and file of script
+# [17-10-2026] Fingerprint of applied offsets used only by READ mode, it is forgotten when offsets are set by other
+#              modes, by end_session_indi script or at daemon start and it is trusted for 12 hours
+# [17-10-2026] Filter wheel and focuser are moved one after other when filters offsets can move focuser during filter
+#              change, critical errors of moves done at the same time end script in main thread
+# [17-10-2026] Backlash overshoot position limited by maximal focuser position: --maxposition, -x <focuser steps>
 # ---------------------------------------------------------------------------- #
 #
 
 from ccdciel import ccdciel
-import sqlite3
+from ccdciel_rpc import BatchClient, DeviceCache, ccdciel_address, enable_metrics, response_error, wait_for_value
+from ccdciel_log import enable_log_sink, flush_log, log_options, set_log_options
+from ccdciel_daemon import RequestServer, address_name, daemon_address, send_request
+import atexit
+import copy
 import os
 import sys
 import time
@@ -80,53 +137,116 @@ import time
 # 36  - cannot read reference flag and offset for selected filter
 #
 
+# Enable RPC metrics when CCDCIEL_METRICS or --metrics <file> is provided
+ccdciel = enable_metrics(ccdciel)
+
+# Buffer logs, DEBUG level and local log file are enabled by CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel <level>, --logfile <file>
+ccdciel = enable_log_sink(ccdciel)
+
 # GLOBAL VARIABLES
 this_script_path = os.path.abspath(__file__) # Path to this script
 this_script_dir = os.path.dirname(this_script_path) # Directory of this script
-ccdciel_version = ccdciel('CCDciel_Version')['result'] # Main version, short revision, full revision stored in array
+device_cache = DeviceCache(ccdciel) # Per-run cache of static device metadata
+rpc_batch = BatchClient(ccdciel) # Client for sending bursts of calls as batch requests
 initial_focuser_position = 0 # Initial focuser position
 filters_and_focuser_positions_database_file = 'focuser_position_per_filter.db' # Name of file with filters and focuser positions
 filters_and_focuser_positions_database_directory = this_script_dir # Directory with database file
+profile_name = None # Rig profile provided by argument, None - profile detected from filters in filter wheel
+focus_profile = None # Rig profile of current run, rows of focus table and focus history are selected by profile
 filter_name_to_set = ['', 0, None, None] # Filter name and position provided by user otherwise used reference filter or current filter in filter wheel
 filters_subset = [] # List of selected filters for which autofocus will be performed provided by argument
-script_working_mode = 0 # Script working mode, 0 - calculate focuser position for all filters in filter wheel, 1 - read focuser position for selected filter from database
+script_working_mode = 0 # Script working mode, 0 - calculate focuser position for all filters in filter wheel, 1 - read focuser position for selected filter from database, 2 - reset, 3 - incremental calculation, 4 - report
+focuser_overshoot = 0 # Overshoot in focuser steps used to take up backlash, 0 - disabled
+focuser_approach = 1 # Direction of final focuser approach, 1 - OUT (increasing position), -1 - IN (decreasing position)
+focuser_max_position = 0 # Maximal focuser position in steps, overshoot is limited to it, 0 - not limited
+pending_focuser_position = None # Deferred focuser position, None - no deferred move
+pending_focuser_filter = None # Filter label of deferred focuser move
+drift_tolerance = 20 # INCREMENTAL mode, maximal shift of reference filter in focuser steps for which other filters are not calculated
+max_data_age = 30.0 # INCREMENTAL mode, maximal age of latest autofocus result for filter in days
 focus_type = 0 # Autofocus type AUTO - with eventually move to a bright star, INPLACE - autofocus in place
+kinematics_model = None # Focuser and filter wheel kinematics model learned from recorded moves
+focus_repository = None # In-memory copy of focus table from database
+focus_predictor = None # Temperature-compensated focus prediction per filter
+prediction_max_error = None # Maximal standard error of used prediction in focuser steps, 0 - prediction disabled, None - FocusPredictor.DEFAULT_MAX_ERROR
+unavailable_temperatures = [] # JSON-RPC methods which could not return temperature in current run
+autofocus_results = [] # Autofocus results in current run: filter name, focuser position, time, duration, CCD and ambient temperature
+run_spans = None # Timing spans of run phases stored in database at the end of run
+applied_offsets = None # Fingerprint of filters offsets applied in CCDciel, None - not loaded
+known_offsets = {} # Filter name -> offset set in CCDciel known in current run, offset of other filters is not known
+loaded_database_version = None # Database path and version of data kept in memory by daemon
+arguments_log = [] # Messages about provided arguments, logged in CCDciel after arguments are parsed
+daemon_mode = 0 # 0 - run script without daemon, 1 - run as daemon, 2 - stop daemon, 3 - forward arguments to running daemon or run script when daemon is not running
+daemon_socket = os.path.join(this_script_dir, 'focuser_position_per_filter.sock') # Default Unix socket of daemon, address can be set by CCDCIEL_FOCUS_DAEMON
+# Variables set by arguments or changed during run, restored for every request served by daemon
+RUN_STATE = ('initial_focuser_position', 'filters_and_focuser_positions_database_file', 'profile_name', 'focus_profile', 'filter_name_to_set', 'filters_subset', 'script_working_mode',
+             'focuser_overshoot', 'focuser_approach', 'focuser_max_position', 'pending_focuser_position', 'pending_focuser_filter', 'drift_tolerance', 'max_data_age',
+             'focus_type', 'prediction_max_error', 'unavailable_temperatures', 'autofocus_results', 'run_spans', 'arguments_log', 'known_offsets')
+daemon_state = {} # Values of RUN_STATE variables after daemon start
 
 # arguments_parser - parse arguments from command line
 # @arguments
 # --dbname, -d <database file name>
+# --profile, -r <rig profile name>
 # --focuserposition, -f <focuser position>
 # --filtername, -n <filter name>
 # --filterid, -i <filter index>
 # --subset, -s <list of filter indexes>
 # --focustype, -t <autofocus type: AUTO, INPLACE>
-# --mode, -m <working mode: CALCULATE, READ, RESET>
+# --predictionerror, -e <maximal standard error of used prediction in focuser steps, 0 - disabled>
+# --backlash, -b <overshoot in focuser steps, 0 - disabled>
+# --approach, -p <final focuser approach direction: OUT, IN>
+# --maxposition, -x <maximal focuser position in steps, 0 - not limited>
+# --tolerance, -o <INCREMENTAL mode, maximal shift of reference filter in focuser steps>
+# --maxage, -a <INCREMENTAL mode, maximal age of filter data in days>
+# --mode, -m <working mode: CALCULATE, READ, RESET, INCREMENTAL, REPORT>
+# --daemon - run as daemon, --stopdaemon - stop running daemon, --usedaemon - forward to running daemon, --local - run without daemon
 # --help, -help - display help
 def arguments_parser():
    """Parse command line arguments and update global settings.
 
    Supported options:
    --dbname, -d <database file name>
+   --profile, -r <rig profile name>, default profile detected from filters in filter wheel
    --focuserposition, -f <focuser position>
    --filtername, -n <filter name>
    --filterid, -i <filter index>
    --subset, -s <list of filter indexes>
    --focustype, -t <autofocus type: AUTO, INPLACE>
-   --mode, -m <working mode>: CALCULATE, READ, RESET
+   --predictionerror, -e <maximal standard error of used prediction in focuser steps, 0 - disabled>
+   --backlash, -b <overshoot in focuser steps, 0 - disabled>
+   --approach, -p <final focuser approach direction: OUT, IN>
+   --maxposition, -x <maximal focuser position in steps, 0 - not limited>
+   --tolerance, -o <INCREMENTAL mode, maximal shift of reference filter in focuser steps>
+   --maxage, -a <INCREMENTAL mode, maximal age of filter data in days>
+   --mode, -m <working mode>: CALCULATE, READ, RESET, INCREMENTAL, REPORT
+   --daemon - run as daemon, --stopdaemon - stop running daemon, --usedaemon - forward arguments to running daemon,
+   --local - run without daemon (default)
    --help, -help - display help and exit
 
    If provided, this updates the module-level globals:
    - filters_and_focuser_positions_database_file
    - initial_focuser_position
+
+   No RPC is made while arguments are parsed, so --help and invalid
+   arguments do not need CCDciel, messages are collected in arguments_log.
    """
    global initial_focuser_position
    global filters_and_focuser_positions_database_file
+   global profile_name
    global filter_name_to_set
    global script_working_mode
    global filters_subset
+   global focus_type
+   global prediction_max_error
+   global focuser_overshoot
+   global focuser_approach
+   global focuser_max_position
+   global drift_tolerance
+   global max_data_age
+   global daemon_mode
 
    usage = (
-      "Usage: {} [--mode|-m CALCULATE (default)/READ/RESET] [--dbname|-d <database>] [--focuserposition|-f <pos>] [--subset|-s <list of filter indexes>] [--focustype|-t <autofocus type: AUTO (default)/INPLACE>] [--filtername|-n <name>] [--filterid|-i <index>] [--help|-help]".format(sys.argv[0])
+      "Usage: {} [--mode|-m CALCULATE (default)/READ/RESET/INCREMENTAL/REPORT] [--dbname|-d <database>] [--profile|-r <profile>] [--focuserposition|-f <pos>] [--subset|-s <list of filter indexes>] [--focustype|-t <autofocus type: AUTO (default)/INPLACE>] [--predictionerror|-e <steps>] [--backlash|-b <steps>] [--approach|-p OUT (default)/IN] [--maxposition|-x <steps>] [--tolerance|-o <steps>] [--maxage|-a <days>] [--filtername|-n <name>] [--filterid|-i <index>] [--daemon|--stopdaemon|--usedaemon|--local] [--help|-help]".format(sys.argv[0])
    )
 
    # Test reference filter id/name flag 
@@ -141,15 +261,26 @@ def arguments_parser():
       a = args[i]
       if a in ("--help", "-help"):
          print(usage)
-         print("\nOptions:\n  --mode,-m <working mode: CALCULATE (default)/READ/RESET>\n --dbname, -d <database file name>\n  --focuserposition, -f <focuser position>\n  --focustype, -t <autofocus type: AUTO (default)/INPLACE>\n  --filtername, -n <name>\n  --filterid, -i <filter index>\n  --subset, -s <list of filter indexes>\n  --help, -help\n")
+         print("\nOptions:\n  --mode,-m <working mode: CALCULATE (default)/READ/RESET/INCREMENTAL/REPORT>\n --dbname, -d <database file name>\n  --profile, -r <rig profile name, default - detected from filters in filter wheel>\n  --focuserposition, -f <focuser position>\n  --focustype, -t <autofocus type: AUTO (default)/INPLACE>\n  --predictionerror, -e <maximal standard error of used prediction in focuser steps, 0 - disabled>\n  --backlash, -b <overshoot in focuser steps, 0 - disabled>\n  --approach, -p <final focuser approach direction: OUT (default)/IN>\n  --maxposition, -x <maximal focuser position in steps, 0 - not limited (default)>\n  --tolerance, -o <INCREMENTAL mode, maximal shift of reference filter in focuser steps>\n  --maxage, -a <INCREMENTAL mode, maximal age of filter data in days>\n  --filtername, -n <name>\n  --filterid, -i <filter index>\n  --subset, -s <list of filter indexes>\n  --daemon - run as focus manager daemon\n  --stopdaemon - stop running daemon\n  --usedaemon - forward arguments to running daemon, run without daemon when daemon is not running\n  --local - run without daemon (default)\n  --help, -help\n")
          sys.exit(0)
+      elif a in ("--daemon", "--stopdaemon", "--usedaemon", "--local"):
+         daemon_mode = {"--daemon": 1, "--stopdaemon": 2, "--usedaemon": 3, "--local": 0}[a]
+         i += 1
       elif a in ("--dbname", "-d"):
          if i + 1 >= len(args):
             print("Error: missing value for %s" % a)
             print(usage)
             sys.exit(1)
          filters_and_focuser_positions_database_file = args[i+1]
-         ccdciel('LogMsg', 'Database name set from arguments: %s' % (filters_and_focuser_positions_database_file))
+         arguments_log.append('Database name set from arguments: %s' % (filters_and_focuser_positions_database_file))
+         i += 2
+      elif a in ("--profile", "-r"):
+         if i + 1 >= len(args) or args[i+1].strip() == '':
+            print("Error: missing value for %s" % a)
+            print(usage)
+            sys.exit(1)
+         profile_name = args[i+1].strip()
+         arguments_log.append('Rig profile set from arguments: %s' % (profile_name))
          i += 2
       elif a in ("--focuserposition", "-f"):
          if i + 1 >= len(args):
@@ -161,7 +292,7 @@ def arguments_parser():
          except ValueError:
             print("Error: invalid focuser position, must be integer: %s" % args[i+1])
             sys.exit(1)
-         ccdciel('LogMsg', 'Initial focuser position set from arguments: %d' % (initial_focuser_position))
+         arguments_log.append('Initial focuser position set from arguments: %d' % (initial_focuser_position))
          i += 2
          
       elif a in ("--focustype", "-t"):
@@ -178,9 +309,94 @@ def arguments_parser():
             print("Error: invalid focus type for %s, must be AUTO, INPLACE" % a)
             print(usage)
             sys.exit(1)
-         ccdciel('LogMsg', 'Script working mode set from arguments: %s' % (mode_arg))
+         arguments_log.append('Autofocus type set from arguments: %s' % (mode_arg))
          i += 2
          
+      elif a in ("--predictionerror", "-e"):
+         if i + 1 >= len(args):
+            print("Error: missing value for %s" % a)
+            print(usage)
+            sys.exit(1)
+         try:
+            prediction_max_error = float(args[i+1])
+         except ValueError:
+            print("Error: invalid prediction error, must be number: %s" % args[i+1])
+            sys.exit(1)
+         arguments_log.append('Maximal prediction error set from arguments: %.1f' % (prediction_max_error))
+         i += 2
+
+      elif a in ("--backlash", "-b"):
+         if i + 1 >= len(args):
+            print("Error: missing value for %s" % a)
+            print(usage)
+            sys.exit(1)
+         try:
+            focuser_overshoot = int(args[i+1])
+         except ValueError:
+            print("Error: invalid backlash overshoot, must be integer: %s" % args[i+1])
+            sys.exit(1)
+         arguments_log.append('Focuser backlash overshoot set from arguments: %d' % (focuser_overshoot))
+         i += 2
+
+      elif a in ("--approach", "-p"):
+         if i + 1 >= len(args):
+            print("Error: missing value for %s" % a)
+            print(usage)
+            sys.exit(1)
+         approach_arg = args[i+1].upper()
+         if approach_arg == "OUT":
+            focuser_approach = 1
+         elif approach_arg == "IN":
+            focuser_approach = -1
+         else:
+            print("Error: invalid approach direction for %s, must be OUT, IN" % a)
+            print(usage)
+            sys.exit(1)
+         arguments_log.append('Focuser final approach direction set from arguments: %s' % (approach_arg))
+         i += 2
+
+      elif a in ("--maxposition", "-x"):
+         if i + 1 >= len(args):
+            print("Error: missing value for %s" % a)
+            print(usage)
+            sys.exit(1)
+         try:
+            focuser_max_position = int(args[i+1])
+         except ValueError:
+            print("Error: invalid maximal focuser position, must be integer: %s" % args[i+1])
+            sys.exit(1)
+         if focuser_max_position < 0:
+            print("Error: invalid maximal focuser position, must be >= 0: %s" % args[i+1])
+            sys.exit(1)
+         arguments_log.append('Maximal focuser position set from arguments: %d' % (focuser_max_position))
+         i += 2
+
+      elif a in ("--tolerance", "-o"):
+         if i + 1 >= len(args):
+            print("Error: missing value for %s" % a)
+            print(usage)
+            sys.exit(1)
+         try:
+            drift_tolerance = int(args[i+1])
+         except ValueError:
+            print("Error: invalid tolerance, must be integer: %s" % args[i+1])
+            sys.exit(1)
+         arguments_log.append('Drift tolerance set from arguments: %d' % (drift_tolerance))
+         i += 2
+
+      elif a in ("--maxage", "-a"):
+         if i + 1 >= len(args):
+            print("Error: missing value for %s" % a)
+            print(usage)
+            sys.exit(1)
+         try:
+            max_data_age = float(args[i+1])
+         except ValueError:
+            print("Error: invalid maximal age, must be number of days: %s" % args[i+1])
+            sys.exit(1)
+         arguments_log.append('Maximal age of filter data set from arguments: %.1f days' % (max_data_age))
+         i += 2
+
       elif a in ("--filtername", "-n"):
          if filter_name_id_provided:
             print("Error: both filter name and filter index provided, please provide only one of them")
@@ -192,7 +408,7 @@ def arguments_parser():
             sys.exit(1)
          filter_name_to_set[2] = args[i+1]
          filter_name_id_provided = True
-         ccdciel('LogMsg', 'Initial focuser position set from arguments: %d' % (initial_focuser_position))
+         arguments_log.append('Filter name to set provided from arguments: %s' % (filter_name_to_set[2]))
          i += 2
       
       elif a in ("--filterid", "-i"):
@@ -210,7 +426,7 @@ def arguments_parser():
             print("Error: invalid filter index, must be integer: %s" % args[i+1])
             sys.exit(1)
          filter_name_id_provided = True
-         ccdciel('LogMsg', 'Filter index to set provided from arguments: %d' % (filter_name_to_set[3]))
+         arguments_log.append('Filter index to set provided from arguments: %d' % (filter_name_to_set[3]))
          i += 2
 
       elif a in ("--subset", "-s"):
@@ -225,7 +441,11 @@ def arguments_parser():
             print("Error: invalid subset format for %s, must be a list of integers like [1,3,4]" % a)
             print(usage)
             sys.exit(1)
-         ccdciel('LogMsg', 'Filter subset set from arguments: %s' % (filters_subset))
+         if min(filters_subset) < 1:
+            print("Error: invalid subset for %s, filter indexes start from 1: %s" % (a, subset_arg))
+            print(usage)
+            sys.exit(1)
+         arguments_log.append('Filter subset set from arguments: %s' % (filters_subset))
          i += 2
 
       elif a in ("--mode", "-m"):
@@ -240,11 +460,15 @@ def arguments_parser():
             script_working_mode = 1
          elif mode_arg == "RESET":
             script_working_mode = 2
+         elif mode_arg == "INCREMENTAL":
+            script_working_mode = 3
+         elif mode_arg == "REPORT":
+            script_working_mode = 4
          else:
-            print("Error: invalid mode value for %s, must be CALCULATE, READ or RESET" % a)
+            print("Error: invalid mode value for %s, must be CALCULATE, READ, RESET, INCREMENTAL or REPORT" % a)
             print(usage)
             sys.exit(1)
-         ccdciel('LogMsg', 'Script working mode set from arguments: %s' % (mode_arg))
+         arguments_log.append('Script working mode set from arguments: %s' % (mode_arg))
          i += 2
       else:
          print("Unknown argument: %s" % a)
@@ -258,18 +482,12 @@ def arguments_parser():
 # 1 - newer version
 # 0 - older version
 def check_for_version_neq_0_9_92_3829(display_log):
-   global ccdciel_version
-   status = 0 # Status of operation
-   if ccdciel_version[0] == '0.9.92':
-      if int(ccdciel_version[1]) >= 3829:
-         status = 1
-         if display_log == 1:
-            ccdciel('LogMsg', 'Setting FILTERS OFFSETS for FOCUSER supported in script')
+   ccdciel_version = device_cache.version() # Main version, short revision, full revision stored in array, read once per run
+   status = device_cache.memoize('offsets_supported', lambda: 1 if ccdciel_version[0] == '0.9.92' and int(ccdciel_version[1]) >= 3829 else 0) # Status of operation
+   if display_log == 1:
+      if status == 1:
+         ccdciel('LogMsg', 'Setting FILTERS OFFSETS for FOCUSER supported in script')
       else:
-         if display_log == 1:
-            ccdciel('LogMsg', 'Setting FILTERS OFFSETS for FOCUSER NOT supported in script, minimal version is 0.9.92-3829')
-   else:
-      if display_log == 1:
          ccdciel('LogMsg', 'Setting FILTERS OFFSETS for FOCUSER NOT supported in script, minimal version is 0.9.92-3829')
    return status
 
@@ -279,6 +497,7 @@ def check_for_version_neq_0_9_92_3829(display_log):
 # EXIT - script exit due to critical error
 def check_necessary_components():
    status = 0 # Status of operation
+   span = run_spans.begin('preflight') # Timing span of preflight checks
 
    if 'sqlite3' in sys.modules:
       ccdciel('LogMsg','sqlite3 module is already imported.')
@@ -310,20 +529,96 @@ def check_necessary_components():
    # Exit script if necessary components are not connected
    if status != 0:
       ccdciel('LogMsg','[CRITICAL ERROR] Necessary components are not connected, script will exit!')
+      span.end(status)
       exit(1)
 
-   return status
+   return span.end(status)
+
+# load_applied_offsets - load fingerprint of filters offsets applied in CCDciel
+#                        for CCDciel instance and filters in filter wheel
+# @return fingerprint or None if it can not be read
+def load_applied_offsets():
+   global applied_offsets
+
+   db_path = os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file)
+   instance = '%s %s:%s' % (' '.join(str(v) for v in device_cache.version()), os.environ.get('CCDCIEL_HOST', 'localhost'), os.environ.get('CCDCIEL_PORT', '3277')) # CCDciel version and JSON-RPC address
+   list_of_filters = device_cache.filters_names()
+   if applied_offsets == None or applied_offsets.db_path != db_path or applied_offsets.instance != instance or applied_offsets.filters != list_of_filters:
+      applied_offsets = AppliedOffsets(db_path, instance, list_of_filters)
+      if applied_offsets.load() != 0:
+         ccdciel('LogMsg','[WARNING] Can not read applied filters offsets from database, all offsets will be set')
+         applied_offsets = None
+   return applied_offsets
+
+# forget_applied_offsets_fingerprint - forget fingerprint of applied offsets before offsets are set
+#                                      without it, so next READ run sets all offsets
+def forget_applied_offsets_fingerprint():
+   global applied_offsets
+
+   applied_offsets = None
+   if forget_applied_offsets(os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file)) != 0:
+      ccdciel('LogMsg','[WARNING] Can not remove applied filters offsets from database')
+
+# set_filters_offsets - set offsets for filters in filter wheel, calls are send in one batch,
+#                       messages are logged by log sink in order with other messages
+# With only_changed applied offsets are kept in fingerprint, so offsets which did not change
+# can be skipped, otherwise fingerprint is forgotten before offsets are set. Offsets set in
+# current run are remembered in known_offsets for decision if filter change moves focuser.
+# @arguments
+# filters_offsets - list with filter index, name and offset for each filter
+# log_message - message logged for each filter with filter index, name and offset, None - no log
+# only_changed - True - set only offsets which differ from applied offsets (READ mode)
+#
+# @return number of filters for which offset can not be set
+def set_filters_offsets(filters_offsets, log_message, only_changed=False):
+   span = run_spans.begin('offsets') # Timing span of offsets application
+   fingerprint = None # Offsets applied in CCDciel, None - not used
+   if only_changed:
+      fingerprint = load_applied_offsets()
+   else:
+      forget_applied_offsets_fingerprint()
+   if fingerprint != None:
+      changed_offsets = fingerprint.changed(filters_offsets)
+      for item in filters_offsets:
+         if item not in changed_offsets:
+            known_offsets[item[1]] = item[2]
+      if len(changed_offsets) < len(filters_offsets):
+         ccdciel('LogMsg','[INFO] Offsets of %d filters already applied, %d offsets will be set' % (len(filters_offsets) - len(changed_offsets), len(changed_offsets)))
+      filters_offsets = changed_offsets
+      if len(filters_offsets) == 0:
+         span.end(0)
+         return 0
+   for item in filters_offsets:
+      rpc_batch.queue('Set_FilterOffset',[item[1],item[2]])
+   responses = rpc_batch.flush()
+
+   # Report result for each filter
+   failed = 0
+   for idf,item in enumerate(filters_offsets):
+      error = response_error(responses[idf])
+      if log_message != None:
+         ccdciel('LogMsg',log_message % (item[0],item[1],item[2]))
+      if error != None:
+         ccdciel('LogMsg','[ERROR] Can not set offset %d for filter index: %d name: %s: %s' % (item[2],item[0],item[1],error))
+         failed += 1
+         known_offsets.pop(item[1], None)
+      else:
+         known_offsets[item[1]] = item[2]
+      if fingerprint != None:
+         fingerprint.update(item[1], item[2] if error == None else None)
+   if fingerprint != None and fingerprint.save() != 0:
+      ccdciel('LogMsg','[WARNING] Can not store applied filters offsets in database')
+   span.end(1 if failed > 0 else 0)
+   return failed
 
 # reset_focuser_positions_and_offsets - reset focuser positions and offsets for all filters
 def reset_focuser_positions_and_offsets():
 
    # Get list of filters in filter wheel
-   list_of_filters = (ccdciel('Wheel_GetfiltersName')['result'])
+   list_of_filters = device_cache.filters_names()
 
    # Reset offset for each filter in filters wheel
-   for idf,f in enumerate(list_of_filters):
-      ccdciel('Set_FilterOffset',[f,0])
-      ccdciel('LogMsg','Reset offset for filter index: %d name: %s to 0' % (idf+1,f))
+   set_filters_offsets([[idf+1,f,0] for idf,f in enumerate(list_of_filters)], 'Reset offset for filter index: %d name: %s to %d')
    
    # Set filter in filter wheel to reference filter (first filter)
    ccdciel('Wheel_setfilter',1)
@@ -341,11 +636,11 @@ def get_reference_filter_from_application_arguments():
    # Get current filter in filter wheel
    cur_fwheel_dict = ccdciel('Wheel_getfilter')['result']
    cur_filter_index = int(cur_fwheel_dict.get("status"))
-   filter_name_to_set[0] = (ccdciel('Wheel_GetfiltersName')['result'])[cur_filter_index-1]
+   filter_name_to_set[0] = device_cache.filter_name(cur_filter_index)
    filter_name_to_set[1] = cur_filter_index
 
    # Get list of filters in filter wheel
-   list_of_filters = (ccdciel('Wheel_GetfiltersName')['result'])
+   list_of_filters = device_cache.filters_names()
 
    # Looking for filter provided by parameters
    if filter_name_to_set[2] != None or filter_name_to_set[3] != None:
@@ -374,7 +669,36 @@ def get_reference_filter_from_application_arguments():
          filter_name_to_set[2] = None
          filter_name_to_set[3] = None
 
+# load_focus_repository - read whole focus table from database once per run
+# @arguments
+# db_name - name of file with database
+# db_directory - directory with database file
+#
+# @return status
+# 0 - no error / success
+# 31 - can not open database
+# 32 - can not read focuser positions from database
+def load_focus_repository(db_name, db_directory):
+   global focus_repository
+   status = 0 # Status of operation
+
+   db_path = os.path.join(db_directory, db_name)
+   if focus_repository == None or focus_repository.db_path != db_path or focus_repository.profile != focus_profile:
+      ccdciel('LogMsg','Database directory: %s name: %s profile: %s' %(db_directory, db_name, focus_profile))
+      focus_repository = FocusRepository(db_path, focus_profile)
+      span = run_spans.begin('db_read') # Timing span of focus table read
+      status = span.end(focus_repository.load())
+      if status == 31:
+         ccdciel('LogMsg','[ERROR] Can not open database %s' %(db_name))
+         focus_repository = None
+      elif status == 32:
+         ccdciel('LogMsg','[ERROR] Can not read focuser positions from database %s' %(db_name))
+      elif focus_repository.usage_flag_column == False:
+         ccdciel('LogMsg','[WARNING] No usage flag in database, mark all filters as in use')
+   return status
+
 # get_focuser_position_for_filter_from_database - get focuser position for selected filter from database
+#                                                 whole table is read once per run and kept in memory
 # @arguments
 # db_name - name of file with database
 # db_directory - directory with database file
@@ -390,184 +714,157 @@ def get_reference_filter_from_application_arguments():
 # 36 - can not read reference flag and offset for selected filter
 #
 def get_focuser_position_for_filter_from_database(db_name, db_directory, filter_name):
-   status = 0 # Status of operation
-   status_array = [0,0,0, ] # Status array for focuser position, reference flag, offset and usage flag
-   focuser_position_reference_flag_offset_and_usage_flag = [0, 0, 0, 0] # Focuser position, reference flag, offset and usage flag for selected filter
-
-   ccdciel('LogMsg','Database directory: %s name: %s' %(db_directory, db_name))
-   ccdciel('LogMsg','Selected filter name: %s' %(filter_name))
-
-   # Open database
-   try:
-      conn = sqlite3.connect(os.path.join(db_directory, db_name))
-      cursor = conn.cursor()
-   except sqlite3.Error as e:
-      ccdciel('LogMsg','[ERROR] Can not open database %s: %s' %(db_name, str(e)))
-      status = 31
-      return status, focuser_position_reference_flag_offset_and_usage_flag
-   
-   # Read focuser position for selected filter
-   try:
-      cursor.execute("SELECT focuser_position FROM filters_focuser_position WHERE filter_name = ?", (filter_name,))
-      result = cursor.fetchone()
-      if result:
-         focuser_position_reference_flag_offset_and_usage_flag[0] = result[0]
-      else:
-         ccdciel('LogMsg','[ERROR] No focuser position for selected filter %s in database' %(filter_name))
-         status_array[0] = 33
-
-      cursor.execute("SELECT reference_flag FROM filters_focuser_position WHERE filter_name = ?", (filter_name,))
-      result = cursor.fetchone()
-      if result:
-         focuser_position_reference_flag_offset_and_usage_flag[1] = result[0]
-      else:
-         ccdciel('LogMsg','[ERROR] No reference flag for selected filter %s in database' %(filter_name))
-         status_array[1] = 34
-      
-      cursor.execute("SELECT offset_for_filter FROM filters_focuser_position WHERE filter_name = ?", (filter_name,))
-      result = cursor.fetchone()
-      if result:
-         focuser_position_reference_flag_offset_and_usage_flag[2] = result[0]
-         status = 0
-      else:
-         ccdciel('LogMsg','[ERROR] No focuser offset for selected filter %s in database' %(filter_name))
-         status_array[2] = 35
-
-      cursor.execute("SELECT usage_flag FROM filters_focuser_position WHERE filter_name = ?", (filter_name,))
-      result = cursor.fetchone()
-      if result:
-         focuser_position_reference_flag_offset_and_usage_flag[3] = result[0]
-         status = 0
-      else:
-         ccdciel('LogMsg','[WARNING] No usage flag for selected filter %s in database, mark filter as in use' %(filter_name))
-         focuser_position_reference_flag_offset_and_usage_flag[3] = 1
-         status = 0
-
-      # Determine overall status
-      if status_array[0] == 33 and status_array[1] == 34 and status_array[2] == 35:
-         status = 32
-      elif status_array[1] == 34 and status_array[2] == 35:
-         status = 36
-      elif status_array[0] == 33:
-         status = 33
-      elif status_array[1] == 34:
-         status = 34
-      elif status_array[2] == 35:
-         status = 35
-      else:
-         status = 0
-
-   except sqlite3.Error as e:
-      ccdciel('LogMsg','[ERROR] Can not read focuser position for selected filter %s: %s' %(filter_name, str(e)))
-      status = 32
-   finally:
-      conn.close()
+   # Read whole focus table from database once per run
+   status = load_focus_repository(db_name, db_directory)
+   if status == 31:
+      return status, [0, 0, 0, 0]
+
+   # Get data for selected filter
+   status, focuser_position_reference_flag_offset_and_usage_flag = focus_repository.get(filter_name)
+   if status == 32 or status == 33:
+      ccdciel('LogMsg','[ERROR] No focuser position for selected filter %s in database' %(filter_name))
+   if status == 34 or status == 36:
+      ccdciel('LogMsg','[ERROR] No reference flag for selected filter %s in database' %(filter_name))
+   if status == 35 or status == 36:
+      ccdciel('LogMsg','[ERROR] No focuser offset for selected filter %s in database' %(filter_name))
 
    return status, focuser_position_reference_flag_offset_and_usage_flag
 
-# store_position_per_filter_in_database - store information about filter and
-#                                         caclulated focus point in database
+# store_positions_per_filter_in_database - store information about filters and
+#                                          caclulated focus points in database
+#                                          in one transaction
 # @arguments
 # db_name - name of file with database
 # db_directory - directory with database file
-# filter_name - selected filter name
-# focuser_position - focuser position
-# reference_flag - reference flag for selected filter (0 - no, 1 - yes)
-# offset_for_filter - offset for selected filter calculated from reference filter
-# usage_flag - filter usage flag (0 - no, 1 - yes)
+# focuser_position_per_filter - list with filter index, name, focuser position, reference flag,
+#                               offset and usage flag for each filter
 #
 # @return status
 # 0 - success
 # 31 - can not open database
 #
-def store_position_per_filter_in_database(db_name, db_directory, filter_name, focuser_position, reference_flag, offset_for_filter, usage_flag):
+def store_positions_per_filter_in_database(db_name, db_directory, focuser_position_per_filter):
+   global focus_repository
    status = 0
 
-   ccdciel('LogMsg','Save focuser position for \"%s\" filter in \"%s/%s\" database' %(filter_name, db_directory, db_name))
+   ccdciel('LogMsg','Save focuser positions for %d filters in \"%s/%s\" database' %(len(focuser_position_per_filter), db_directory, db_name))
 
-   try:
-      # Open database connection
-      conn = sqlite3.connect(os.path.join(db_directory, db_name))
-      cursor = conn.cursor()
-
-      # Create table if it does not exist
-      cursor.execute('''CREATE TABLE IF NOT EXISTS filters_focuser_position (
-                        filter_name TEXT PRIMARY KEY,
-                        focuser_position INTEGER,
-                        reference_flag INTEGER,
-                        offset_for_filter INTEGER,
-                        usage_flag INTEGER
-                     )''')
-
-      # Insert or update the filter name and focuser position
-      cursor.execute('''INSERT INTO filters_focuser_position (filter_name, focuser_position, reference_flag, offset_for_filter, usage_flag)
-                          VALUES (?, ?, ?, ?, ?)
-                          ON CONFLICT(filter_name) DO UPDATE SET focuser_position=excluded.focuser_position,
-                                                                 reference_flag=excluded.reference_flag,
-                                                                 offset_for_filter=excluded.offset_for_filter,
-                                                                 usage_flag=excluded.usage_flag''',
-                       (filter_name, focuser_position, reference_flag, offset_for_filter, usage_flag))
-
-      # Commit changes and close connection
-      conn.commit()
-      conn.close()
-      ccdciel('LogMsg', 'Successfully stored \"%s\" filter focuser position in \"%s/%s\" database.' % (filter_name, db_directory, db_name))
-   except sqlite3.Error as e:
-      ccdciel('LogMsg', '[ERROR] Failed to store \"%s\" filter focuser position in database \"%s/%s\": %s' % (filter_name, db_directory, db_name, str(e)))
-      status = 31
+   # Store all rows at once, database is never left with part of results
+   db_path = os.path.join(db_directory, db_name)
+   if focus_repository == None or focus_repository.db_path != db_path or focus_repository.profile != focus_profile:
+      focus_repository = FocusRepository(db_path, focus_profile)
+   status = focus_repository.store_all([item[1:6] for item in focuser_position_per_filter])
+   if status == 0:
+      ccdciel('LogMsg', 'Successfully stored focuser positions in \"%s/%s\" database.' % (db_directory, db_name))
+   else:
+      ccdciel('LogMsg', '[ERROR] Failed to store focuser positions in database \"%s/%s\"' % (db_directory, db_name))
 
    return status
 
+# backlash_waypoint - get position from which focuser approaches target in configured direction,
+# position is limited to focuser range (0 .. focuser_max_position)
+# @arguments
+# current_position - current focuser position
+# target_position - target focuser position
+#
+# @return overshoot position or None if target is approached in configured direction
+def backlash_waypoint(current_position, target_position):
+   if focuser_overshoot <= 0 or current_position == target_position:
+      return None
+   if (target_position - current_position) * focuser_approach > 0:
+      return None
+   waypoint = max(0, target_position - focuser_approach * focuser_overshoot)
+   if focuser_max_position > 0:
+      waypoint = min(focuser_max_position, waypoint)
+   return waypoint if waypoint != target_position else None
+
+# request_focuser_position - request focuser position, move is deferred until position is needed
+# so back-to-back moves are merged into one move, see flush_focuser_position()
+# @arguments
+# new_focuser_position - new focuser position
+# filter_name - filter label of move timing span
+def request_focuser_position(new_focuser_position, filter_name=None):
+   global pending_focuser_position
+   global pending_focuser_filter
+   if pending_focuser_position != None:
+      ccdciel('LogMsg','Deferred focuser move to %d replaced by move to %d' % (pending_focuser_position,new_focuser_position))
+   pending_focuser_position = new_focuser_position
+   pending_focuser_filter = filter_name
+
+# flush_focuser_position - execute deferred focuser move
+# @return status like set_focuser_position()
+def flush_focuser_position():
+   global pending_focuser_position
+   if pending_focuser_position == None:
+      return 0
+   new_focuser_position = pending_focuser_position
+   pending_focuser_position = None
+   return set_focuser_position(new_focuser_position, pending_focuser_filter)
+
 # set_focuser_position - set focuser position to selected value
+# Final approach is done in configured direction, when focuser moves in other
+# direction it overshoots target first to take up backlash. Global variables are not changed,
+# so function can run in worker thread.
 # @arguments
 # new_focuser_position - new focuser position
+# filter_name - filter label of move timing span
+# exit_on_critical_error - False - status 13 is returned instead of exit (worker thread)
 #
 # @return status
 # 0 - success
 # 12 - can not set new focuser position
 # 13 - can not return to intial focuser position
-def set_focuser_position(new_focuser_position):
+# EXIT - can not return to initial focuser position when exit_on_critical_error is set (critical error)
+def set_focuser_position(new_focuser_position, filter_name=None, exit_on_critical_error=True):
    status = 0 # Status of operation
+   span = run_spans.begin('focuser_move', filter_name) # Timing span of focuser move
    restore = 0 # Restore flag, 0 - normal operation, 1 - need to restore, 2 - in progress, 3 - can not restore
-   max_time_array = [120,240] # max operation time [normal,restore]
-   cur_max_time = [0,0] # current and max time
+   cur_max_time = [0,0] # elapsed and max time
    foc_pos_array = [0,new_focuser_position,0] # focuser position array [initial,new,temporary]
+   legs = [new_focuser_position] # Targets of moves, overshoot position and new focuser position
 
    # Get the focuser position
    foc_pos_array[0] = ccdciel('FocuserPosition')['result']
    ccdciel('LogMsg','Initial focuser position is %d, target position is %d' %(foc_pos_array[0],foc_pos_array[1]))
    foc_pos_array[2] = foc_pos_array[0]
 
+   # Overshoot target when it is not approached in configured direction
+   waypoint = backlash_waypoint(foc_pos_array[0], new_focuser_position)
+   if waypoint != None:
+      legs.insert(0, waypoint)
+      ccdciel('LogMsg','Focuser overshoot to %d to approach %d %s' %(waypoint,new_focuser_position,'OUT' if focuser_approach == 1 else 'IN'))
+   foc_pos_array[1] = legs.pop(0)
+
    # Set into new position
    while True:
       # Restore procedure
-      if restore == 0:
-         cur_max_time[1]=max_time_array[0] # Set max time for normal operation
       if restore == 1:
-         cur_max_time[1]=max_time_array[1] # Set max time for restore operation
-         cur_max_time[0]=0  # Clear timer
          foc_pos_array[1] = foc_pos_array[0] # Set target focus point as initial
          foc_pos_array[2] = ccdciel('FocuserPosition')['result'] # Get current focus point
          restore = 2 # Set restore flag to in progress
       if foc_pos_array[2] != foc_pos_array[1]:
+         # Set max time for normal or restore operation from kinematics model
+         move_distance = abs(foc_pos_array[1] - foc_pos_array[2])
+         cur_max_time[1] = kinematics_model.max_time('focuser', move_distance, 0 if restore == 0 else 1)
+         move_start = time.monotonic()
          ccdciel('Focuser_setposition',foc_pos_array[1])
-         foc_pos_array[2] = ccdciel('FocuserPosition')['result']
-         while foc_pos_array[2] != foc_pos_array[1]:
-            if cur_max_time[0] == cur_max_time[1]:
-               if restore == 0:
-                  ccdciel('LogMsg', '[ERROR] Focuser not set in position %d during %ds try to restore initial position!!!' %(foc_pos_array[1],cur_max_time[1]))
-                  status = 12
-                  restore = 1
-                  break
-               if restore == 2:
-                  ccdciel('LogMsg', '[ERROR] Focuser can not restore focuser position %d during %ds something goes wrong!!!' %(foc_pos_array[0],cur_max_time[1]))
-                  status = 13
-                  restore = 3
-                  break
-            time.sleep(1)
-            foc_pos_array[2] = ccdciel('FocuserPosition')['result']
-            cur_max_time[0]=cur_max_time[0]+1
+         reached, foc_pos_array[2], cur_max_time[0] = wait_for_value(lambda: ccdciel('FocuserPosition')['result'], foc_pos_array[1], cur_max_time[1], expected_time=kinematics_model.expected_time('focuser', move_distance))
+         if reached:
+            kinematics_model.record('focuser', move_distance, time.monotonic() - move_start)
+         else:
+            if restore == 0:
+               ccdciel('LogMsg', '[ERROR] Focuser not set in position %d during %ds try to restore initial position!!!' %(foc_pos_array[1],cur_max_time[1]))
+               status = 12
+               restore = 1
+               continue
+            if restore == 2:
+               ccdciel('LogMsg', '[ERROR] Focuser can not restore focuser position %d during %ds something goes wrong!!!' %(foc_pos_array[0],cur_max_time[1]))
+               status = 13
+               restore = 3
       # Check status after operation
+      if status == 0 and restore == 0 and len(legs) > 0:
+         foc_pos_array[1] = legs.pop(0) # Next move after overshoot
+         continue
       if status == 0 and restore == 0:
          foc_pos_array[2] = ccdciel('FocuserPosition')['result']
          ccdciel('LogMsg','Focuser after setting to %d position %d' %(foc_pos_array[1],foc_pos_array[2]))
@@ -580,13 +877,200 @@ def set_focuser_position(new_focuser_position):
       if status == 13 and restore == 3:
          foc_pos_array[2] = ccdciel('FocuserPosition')['result']
          ccdciel('LogMsg','[CRITICAL ERROR] Focuser position not restored, position is %d' %(foc_pos_array[2]))
-         exit(1)
+         if exit_on_critical_error:
+            span.end(status)
+            exit(1)
+         break
+   return span.end(status)
+
+# read_temperature - read temperature from CCDciel
+# @arguments
+# method - JSON-RPC method which returns temperature
+#
+# @return temperature or None if temperature is not available, warning is logged once per run
+def read_temperature(method):
+   try:
+      temperature = ccdciel(method).get('result')
+      if temperature != None:
+         return float(temperature)
+   except (TypeError, ValueError, AttributeError):
+      pass
+   if method not in unavailable_temperatures:
+      unavailable_temperatures.append(method)
+      ccdciel('LogMsg','[WARNING] Can not read temperature by %s, focus prediction and temperatures in focus history are not available' % (method))
+   return None
+
+# predicted_focuser_position - get focuser position for filter predicted from temperature
+# Prediction is not used for filters calculated by autofocus in current run.
+# @arguments
+# filter_name - filter name
+# stored_position - focuser position stored in database
+# temperature - current temperature, None - prediction not possible
+#
+# @return focuser position to set, predicted if prediction is trusted otherwise stored position
+def predicted_focuser_position(filter_name, stored_position, temperature):
+   if focus_predictor == None or prediction_max_error <= 0 or temperature == None:
+      return stored_position
+   if filter_name in [r[0] for r in autofocus_results]:
+      return stored_position
+   position, error = focus_predictor.predict(filter_name, temperature)
+   if not focus_predictor.trusted(filter_name, temperature):
+      if position != None:
+         ccdciel('LogMsg','[INFO] Prediction for filter %s at %.1fC not trusted (%d +/- %.1f steps), use stored position %d' % (filter_name, temperature, position, error, stored_position))
+      return stored_position
+   ccdciel('LogMsg','Focuser position for filter %s predicted at %.1fC is %d +/- %.1f steps, stored position %d' % (filter_name, temperature, position, error, stored_position))
+   return position
+
+# store_focus_history_in_database - append autofocus results from current run to focus history
+# @arguments
+# db_name - name of file with database
+# db_directory - directory with database file
+# focuser_position_per_filter - list with filter index, name, focuser position, reference flag,
+#                               offset and usage flag for each filter
+# reference_filter - name of reference filter
+#
+# @return status
+# 0 - success
+# 31 - can not open database
+def store_focus_history_in_database(db_name, db_directory, focuser_position_per_filter, reference_filter):
+   offsets = {} # Filter name -> offset
+   for item in focuser_position_per_filter:
+      offsets[item[1]] = item[4]
+   rows = []
+   for r in autofocus_results:
+      rows.append([r[2], r[0], r[1], offsets.get(r[0]), reference_filter, 'AUTO' if focus_type == 0 else 'INPLACE', r[4], r[5], r[3]])
+   status = FocusHistory(os.path.join(db_directory, db_name), profile=focus_profile).append_all(rows)
+   if status != 0:
+      ccdciel('LogMsg','[ERROR] Can not store focus history in database \"%s/%s\"' % (db_directory, db_name))
    return status
 
+# read_filter_wheel_index - read current filter wheel index
+# @return filter slot index (1..N)
+def read_filter_wheel_index():
+   cur_fwheel_dict = ccdciel('Wheel_getfilter')['result']
+   return int(cur_fwheel_dict.get("status"))
+
+# set_filter_wheel_position - set filter in filter wheel, initial filter is restored if filter can not be set
+# @arguments
+# filter_index - filter slot index (1..N)
+# filter_name - filter name
+# exit_on_critical_error - False - status 24 is returned instead of exit (worker thread)
+#
+# @return status
+# 0 - success
+# 23 - cannot set filter in filter wheel, initial filter restored
+# 24 - cannot restore filter in filter wheel when exit_on_critical_error is not set
+# EXIT - cannot restore filter in filter wheel (status 24, critical error)
+def set_filter_wheel_position(filter_index, filter_name, exit_on_critical_error=True):
+   status = 0 # Status of operation
+   restore = 0 # Restore flag, 0 - normal operation, 1 - need to restore, 2 - in progress, 3 - can not restore
+   cur_init_fwheel_index = [0,0] # current and initial filter wheel index
+   cur_max_time = [0,0] # elapsed and max time
+   span = run_spans.begin('filter_change', filter_name) # Timing span of filter change
+
+   # Get initial filter wheel position
+   cur_init_fwheel_index[1] = read_filter_wheel_index()
+   fwheel_target_index = [filter_index,-1] # target filter wheel index and last logged step
+
+   # Log filter wheel position during move, at most once per second
+   def log_filter_wheel_step(cur_index, elapsed):
+      if int(elapsed) > fwheel_target_index[1]:
+         fwheel_target_index[1] = int(elapsed)
+         ccdciel('LogMsg','[DEBUG] Step: %d filter %d expected filter %d' % (fwheel_target_index[1],cur_index,fwheel_target_index[0]))
+
+   # Select filter in wheel
+   while True:
+      if restore == 1:
+         fwheel_target_index[0] = cur_init_fwheel_index[1] # Set target filter as initial
+         fwheel_target_index[1] = -1
+         restore = 2 # Set restore flag to in progress
+
+      # Set max time for normal or restore operation from kinematics model
+      move_distance = abs(fwheel_target_index[0] - (cur_init_fwheel_index[1] if restore == 0 else cur_init_fwheel_index[0]))
+      cur_max_time[1] = kinematics_model.max_time('wheel', move_distance, 0 if restore == 0 else 1)
+      move_start = time.monotonic()
+      ccdciel('Wheel_setfilter',fwheel_target_index[0])
+
+      # Check filter wheel position
+      reached, cur_init_fwheel_index[0], cur_max_time[0] = wait_for_value(read_filter_wheel_index, fwheel_target_index[0], cur_max_time[1], on_poll=log_filter_wheel_step, expected_time=kinematics_model.expected_time('wheel', move_distance))
+      if reached:
+         kinematics_model.record('wheel', move_distance, time.monotonic() - move_start)
+      else:
+         if restore == 0:
+            ccdciel('LogMsg','[ERROR] Filter wheel not set to index: %d name: %s during %ds try to restore initial filter!!!' % (filter_index,filter_name,cur_max_time[1]))
+            status = 23
+            restore = 1
+            continue
+         if restore == 2:
+            ccdciel('LogMsg','[ERROR] Filter wheel can not restore filter index: %d name: %s during %ds something goes wrong!!!' % (cur_init_fwheel_index[1],device_cache.filter_name(cur_init_fwheel_index[1]),cur_max_time[1]))
+            status = 24
+            restore = 3
+
+      # Check status after operation
+      if status == 0 and restore == 0:
+         ccdciel('LogMsg','Filter wheel set to index: %d name: %s' % (filter_index,filter_name))
+         break
+      if status == 23 and restore == 2:
+         ccdciel('LogMsg','[ERROR] Filter wheel not set to index: %d name: %s but restored to index: %d name: %s' % (filter_index,filter_name,cur_init_fwheel_index[1],device_cache.filter_name(cur_init_fwheel_index[0])))
+         break
+      if status == 24 and restore == 3:
+         ccdciel('LogMsg','[CRITICAL ERROR] Filter wheel not restored, position is index: %d name: %s' % (cur_init_fwheel_index[0],device_cache.filter_name(cur_init_fwheel_index[0])))
+         if exit_on_critical_error:
+            span.end(status)
+            exit(1)
+         break
+
+   return span.end(status)
+
+# filter_offsets_move_focuser - check if CCDciel can move focuser by filters offsets when filter is selected
+# CCDciel moves focuser by difference of offsets of current and selected filter during filter change.
+# @arguments
+# filter_name - selected filter name
+#
+# @return True when offset of current or selected filter is not known or offsets differ
+def filter_offsets_move_focuser(filter_name):
+   if filter_name not in known_offsets:
+      return True
+   if len(known_offsets) == len(device_cache.filters_names()) and all(offset == 0 for offset in known_offsets.values()):
+      return False
+   current_filter = device_cache.filter_name(read_filter_wheel_index())
+   return current_filter not in known_offsets or known_offsets[current_filter] != known_offsets[filter_name]
+
+# move_filter_wheel_and_focuser - select filter in filter wheel and set focuser position
+# Filter wheel and focuser are moved at the same time only when filters offsets can not move
+# focuser during filter change, otherwise focuser is set after filter change, so move made by
+# CCDciel does not race with focuser move. Worker threads return status, critical errors end
+# script in main thread.
+# @arguments
+# filter_index - filter slot index (1..N)
+# filter_name - filter name
+# focuser_position - focuser position, None - deferred focuser position, see request_focuser_position()
+#
+# @return status of filter wheel like set_filter_wheel_position() and status of focuser like set_focuser_position()
+def move_filter_wheel_and_focuser(filter_index, filter_name, focuser_position=None):
+   global pending_focuser_position
+   focuser_filter = filter_name # Filter label of focuser move
+   if focuser_position == None:
+      focuser_position = pending_focuser_position
+      focuser_filter = pending_focuser_filter
+   pending_focuser_position = None
+   if focuser_position == None:
+      return set_filter_wheel_position(filter_index, filter_name), 0
+   if filter_offsets_move_focuser(filter_name):
+      ccdciel('LogMsg','Filters offsets can move focuser during filter change, focuser is set after filter wheel')
+      wheel_status = set_filter_wheel_position(filter_index, filter_name)
+      return wheel_status, set_focuser_position(focuser_position, focuser_filter)
+   wheel_status, focuser_status = run_concurrently([lambda: set_filter_wheel_position(filter_index, filter_name, False), lambda: set_focuser_position(focuser_position, focuser_filter, False)])
+   if wheel_status == 24 or focuser_status == 13:
+      exit(1)
+   return wheel_status, focuser_status
+
 # calculate_focuser_position - calculate focuser position for selected filter
 #                              using autofocus tool and store in array
+# Filter wheel rotation and focuser move to position for autofocus are done at the same time when offsets allow it.
 # @arguments
 # filter_name - selected filter name
+# force_autofocus - run autofocus even if filter is not reference and usage flag is not set
 #
 # @return status - status of operation
 # 0 - success
@@ -595,28 +1079,22 @@ def set_focuser_position(new_focuser_position):
 # 24 - cannot restore filter in filter wheel (critical error)
 # @return filter_index_and_name_focuser_position - array with filter index, name and focuser position
 #
-def calculate_focuser_position(filter_name):
+def calculate_focuser_position(filter_name, force_autofocus=False):
    global filters_and_focuser_positions_database_file
    global filters_and_focuser_positions_database_directory
    global filters_subset
    global focus_type
 
    status = 0 # Status of operation
-   restore = 0 # Restore flag, 0 - normal operation, 1 - need to restore, 2 - in progress, 3 - can not restore
    filter_index_and_name_focuser_position = [ 0, 'NONE', 0, 0, 0, 0 ] # array with filter index, name, focuser position, reference filter, offset and usage flag
-   cur_init_fwheel_index = [0,0] # current and initial filter wheel index
-   max_time_array = [30,60] # max operation time [normal,restore]
-   cur_max_time = [0,0] # current and max time
    ccdciel('LogMsg','Selected filter name: %s' %(filter_name))
    
-   # Looking for filter in filter wheel and display list of filters
-   list_of_filters = (ccdciel('Wheel_GetfiltersName')['result'])
-   for idf,f in enumerate(list_of_filters):
-      if filter_name == f:
-         filter_index_and_name_focuser_position[0] = idf+1
-         filter_index_and_name_focuser_position[1] = f
-         break
-    
+   # Looking for filter in filter wheel
+   filter_index = device_cache.filter_index(filter_name)
+   if filter_index != 0:
+      filter_index_and_name_focuser_position[0] = filter_index
+      filter_index_and_name_focuser_position[1] = filter_name
+
    if filter_index_and_name_focuser_position[1] != filter_name:
       ccdciel('LogMsg','[ERROR] Following filter %s not found: %s' % (filter_name,filter_index_and_name_focuser_position[1]))
       status = 22
@@ -625,62 +1103,12 @@ def calculate_focuser_position(filter_name):
    # Log found filter index and name
    ccdciel('LogMsg','Filter found index: %d name: %s' % (filter_index_and_name_focuser_position[0],filter_index_and_name_focuser_position[1]))
 
-   # Select filter in wheel
-   while True:
-      if restore == 0:
-         cur_max_time[1]=max_time_array[0] # Set max time for normal operation
-         cur_max_time[0]=0  # Clear timer
-      if restore == 1:
-         cur_max_time[1]=max_time_array[1] # Set max time for restore operation
-         cur_max_time[0]=0  # Clear timer
-         restore = 2 # Set restore flag to in progress
-      
-      # Get current filter wheel position and set new filter wheel position
-      cur_fwheel_dict = ccdciel('Wheel_getfilter')['result']
-      cur_init_fwheel_index[0] = int(cur_fwheel_dict.get("status"))
-      cur_init_fwheel_index[1] = cur_init_fwheel_index[0]
-      if restore == 0:
-         ccdciel('Wheel_setfilter',filter_index_and_name_focuser_position[0])
-      if restore == 1:
-         ccdciel('Wheel_setfilter',cur_init_fwheel_index[1])
-
-      # Check filter wheel position
-      while cur_init_fwheel_index[0] != filter_index_and_name_focuser_position[0]:
-         if cur_max_time[0] == cur_max_time[1]:
-            if restore == 0:
-               ccdciel('LogMsg','[ERROR] Filter wheel not set to index: %d name: %s during %ds try to restore initial filter!!!' % (filter_index_and_name_focuser_position[0],filter_name,cur_max_time[1]))
-               status = 23
-               restore = 1
-               break
-            if restore == 2:
-               ccdciel('LogMsg','[ERROR] Filter wheel can not restore filter index: %d name: %s during %ds something goes wrong!!!' % (cur_init_fwheel_index[1],list_of_filters[cur_init_fwheel_index[1]],cur_max_time[1]))
-               status = 24
-               restore = 3
-               break
-         time.sleep(1)
-         ccdciel('LogMsg','[DEBUG] Step: %s' % (cur_max_time[0]))
-         cur_fwheel_dict = ccdciel('Wheel_getfilter')['result']
-         cur_init_fwheel_index[0] = int(cur_fwheel_dict.get("status"))
-         ccdciel('LogMsg','[DEBUG] Step: %d filter %d expected filter %d' % (cur_max_time[0],cur_init_fwheel_index[0],filter_index_and_name_focuser_position[0]))
-         cur_max_time[0]=cur_max_time[0]+1
-      
-      # Check status after operation
-      if status == 0 and restore == 0:
-         ccdciel('LogMsg','Filter wheel set to index: %d name: %s' % (filter_index_and_name_focuser_position[0],filter_name))
-         break
-      if status == 23 and restore == 2:
-         ccdciel('LogMsg','[ERROR] Filter wheel not set to index: %d name: %s but restored to index: %d name: %s' % (filter_index_and_name_focuser_position[0],filter_name,cur_init_fwheel_index[1],list_of_filters[cur_init_fwheel_index[0]]))
-         break
-      if status == 24 and restore == 3:
-         ccdciel('LogMsg','[CRITICAL ERROR] Filter wheel not restored, position is index: %d name: %s' % (cur_init_fwheel_index[0],list_of_filters[cur_init_fwheel_index[0]]))
-         exit(1)
-
    # Get optimal position for filter from data base
    status, focuser_position_reference_flag_offset_and_usage_flag = get_focuser_position_for_filter_from_database(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory,filter_name)
    if status == 34 or status == 35 or status == 36 or status == 0:
       filter_index_and_name_focuser_position[2] = focuser_position_reference_flag_offset_and_usage_flag[0]
       ccdciel('LogMsg','Focuser position for filter %s read from database is %d' % (filter_name,filter_index_and_name_focuser_position[2]))
-      set_focuser_position(filter_index_and_name_focuser_position[2])
+      request_focuser_position(filter_index_and_name_focuser_position[2], filter_name)
       
       # Set reference filter and offset to 0 will be calculated after autofocus
       filter_index_and_name_focuser_position[3] = focuser_position_reference_flag_offset_and_usage_flag[1]
@@ -692,9 +1120,10 @@ def calculate_focuser_position(filter_name):
    else:
       ccdciel('LogMsg','[WARNING] Can not read focuser position for filter %s from database, script will use initial focuser position or current value' % (filter_name))
       if initial_focuser_position != 0:
-         set_focuser_position(initial_focuser_position)
+         request_focuser_position(initial_focuser_position, filter_name)
          ccdciel('LogMsg','Set initial focuser position to %d before autofocus' % (initial_focuser_position))
       else:
+         flush_focuser_position()
          cur_focuser_position = ccdciel('FocuserPosition')['result']
          if cur_focuser_position != 0:
             ccdciel('LogMsg','Use current focuser position before autofocus is %d' % (ccdciel('FocuserPosition')['result']))
@@ -715,63 +1144,211 @@ def calculate_focuser_position(filter_name):
       elif filter_on_subset_list == 0 and filter_index_and_name_focuser_position[5] == 1:
          filter_index_and_name_focuser_position[5] = 0
          ccdciel('LogMsg','Filter %s index %d not found in filters subset, mark filter as not in use' % (filter_name,filter_index_and_name_focuser_position[0]))
+
+   # Autofocus is done if filter is reference or usage flag is set to 1
+   autofocus = force_autofocus or filter_index_and_name_focuser_position[3] == 1 or filter_index_and_name_focuser_position[5] == 1
+
+   # Select filter in wheel, focuser is moved at the same time when it is needed for autofocus
+   if autofocus:
+      wheel_status, focuser_status = move_filter_wheel_and_focuser(filter_index_and_name_focuser_position[0], filter_name)
+      # Autofocus with other filter in wheel would store its position for selected filter
+      if wheel_status != 0:
+         ccdciel('LogMsg','[ERROR] Filter %s not set in filter wheel, autofocus skipped' % (filter_name))
+         return wheel_status, filter_index_and_name_focuser_position
+   else:
+      set_filter_wheel_position(filter_index_and_name_focuser_position[0], filter_name)
       
-   # Calculate focuser position for selected filter using autofocus tool if filter is reference or usage flag is set to 1
-   if filter_index_and_name_focuser_position[3] == 1 or filter_index_and_name_focuser_position[5] == 1:
-      if filter_index_and_name_focuser_position[5] == 0:
+   # Calculate focuser position for selected filter using autofocus tool
+   if autofocus:
+      if filter_index_and_name_focuser_position[5] == 0 and filter_index_and_name_focuser_position[3] == 1:
          ccdciel('LogMsg','Calculate focuser position for selected filter %s, reference flag have priority over usage flag which set to 0' % (filter_name))
+      autofocus_start = time.monotonic()
+      span = run_spans.begin('autofocus', filter_name) # Timing span of autofocus
       if focus_type == 0:
          ccdciel('LogMsg','Calculate focuser position for selected filter using automatic autofocus tool')
-         ccdciel('AutomaticAutofocus')
+         autofocus_response = ccdciel('AutomaticAutofocus')
       elif focus_type == 1:
          ccdciel('LogMsg','Calculate focuser position for selected filter using autofocus tool')
-         ccdciel('Autofocus')
+         autofocus_response = ccdciel('Autofocus')
       else:
          ccdciel('LogMsg','[CRITICAL ERROR] Unknown autofocus type %d' % (focus_type))
          exit(1)
+      autofocus_duration = time.monotonic() - autofocus_start
+      autofocus_result = autofocus_response.get('result')
+      span.end(1 if response_error(autofocus_response) != None or autofocus_result == False or (isinstance(autofocus_result, dict) and autofocus_result.get('status', 'OK') != 'OK') else 0)
 
       # Get calculated focuser position
       filter_index_and_name_focuser_position[2] = ccdciel('FocuserPosition')['result']
       ccdciel('LogMsg','Calculated focuser position for filter %s is %d' % (filter_name,filter_index_and_name_focuser_position[2]))
 
+      # Remember autofocus result for focus history and update prediction model
+      autofocus_results.append([filter_name, filter_index_and_name_focuser_position[2], time.time(), autofocus_duration, read_temperature('CcdTemp'), read_temperature('FocuserTemp')])
+      if focus_predictor != None:
+         focus_predictor.update(filter_name, autofocus_results[-1][5], filter_index_and_name_focuser_position[2])
+
    else:
       ccdciel('LogMsg','Skip calculating focuser position for selected filter %s, usage flag is set to 0' % (filter_name))
 
    return status, filter_index_and_name_focuser_position
 
 # select_filter_and_set_focuser_position - select filter in filter wheel and set focuser position from database
+#                                          filter wheel and focuser are moved at the same time when offsets allow it
 # @return status - status of operation
 # 0 - success
+# 12 - can not set new focuser position, initial position restored
 # 15 - use current focuser position as initial position
+# 23 - can not set filter in filter wheel, initial filter restored
 def select_filter_and_set_focuser_position(db_name, db_directory, filter_name_and_index):
    status = 0 # Status of operation
    
-   # Set filter in filter wheel
-   ccdciel('Wheel_setfilter',filter_name_and_index[1])
-
-   # Get current focuser position
-   cur_focuser_position = ccdciel('FocuserPosition')['result']
-
    # Get focuser position for selected filter from database
    status, focuser_position_reference_flag_offset_and_usage_flag = get_focuser_position_for_filter_from_database(db_name, db_directory, filter_name_and_index[0])
 
-   # Set focuser position for selected filter
+   # Set filter in filter wheel and focuser position for selected filter, predicted from temperature if possible
    if status == 0 or status == 34 or status == 35 or status == 36:
-      set_focuser_position(focuser_position_reference_flag_offset_and_usage_flag[0])
+      temperature = read_temperature('FocuserTemp') if focus_predictor != None and prediction_max_error > 0 else None
+      new_focuser_position = predicted_focuser_position(filter_name_and_index[0], focuser_position_reference_flag_offset_and_usage_flag[0], temperature)
+      wheel_status, focuser_status = move_filter_wheel_and_focuser(filter_name_and_index[1], filter_name_and_index[0], new_focuser_position)
+      status = wheel_status if wheel_status != 0 else focuser_status
    else:
+      set_filter_wheel_position(filter_name_and_index[1], filter_name_and_index[0])
+      cur_focuser_position = ccdciel('FocuserPosition')['result']
       ccdciel('LogMsg','[WARNING] Can not read focuser position for filter %s from database, script will use current focuser position %d' % (filter_name_and_index[0],cur_focuser_position))
       status = 15
 
    return status
 
+# select_filters_for_incremental_calculation - calculate focuser position for reference filter
+#                                              and select filters which must be calculated again
+# Filter in use is calculated again when reference filter moved more than drift_tolerance
+# or latest autofocus for filter is older than max_data_age, other filters keep stored
+# position shifted by reference filter move, so their offsets are carried forward.
+# @arguments
+# list_of_filters - list of filters in filter wheel
+# reference_filter_id - reference filter index provided by arguments, 0 - use reference filter from database,
+#                       without reference flag stored filter with most recent autofocus or current filter is used
+#
+# @return calculated filters (filter name -> [status, filter_index_and_name_focuser_position]),
+#         filters to calculate (list of names) or None if all filters must be calculated,
+#         shift of reference filter in focuser steps,
+#         reference filter index used for calculation (1..N), 0 - no reference filter
+def select_filters_for_incremental_calculation(list_of_filters, reference_filter_id):
+   stored = {} # Filter name -> focuser position, reference flag, offset and usage flag from database
+   for f in list_of_filters:
+      status, focuser_position_reference_flag_offset_and_usage_flag = get_focuser_position_for_filter_from_database(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory,f)
+      if status == 0 or status == 34 or status == 35 or status == 36:
+         stored[f] = focuser_position_reference_flag_offset_and_usage_flag
+         if reference_filter_id == 0 and focuser_position_reference_flag_offset_and_usage_flag[1] == 1:
+            reference_filter_id = device_cache.filter_index(f)
+   reference_filter = device_cache.filter_name(reference_filter_id) if reference_filter_id != 0 else None
+   status, latest_autofocus = FocusHistory(os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file), profile=focus_profile).latest()
+   if reference_filter == None and len(stored) > 0:
+      # No reference flag in database (CALCULATE without -n, -i), use stored filter with most recent autofocus
+      # or filter currently set in filter wheel
+      with_history = [f for f in stored if f in latest_autofocus]
+      if len(with_history) > 0:
+         reference_filter = max(with_history, key=lambda f: latest_autofocus[f])
+      else:
+         reference_filter = device_cache.filter_name(read_filter_wheel_index())
+      ccdciel('LogMsg','No reference filter flagged in database, filter %s used as reference filter' % (reference_filter))
+   if reference_filter == None or reference_filter not in stored:
+      ccdciel('LogMsg','[WARNING] No reference filter with focuser position in database, calculate all filters')
+      return {}, None, 0, reference_filter_id
+
+   # Autofocus reference filter and measure shift against stored position
+   status, filter_and_focuser_position = calculate_focuser_position(reference_filter, True)
+   if status != 0:
+      ccdciel('LogMsg','[WARNING] Can not calculate focuser position for reference filter %s, calculate all filters' % (reference_filter))
+      return {}, None, 0, device_cache.filter_index(reference_filter)
+   shift = filter_and_focuser_position[2] - stored[reference_filter][0]
+   ccdciel('LogMsg','Reference filter %s moved by %d steps, tolerance %d steps' % (reference_filter, shift, drift_tolerance))
+
+   # Select filters in use which moved or have old data
+   filters_to_calculate = []
+   for idf,f in enumerate(list_of_filters):
+      if f == reference_filter:
+         continue
+      if f not in stored:
+         ccdciel('LogMsg','Filter %s not found in database, calculate focuser position' % (f))
+         filters_to_calculate.append(f)
+         continue
+      in_use = (idf+1) in filters_subset if len(filters_subset) > 0 else stored[f][3] == 1
+      if not in_use:
+         continue
+      if abs(shift) > drift_tolerance:
+         ccdciel('LogMsg','Filter %s will be calculated, reference filter moved more than tolerance' % (f))
+         filters_to_calculate.append(f)
+      elif f not in latest_autofocus or time.time() - latest_autofocus[f] > max_data_age * 86400.0:
+         ccdciel('LogMsg','Filter %s will be calculated, latest autofocus is older than %.1f days' % (f, max_data_age))
+         filters_to_calculate.append(f)
+   ccdciel('LogMsg','INCREMENTAL mode: autofocus skipped for %d filters' % (len(list_of_filters) - 1 - len(filters_to_calculate)))
+   return {reference_filter: [status, filter_and_focuser_position]}, filters_to_calculate, shift, device_cache.filter_index(reference_filter)
+
+# plan_filter_visit_order - plan order of filters visits which minimises time of moves
+# Reference filter is visited first, other filters are ordered to minimise filter wheel rotation
+# and focuser travel between stored positions, at the end filter wheel returns to reference filter.
+# Estimated time against filter wheel order is logged.
+# @arguments
+# list_of_filters - list of filters in filter wheel
+# reference_filter_id - reference filter index (1..N), 0 - use reference filter flagged in database
+# visited_filters - list of filters which will be visited (filter wheel and focuser moved), None - all filters
+# reference_calculated - 1 - reference filter is already calculated, filter wheel is on reference filter
+#
+# @return list of filters indexes (0..N-1) in visit order
+def plan_filter_visit_order(list_of_filters, reference_filter_id, visited_filters, reference_calculated):
+   slots = {-1: read_filter_wheel_index()-1} # Node -> filter wheel slot (0..N-1), node -1 is current state
+   positions = {-1: ccdciel('FocuserPosition')['result']} # Node -> focuser position
+   in_use = [] # Filters for which autofocus is expected
+   load_focus_repository(filters_and_focuser_positions_database_file, filters_and_focuser_positions_database_directory)
+   for idf,f in enumerate(list_of_filters):
+      slots[idf] = idf
+      positions[idf] = initial_focuser_position if initial_focuser_position != 0 else positions[-1]
+      if focus_repository != None:
+         status, focuser_position_reference_flag_offset_and_usage_flag = focus_repository.get(f)
+         if status == 0 or status == 34 or status == 35 or status == 36:
+            positions[idf] = focuser_position_reference_flag_offset_and_usage_flag[0]
+            if reference_filter_id == 0 and focuser_position_reference_flag_offset_and_usage_flag[1] == 1:
+               reference_filter_id = idf+1
+            if focuser_position_reference_flag_offset_and_usage_flag[3] == 1 and len(filters_subset) == 0:
+               in_use.append(f)
+      if (idf+1) in filters_subset:
+         in_use.append(f)
+
+   # Cost of move between filters is estimated time of filter wheel rotation and focuser travel
+   def move_time(a, b):
+      return kinematics_model.estimate_time('wheel', abs(slots[a] - slots[b])) + kinematics_model.estimate_time('focuser', abs(positions[a] - positions[b]))
+
+   reference = reference_filter_id - 1 if reference_filter_id != 0 else None
+   nodes = [idf for idf,f in enumerate(list_of_filters) if (visited_filters == None or f in visited_filters) and idf != reference]
+   if reference != None:
+      wheel_order = ([reference] if reference_calculated == 1 else []) + [idf for idf in range(len(list_of_filters)) if idf in nodes or (idf == reference and reference_calculated == 0)]
+      order = [reference] + plan_visit_order(nodes, move_time, reference, reference)
+   else:
+      wheel_order = nodes
+      order = plan_visit_order(nodes, move_time, -1)
+   wheel_order_time = path_cost(wheel_order, move_time, -1, reference)
+   planned_time = path_cost(order, move_time, -1, reference)
+
+   # Autofocus time is the same for every order, it is logged to show total estimation
+   status, autofocus_durations = FocusHistory(os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file), profile=focus_profile).mean_durations(time.time() - 180 * 86400.0)
+   autofocus_time = sum(autofocus_durations.get(list_of_filters[idf], 0.0) for idf in order if list_of_filters[idf] in in_use or idf == reference)
+   ccdciel('LogMsg','Planned filters visit order: %s' % (', '.join(list_of_filters[idf] for idf in order)))
+   ccdciel('LogMsg','Estimated moves time %.0fs, in filter wheel order %.0fs, saving %.0fs, expected autofocus time %.0fs' % (planned_time, wheel_order_time, wheel_order_time - planned_time, autofocus_time))
+
+   # Filters which are not visited keep filter wheel order
+   return order + [idf for idf in range(len(list_of_filters)) if idf not in order]
+
 # calculate_focuser_position_for_filter_wheel - calculate focuser position for used filter wheel
+# @arguments
+# incremental - 0 - calculate all filters, 1 - INCREMENTAL mode, calculate reference filter and filters which moved or have old data
+#
 # @return status - status of operation
 # 0 - success
-def calculate_focuser_position_for_filter_wheel():
+def calculate_focuser_position_for_filter_wheel(incremental=0):
    global filter_name_to_set
 
    status = 0 # Status of operation
-   focuser_position_per_filter = [ ] # array with focuser position per filter
+   focuser_position_per_filter = [ ] # array with focuser position per filter in filter wheel order
    reference_filter_id = 0 # Reference filter id
    
    # Get reference filter from parameters if provided
@@ -781,16 +1358,34 @@ def calculate_focuser_position_for_filter_wheel():
       ccdciel('LogMsg','Reference filter provided by parameters name: %s position: %d' % (filter_name_to_set[2],filter_name_to_set[3]))
    
    # Get list of filters in filter wheel
-   list_of_filters = (ccdciel('Wheel_GetfiltersName')['result'])
+   list_of_filters = device_cache.filters_names()
 
    # Reset offset for each filter in filters wheel
    if check_for_version_neq_0_9_92_3829(0) == 1:
-      for idf,f in enumerate(list_of_filters):
-         ccdciel('Set_FilterOffset',[f,0])
-
-   # Calculate focuser position for each filter
-   for idf,f in enumerate(list_of_filters):
-      status, filter_and_focuser_position = calculate_focuser_position(f)
+      set_filters_offsets([[idf+1,f,0] for idf,f in enumerate(list_of_filters)], None)
+
+   # INCREMENTAL mode - calculate reference filter and select other filters to calculate
+   calculated_filters = {} # Filter name -> status and calculated focuser position
+   filters_to_calculate = None # List of filters to calculate, None - all filters
+   reference_shift = 0 # Shift of reference filter in focuser steps
+   if incremental == 1:
+      calculated_filters, filters_to_calculate, reference_shift, reference_filter_id = select_filters_for_incremental_calculation(list_of_filters, reference_filter_id)
+
+   # Calculate focuser position for each filter in planned order
+   visit_order = plan_filter_visit_order(list_of_filters, reference_filter_id, filters_to_calculate, 1 if len(calculated_filters) > 0 else 0)
+   focuser_position_per_filter = [None] * len(list_of_filters)
+   for idf in visit_order:
+      f = list_of_filters[idf]
+      if f in calculated_filters:
+         status, filter_and_focuser_position = calculated_filters[f]
+      elif filters_to_calculate != None and f not in filters_to_calculate:
+         # Keep stored position shifted by reference filter move, offset is carried forward
+         status, focuser_position_reference_flag_offset_and_usage_flag = get_focuser_position_for_filter_from_database(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory,f)
+         filter_and_focuser_position = [ idf+1, f, focuser_position_reference_flag_offset_and_usage_flag[0] + reference_shift, focuser_position_reference_flag_offset_and_usage_flag[1], 0, focuser_position_reference_flag_offset_and_usage_flag[3] ]
+         ccdciel('LogMsg','Skip calculating focuser position for filter %s, stored position shifted to %d' % (f, filter_and_focuser_position[2]))
+         status = 0
+      else:
+         status, filter_and_focuser_position = calculate_focuser_position(f)
       if status == 0:
          # Reference filter id handling
          if (idf+1) == reference_filter_id:
@@ -802,35 +1397,39 @@ def calculate_focuser_position_for_filter_wheel():
             filter_and_focuser_position[3] = 0
             ccdciel('LogMsg','[WARNING] Multiple reference filters found reference flag will be removed, current index: %d name: %s index: %d' % (filter_and_focuser_position[0],filter_and_focuser_position[1],reference_filter_id))
          # Store calculated focuser position for filter in array
-         focuser_position_per_filter.append(filter_and_focuser_position)
+         focuser_position_per_filter[idf] = filter_and_focuser_position
       else:
          filter_index_and_name_focuser_position = [ idf+1, f, ccdciel('FocuserPosition')['result'], 0, 0, 1 ] # array with filter index, name, focuser position, reference filter, offset and usage flag
-         focuser_position_per_filter.append(filter_index_and_name_focuser_position)
+         focuser_position_per_filter[idf] = filter_index_and_name_focuser_position
          ccdciel('LogMsg','[ERROR] Can not calculate focuser position for filter %s' % (f))
    
    # Set filters wheel in reference filter position
    if reference_filter_id != 0:
       ccdciel('Wheel_setfilter',reference_filter_id)
-      ccdciel('LogMsg','Filter wheel set to reference filter index: %d name: %s' % (reference_filter_id,(ccdciel('Wheel_GetfiltersName')['result'])[reference_filter_id-1]))
+      ccdciel('LogMsg','Filter wheel set to reference filter index: %d name: %s' % (reference_filter_id,device_cache.filter_name(reference_filter_id)))
 
    # Calculate offset for each filter based on reference filter
    if(reference_filter_id != 0):
-      filter_name_to_set[0] = (ccdciel('Wheel_GetfiltersName')['result'])[reference_filter_id-1]
+      filter_name_to_set[0] = device_cache.filter_name(reference_filter_id)
       filter_name_to_set[1] = reference_filter_id
    for idf,f in enumerate(list_of_filters):
       focuser_position_per_filter[idf][4] = focuser_position_per_filter[idf][2] - focuser_position_per_filter[reference_filter_id-1][2]
-      if check_for_version_neq_0_9_92_3829(0) == 1:
-         ccdciel('Set_FilterOffset',[focuser_position_per_filter[idf][1],focuser_position_per_filter[idf][4]])
-         ccdciel('LogMsg','Filter index: %d name: %s offset: %d' % (focuser_position_per_filter[idf][0],focuser_position_per_filter[idf][1],focuser_position_per_filter[idf][4]))
+   if check_for_version_neq_0_9_92_3829(0) == 1:
+      set_filters_offsets([[item[0],item[1],item[4]] for item in focuser_position_per_filter], 'Filter index: %d name: %s offset: %d')
 
    # Store calculated focuser position for each filter in database
+   span = run_spans.begin('db_write') # Timing span of database write
+   status = store_positions_per_filter_in_database(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory,focuser_position_per_filter)
    for item in focuser_position_per_filter:
-      status = store_position_per_filter_in_database(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory,item[1],item[2],item[3],item[4],item[5])
       if status != 0:
          ccdciel('LogMsg','[ERROR] Can not store focuser position %d for filter %d:%s in database' % (item[2], item[0], item[1]))
       else:
          ccdciel('LogMsg','Filter index: %d name: %s focuser position: %d' % (item[0], item[1], item[2]))
 
+   # Append autofocus results to focus history
+   history_status = store_focus_history_in_database(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory,focuser_position_per_filter,device_cache.filter_name(reference_filter_id) if reference_filter_id != 0 else None)
+   span.end(status if status != 0 else history_status)
+
    # Switch to initial filter in filter wheel and set focuser position
    status = select_filter_and_set_focuser_position(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory, filter_name_to_set)
 
@@ -847,16 +1446,23 @@ def read_focuser_position_for_filters():
    get_reference_filter_from_application_arguments()
 
    # Get list of filters in filter wheel
-   list_of_filters = (ccdciel('Wheel_GetfiltersName')['result'])
+   list_of_filters = device_cache.filters_names()
    filters_configured_in_database = []
+   reference_filter_index = -1 # Index of reference filter stored in database
+   prediction_used = False # True if predicted position is used for any filter
+   temperature = read_temperature('FocuserTemp') if focus_predictor != None and prediction_max_error > 0 else None
             
    # Get focuser position for filters from database
    for idf,f in enumerate(list_of_filters):
       status, focuser_position_reference_flag_offset_and_usage_flag = get_focuser_position_for_filter_from_database(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory,f)
       if status == 0:
          ccdciel('LogMsg','Filter %s configuration in database -> focuser position: %d reference flag: %d offset: %d' % (f,focuser_position_reference_flag_offset_and_usage_flag[0],focuser_position_reference_flag_offset_and_usage_flag[1],focuser_position_reference_flag_offset_and_usage_flag[2]))
-         filters_configured_in_database.append(focuser_position_reference_flag_offset_and_usage_flag)
+         filters_configured_in_database.append(list(focuser_position_reference_flag_offset_and_usage_flag))
+         filters_configured_in_database[idf][0] = predicted_focuser_position(f, focuser_position_reference_flag_offset_and_usage_flag[0], temperature)
+         if filters_configured_in_database[idf][0] != focuser_position_reference_flag_offset_and_usage_flag[0]:
+            prediction_used = True
          if focuser_position_reference_flag_offset_and_usage_flag[1] == 1:
+            reference_filter_index = idf
             if filter_name_to_set[2] == None and filter_name_to_set[3] == None:
                filter_name_to_set[0] = f
                filter_name_to_set[1] = idf+1
@@ -866,10 +1472,17 @@ def read_focuser_position_for_filters():
          ccdciel('LogMsg','[CRITICAL ERROR] Can not read focuser position for filter %s from database' % (f))
          exit(1)
 
-   # Reset offset for each filter in filters wheel
+   # Offsets stored in database are replaced by differences of predicted positions
+   if prediction_used and reference_filter_index >= 0:
+      for item in filters_configured_in_database:
+         item[2] = item[0] - filters_configured_in_database[reference_filter_index][0]
+
+   # Reset offsets of current and selected filter, so filter change does not move focuser, other offsets are kept
    if check_for_version_neq_0_9_92_3829(0) == 1:
-      for idf,f in enumerate(list_of_filters):
-         ccdciel('Set_FilterOffset',[f,0])
+      current_filter = device_cache.filter_name(read_filter_wheel_index())
+      fingerprint = load_applied_offsets()
+      if current_filter != filter_name_to_set[0] and (fingerprint == None or fingerprint.offsets.get(current_filter) == None or fingerprint.offsets.get(current_filter) != fingerprint.offsets.get(filter_name_to_set[0])):
+         set_filters_offsets([[idf+1,f,0] for idf,f in enumerate(list_of_filters) if f == current_filter or f == filter_name_to_set[0]], None, True)
 
    # Apply configuration for selected filter
    status = select_filter_and_set_focuser_position(filters_and_focuser_positions_database_file,filters_and_focuser_positions_database_directory, filter_name_to_set)
@@ -881,42 +1494,316 @@ def read_focuser_position_for_filters():
          # Get current focuser position
          cur_focuser_position = ccdciel('FocuserPosition')['result']
          # Calculate and set offsets
-         for idf,f in enumerate(list_of_filters):
-            filter_offset = filters_configured_in_database[idf][0]-cur_focuser_position
-            ccdciel('Set_FilterOffset',[f,filter_offset])
-            ccdciel('LogMsg','Filter index: %d name: %s calculated offset: %d' % (idf+1,f,filter_offset))
+         set_filters_offsets([[idf+1,f,filters_configured_in_database[idf][0]-cur_focuser_position] for idf,f in enumerate(list_of_filters)], 'Filter index: %d name: %s calculated offset: %d', True)
       else:
          # Set offset from database
-         for idf,f in enumerate(list_of_filters):
-            ccdciel('Set_FilterOffset',[f,filters_configured_in_database[idf][2]])
-            ccdciel('LogMsg','Filter index: %d name: %s offset: %d' % (idf+1,f,filters_configured_in_database[idf][2]))
+         set_filters_offsets([[idf+1,f,filters_configured_in_database[idf][2]] for idf,f in enumerate(list_of_filters)], 'Filter index: %d name: %s offset: %d', True)
 
    return status   
 
+# report_phase_durations - log duration of run phases across runs stored in database
+# For every phase and for every filter in phase number of runs, spans and failed spans,
+# p50, p95 and max duration and median of latest runs are logged, so slow phases and
+# slowly degrading focuser or filter wheel can be found.
+# @return status - status of operation
+# 0 - success
+# 32 - can not read spans from database
+def report_phase_durations():
+   status, statistics = RunSpans(os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file)).statistics()
+   if status != 0:
+      ccdciel('LogMsg','[ERROR] Can not read timing spans from database \"%s/%s\"' % (filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file))
+      return status
+   if len(statistics) == 0:
+      ccdciel('LogMsg','[INFO] No timing spans in database, run script in other working mode first')
+      return status
+   for item in statistics:
+      ccdciel('LogMsg','[REPORT] %s%s: runs %d spans %d failed %d p50 %.1fs p95 %.1fs max %.1fs recent p50 %.1fs' % (item[0], ' filter %s' % (item[1]) if item[1] != None else '', item[2], item[3], item[4], item[5], item[6], item[7], item[8]))
+   return status
+
+# select_profile - select rig profile of current run
+# Profile provided by argument is used, otherwise the only profile stored in database,
+# otherwise profile which filters are the same as filters in filter wheel. Database
+# created by older version of script is upgraded first, its rows belong to default profile.
+# @return status
+# 0 - success
+# 31 - can not upgrade database
+# 32 - can not read profiles from database, default profile is used
+# EXIT - profile can not be detected (critical error)
+def select_profile():
+   global focus_profile
+
+   db_path = os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file)
+   status = upgrade_database(db_path)
+   if status != 0:
+      ccdciel('LogMsg','[ERROR] Can not upgrade database %s to rig profiles' % (filters_and_focuser_positions_database_file))
+
+   # Profile provided by argument
+   if profile_name != None:
+      focus_profile = profile_name
+      ccdciel('LogMsg','[INFO] Rig profile: %s' % (focus_profile))
+      return status
+
+   # Profile detected from filters in filter wheel
+   focus_profile = DEFAULT_PROFILE
+   profiles_status, profiles = FocusRepository(db_path).profiles()
+   if profiles_status != 0:
+      ccdciel('LogMsg','[WARNING] Can not read rig profiles from database, profile %s will be used' % (focus_profile))
+      return profiles_status
+   if len(profiles) == 1:
+      focus_profile = list(profiles.keys())[0]
+   elif len(profiles) > 1:
+      list_of_filters = device_cache.filters_names()
+      matching_profiles = [p for p in sorted(profiles.keys()) if set(profiles[p]) == set(list_of_filters)]
+      if len(matching_profiles) != 1:
+         ccdciel('LogMsg','[CRITICAL ERROR] Can not detect rig profile from filters in filter wheel, matching profiles: %s, stored profiles: %s, select profile by --profile, -r argument' % (', '.join(matching_profiles) if len(matching_profiles) > 0 else 'none', ', '.join(sorted(profiles.keys()))))
+         exit(1)
+      focus_profile = matching_profiles[0]
+   ccdciel('LogMsg','[INFO] Rig profile: %s detected' % (focus_profile))
+   return status
+
+# load_models - load focuser and filter wheel kinematics model and temperature-compensated
+#               focus prediction from database, models are loaded once and kept by daemon
+#               until database is changed
+def load_models():
+   global kinematics_model
+   global focus_predictor
+
+   db_path = os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file)
+
+   # Load focuser and filter wheel kinematics model from database
+   if kinematics_model == None or kinematics_model.db_path != db_path:
+      kinematics_model = KinematicsModel(db_path)
+      if kinematics_model.load() == 0:
+         ccdciel('LogMsg','[INFO] Kinematics model: %s' % (kinematics_model.description()))
+      else:
+         ccdciel('LogMsg','[WARNING] Can not read kinematics model from database, default moves timeouts will be used')
+
+   # Load temperature-compensated focus prediction from focus history
+   if prediction_max_error <= 0:
+      focus_predictor = None
+   elif focus_predictor == None or focus_predictor.db_path != db_path or focus_predictor.profile != focus_profile:
+      focus_predictor = FocusPredictor(db_path, prediction_max_error, focus_profile)
+      if focus_predictor.load() == 0:
+         for f in device_cache.filters_names():
+            ccdciel('LogMsg','[INFO] Focus prediction: %s' % (focus_predictor.description(f)))
+      else:
+         ccdciel('LogMsg','[WARNING] Can not read focus history from database, stored focuser positions will be used')
+         focus_predictor = None
+   else:
+      focus_predictor.max_error = prediction_max_error
+
+# forget_changed_database - forget data read from database when database was changed by other process
+# Daemon keeps focus table, applied offsets and models between requests, they are read again
+# when other process (script run with --local, end session script, sqlite3 shell) changed
+# database or database file was replaced since last request.
+def forget_changed_database():
+   global loaded_database_version
+   global focus_repository
+   global applied_offsets
+   global kinematics_model
+   global focus_predictor
+
+   db_path = os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file)
+   version = [db_path, database_version(db_path)]
+   if loaded_database_version != None and loaded_database_version[0] == db_path and version[1] != None and loaded_database_version[1] == version[1]:
+      return
+   if loaded_database_version != None:
+      ccdciel('LogMsg','[INFO] Database changed by other process, data will be read again')
+   focus_repository = None
+   applied_offsets = None
+   kinematics_model = None
+   focus_predictor = None
+   loaded_database_version = version
+
+# run_working_mode - run script in working mode selected by arguments
+# Critical errors end run by exit(1).
+def run_working_mode():
+   global run_spans
+
+   for message in arguments_log:
+      ccdciel('LogMsg', message)
+
+   ccdciel('LogMsg','[INFO] This script path %s' % (this_script_path))
+   ccdciel('LogMsg','[INFO] This script directory %s' % (this_script_dir))
+   ccdciel('LogMsg','[INFO] Database name %s' % (filters_and_focuser_positions_database_file))
+   ccdciel('LogMsg','[INFO] Initial focuser position %d' % (initial_focuser_position))
+
+   # REPORT mode - log duration of run phases from previous runs, devices are not used
+   if script_working_mode == 4:
+      ccdciel('LogMsg','[INFO] Script working mode: REPORT duration of run phases')
+      report_phase_durations()
+      return
+
+   # Record timing spans of run phases, run ended by critical error is stored at exit
+   run_spans = RunSpans(os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file), ['CALCULATE', 'READ', 'RESET', 'INCREMENTAL'][script_working_mode])
+
+   # Check necessary components are connected
+   check_necessary_components()
+
+   # Select rig profile, load kinematics model and focus prediction
+   select_profile()
+   load_models()
+
+   # Run script in selected working mode CALCULATE (0) - default or READ (1) or RESET (2) or INCREMENTAL (3)
+   if script_working_mode == 1:
+      ccdciel('LogMsg','[INFO] Script working mode: READ focuser position for selected filter from database')
+      read_focuser_position_for_filters()
+   elif script_working_mode == 2:
+      ccdciel('LogMsg','[INFO] Script working mode: RESET focuser positions and offsets for all filters')
+      reset_focuser_positions_and_offsets()
+   elif script_working_mode == 3:
+      ccdciel('LogMsg','[INFO] Script working mode: INCREMENTAL calculate focuser position for filters which moved')
+      calculate_focuser_position_for_filter_wheel(1)
+   else:
+      ccdciel('LogMsg','[INFO] Script working mode: CALCULATE focuser position for filter wheel')
+      calculate_focuser_position_for_filter_wheel()
+
+   # Execute deferred focuser move
+   flush_focuser_position()
+
+   # Store recorded moves for kinematics model
+   if kinematics_model.save() != 0:
+      ccdciel('LogMsg','[WARNING] Can not store recorded moves for kinematics model in database')
+
+   # Store timing spans of run phases
+   if run_spans.save(1) != 0:
+      ccdciel('LogMsg','[WARNING] Can not store timing spans of run phases in database')
+
+   # Log device cache statistics
+   device_cache.log_statistics()
+
+# serve_request - serve request send to daemon by script started with arguments
+# @arguments
+# request - request object with list of script arguments
+#
+# @return response object with exit status of run
+def serve_request(request):
+   global run_spans
+   global prediction_max_error
+   status = 0 # Exit status of run
+
+   # Every request starts from state of daemon after start, filter wheel could be reconfigured between requests
+   for name,value in copy.deepcopy(daemon_state).items():
+      globals()[name] = value
+   device_cache.invalidate('Wheel_GetfiltersName')
+   device_cache.hits = 0
+   device_cache.misses = 0
+   arguments = request.get('arguments') if isinstance(request, dict) else None
+   if not isinstance(arguments, list):
+      return {'status': 1, 'error': 'invalid request'}
+
+   # Devices of other CCDciel instance are not used by daemon, script which sent request runs itself
+   endpoint = request.get('endpoint')
+   if isinstance(endpoint, list) and len(endpoint) == 2 and [str(v) for v in endpoint] != [str(v) for v in ccdciel_address()]:
+      return {'status': 1, 'rejected': True, 'error': 'Daemon uses CCDciel on %s:%s, request for %s:%s rejected' % (ccdciel_address() + tuple(endpoint))}
+
+   # Run is logged with level and log file of script which sent request
+   request_log = request.get('log')
+   daemon_log = set_log_options(request_log[0], request_log[1]) if isinstance(request_log, list) and len(request_log) == 2 else None
+
+   sys.argv = [this_script_path] + [str(a) for a in arguments]
+   try:
+      arguments_parser()
+      if prediction_max_error == None:
+         prediction_max_error = FocusPredictor.DEFAULT_MAX_ERROR
+      forget_changed_database()
+      run_working_mode()
+   except SystemExit as e:
+      # Run ended by critical error, spans are stored as not completed
+      status = e.code if isinstance(e.code, int) else 1
+      if run_spans != None and run_spans.save() != 0:
+         ccdciel('LogMsg','[WARNING] Can not store timing spans of run phases in database')
+   except Exception as e:
+      ccdciel('LogMsg','[ERROR] Daemon request failed: %s' % (str(e)))
+      status = 1
+   flush_log()
+   if daemon_log != None:
+      set_log_options(daemon_log[0], daemon_log[1])
+   return {'status': status}
+
+# run_daemon - run script as daemon, database, models and device information are
+#              read once and kept warm for requests from scripts started later
+# @arguments
+# address - address of daemon socket, see daemon_address()
+def run_daemon(address):
+   global daemon_state
+   global arguments_log
+   global run_spans
+
+   for message in arguments_log:
+      ccdciel('LogMsg', message)
+   arguments_log = []
+   daemon_state = copy.deepcopy(dict((name, globals()[name]) for name in RUN_STATE))
+
+   server = RequestServer(address, serve_request)
+   try:
+      server.start()
+   except OSError as e:
+      ccdciel('LogMsg','[ERROR] Can not start daemon on %s: %s' % (address_name(address), str(e)))
+      sys.exit(1)
+
+   # Warm up, errors are reported again by requests
+   run_spans = RunSpans(os.path.join(filters_and_focuser_positions_database_directory, filters_and_focuser_positions_database_file))
+   try:
+      device_cache.version()
+      forget_changed_database()
+      # Offsets could be changed in CCDciel while daemon did not run
+      forget_applied_offsets_fingerprint()
+      select_profile()
+      load_focus_repository(filters_and_focuser_positions_database_file, filters_and_focuser_positions_database_directory)
+      load_models()
+   except (Exception, SystemExit) as e:
+      ccdciel('LogMsg','[WARNING] Daemon warm up failed: %s' % (str(e)))
+   run_spans = None
+
+   ccdciel('LogMsg','[INFO] Daemon listens on %s' % (address_name(address)))
+   flush_log()
+   try:
+      server.serve()
+   finally:
+      server.close()
+   ccdciel('LogMsg','[INFO] Daemon stopped')
+
 # ---------------------------------------------------------------------------- #
 # --------------- MAIN - FOCUSER POSITION PER FILTER - MAIN ------------------ #
 # ---------------------------------------------------------------------------- #
 
-# Parse arguments from command line
+# Parse arguments from command line, --help and invalid arguments end script before any RPC
 arguments_parser()
 
-ccdciel('LogMsg','[INFO] This script path %s' % (this_script_path))
-ccdciel('LogMsg','[INFO] This script directory %s' % (this_script_dir))
-ccdciel('LogMsg','[INFO] Database name %s' % (filters_and_focuser_positions_database_file))
-ccdciel('LogMsg','[INFO] Initial focuser position %d' % (initial_focuser_position))
-
-# Check necessary components are connected
-check_necessary_components()
-
-# Run script in selected working mode CALCULATE (0) - default or READ (1) or RESET (2)
-if script_working_mode == 1:
-   ccdciel('LogMsg','[INFO] Script working mode: READ focuser position for selected filter from database')
-   read_focuser_position_for_filters()
-elif script_working_mode == 2:
-   ccdciel('LogMsg','[INFO] Script working mode: RESET focuser positions and offsets for all filters')
-   reset_focuser_positions_and_offsets()
+# Stop daemon or forward arguments to running daemon, script runs itself when daemon is not running
+# or daemon uses other CCDciel instance
+address = daemon_address(daemon_socket, 'CCDCIEL_FOCUS_DAEMON') # Address of daemon socket
+if daemon_mode == 2:
+   response = send_request(address, {'command': 'stop'})
+   print('Daemon on %s %s' % (address_name(address), 'stopped' if response != None else 'is not running'))
+   sys.exit(0)
+if daemon_mode == 3:
+   response = send_request(address, {'arguments': sys.argv[1:], 'endpoint': list(ccdciel_address()), 'log': log_options()})
+   if response != None and response.get('rejected'):
+      arguments_log.append('[WARNING] %s, script runs without daemon' % (response.get('error')))
+   elif response != None:
+      if 'error' in response:
+         print(response['error'])
+      sys.exit(response.get('status', 1))
+
+# Database, kinematics and prediction modules (sqlite3, NumPy) are imported only when script runs
+import sqlite3
+from ccdciel_motion import KinematicsModel, path_cost, plan_visit_order, run_concurrently
+from focuser_position_database import DEFAULT_PROFILE, AppliedOffsets, FocusHistory, FocusRepository, RunSpans, close_databases, database_version, forget_applied_offsets, upgrade_database
+from focus_prediction import FocusPredictor
+if prediction_max_error == None:
+   prediction_max_error = FocusPredictor.DEFAULT_MAX_ERROR
+
+if daemon_mode == 1:
+   run_daemon(address)
 else:
-   ccdciel('LogMsg','[INFO] Script working mode: CALCULATE focuser position for filter wheel')
-   calculate_focuser_position_for_filter_wheel()
+   # Run ended by critical error is stored at exit
+   atexit.register(lambda: run_spans.save() if run_spans != None else 0)
+   run_working_mode()
+
+# Close connections used by batch requests and database
+rpc_batch.close()
+close_databases()
 
 # ---------------------------------------------------------------------------- #
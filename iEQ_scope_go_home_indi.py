@@ -18,81 +18,70 @@
 #
 # List of changes:
 # [22-11-2025] Working version
+# [17-10-2026] Completion of HOME operation detected from HOME state and mount coordinates reported by INDI callbacks
+# [17-10-2026] Shared INDI client with properties mirror, device found by event instead of polling, needs ccdciel_indi.py module
+# [17-10-2026] Optional per-method RPC metrics (CCDCIEL_METRICS or --metrics <file>), needs ccdciel_rpc.py module
+# [17-10-2026] Logs buffered and send in batches by background thread, DEBUG messages off by default, optional
+#              rotating log file (CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel, --logfile), needs ccdciel_log.py module
+# [17-10-2026] Maximal time of HOME operation taken from ccdciel_indi.py module, the same as in end_session_indi script
 # ---------------------------------------------------------------------------- #
 #
 
 from ccdciel import ccdciel
+from ccdciel_rpc import enable_metrics
+from ccdciel_log import enable_log_sink
+from ccdciel_indi import DEFAULT_INDI_PORT, HOME_MAX_TIME, disconnect_clients, get_client
 import PyIndi
 import sys
 import time
 
-# INDI CLIENT CLASS
-class IndiClient(PyIndi.BaseClient):
-    def __init__(self):
-        super(IndiClient, self).__init__()
-    def newDevice(self, d):
-        pass
-    def newProperty(self, p):
-        pass
-    def removeProperty(self, p):
-        pass
-    def newBLOB(self, bp):
-        global blobEvent
-        print("new BLOB ", bp.name)
-        blobEvent.set()
-        pass
-    def newSwitch(self, svp):
-        pass
-    def newNumber(self, nvp):
-        pass
-    def newText(self, tvp):
-        pass
-    def newLight(self, lvp):
-        pass
-    def newMessage(self, d, m):
-        pass
-    def serverConnected(self):
-        pass
-    def serverDisconnected(self, code):
-        pass
+# Enable RPC metrics when CCDCIEL_METRICS or --metrics <file> is provided
+ccdciel = enable_metrics(ccdciel)
+
+# Buffer logs, DEBUG level and local log file are enabled by CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel <level>, --logfile <file>
+ccdciel = enable_log_sink(ccdciel)
+
+HOME_DEC_TOLERANCE = 0.1 # Maximal distance in degrees of DEC from pole in HOME position
+
+# home_operation_finished - condition for end of HOME operation, mount reports Ok/Idle state of HOME
+# after it has been busy or when it points to the pole (DEC +/-90)
+# @return 'HOME' - mount at home, 'ALERT' - HOME operation failed, None - HOME operation in progress
+def home_operation_finished(indiclient, mount):
+    state=indiclient.get_state(mount,"HOME")
+    if state == PyIndi.IPS_ALERT:
+       return 'ALERT'
+    if state == PyIndi.IPS_OK or state == PyIndi.IPS_IDLE:
+       dec=indiclient.get_value(mount,"EQUATORIAL_EOD_COORD","DEC")
+       if indiclient.state_reported(mount,"HOME",PyIndi.IPS_BUSY) or (dec != None and abs(abs(dec)-90.0) < HOME_DEC_TOLERANCE):
+          return 'HOME'
+    return None
 
 def processing_indi_commands_iEQ():
     # Monitore iEQ 'iOptron CEM60-EC' mount
     mount="iEQ"
     device_mount=None
-    mount_connected=None
 
     # Get INDI on port
-    default_indi_port=7625
-    indi_port=default_indi_port
+    indi_port=DEFAULT_INDI_PORT
     if len(sys.argv) > 1:
        indi_port=int(sys.argv[1])
 
-    # Trying connect to INDI
-    indiclient=IndiClient()
-    indiclient.setServer("localhost",indi_port)
+    # Trying connect to INDI, connection is shared by all INDI operations
+    indiclient=get_client(indi_port)
 
     # Check is INDI connected
-    sleep_time=2.0
-    if (not(indiclient.connectServer())):
+    if indiclient == None:
        ccdciel('LogMsg',"INDI client is not connected on port %d" %(indi_port))
        sys.exit(1)
     else:
        ccdciel('LogMsg',"INDI client is connected on port %d" %(indi_port))
-    time.sleep(sleep_time)
 
-    # Connect to iEQ mount
+    # Wait for iEQ mount and its HOME property
     max_time=30
-    cur_time=0
-    sleep_time=0.5
-    device_mount=indiclient.getDevice(mount)
-    while not(device_mount):
-          if cur_time == max_time:
-               ccdciel('LogMsg',"iEQ mount not connected during %d, something goes wrong!!!" %(max_time))
-               sys.exit(1)
-          time.sleep(sleep_time)
-          device_mount=indiclient.getDevice(mount)
-          cur_time=cur_time+sleep_time
+    device_mount=indiclient.wait_device(mount,max_time,"HOME")
+    if not(device_mount):
+       ccdciel('LogMsg',"iEQ mount not connected during %d, something goes wrong!!!" %(max_time))
+       sys.exit(1)
 
     # iEQ go to HOME
     mount_home_operation=device_mount.getSwitch("HOME")
@@ -102,9 +91,22 @@ def processing_indi_commands_iEQ():
     # mount_home_operation[0].s -  SET CURRENT POSITION AS HOME
     # mount_home_operation[1].s -  GO HOME
     # mount_home_operation[2].s -  FIND HOME
+    indiclient.clear_states(mount,"HOME")
     mount_home_operation[1].s=1
     indiclient.sendNewSwitch(mount_home_operation)
 
+    # Wait until mount reports HOME operation finished at home position
+    start_time=time.monotonic()
+    if indiclient.wait_for(lambda: home_operation_finished(indiclient,mount),HOME_MAX_TIME) != 'HOME':
+       if indiclient.get_state(mount,"HOME") == PyIndi.IPS_ALERT:
+          ccdciel('LogMsg',"[ERROR] iEQ mount reported failure of HOME operation")
+       else:
+          ccdciel('LogMsg',"[ERROR] iEQ mount not in HOME position during %ds, HOME state: %s DEC: %s" %(HOME_MAX_TIME,indiclient.get_state(mount,"HOME"),indiclient.get_value(mount,"EQUATORIAL_EOD_COORD","DEC")))
+       sys.exit(1)
+    ccdciel('LogMsg',"INDI iEQ in home position after %.1fs" %(time.monotonic()-start_time))
+
+    disconnect_clients()
+
 
 #
 # MAIN PROGRAM
@@ -21,6 +21,43 @@ if errorlevel 1 (
     exit /b 1
 )
 
+echo Installing shared modules in CCDciel directory...
+copy /Y ccdciel_rpc.py "%APPDATA%\ccdciel\"
+if errorlevel 1 (
+    echo Error: Failed to install ccdciel_rpc module
+    exit /b 1
+)
+
+copy /Y ccdciel_motion.py "%APPDATA%\ccdciel\"
+if errorlevel 1 (
+    echo Error: Failed to install ccdciel_motion module
+    exit /b 1
+)
+
+copy /Y focuser_position_database.py "%APPDATA%\ccdciel\"
+if errorlevel 1 (
+    echo Error: Failed to install focuser_position_database module
+    exit /b 1
+)
+
+copy /Y focus_prediction.py "%APPDATA%\ccdciel\"
+if errorlevel 1 (
+    echo Error: Failed to install focus_prediction module
+    exit /b 1
+)
+
+copy /Y ccdciel_log.py "%APPDATA%\ccdciel\"
+if errorlevel 1 (
+    echo Error: Failed to install ccdciel_log module
+    exit /b 1
+)
+
+copy /Y ccdciel_daemon.py "%APPDATA%\ccdciel\"
+if errorlevel 1 (
+    echo Error: Failed to install ccdciel_daemon module
+    exit /b 1
+)
+
 echo.
 echo Script installed successfully!
 echo Location: %APPDATA%\ccdciel\focuser_position_per_filter.script
@@ -12,12 +12,23 @@
 #
 # List of changes:
 # [22-11-2025] Log focuser current position
+# [17-10-2026] Optional per-method RPC metrics (CCDCIEL_METRICS or --metrics <file>), needs ccdciel_rpc.py module
+# [17-10-2026] Logs buffered and send in batches by background thread, DEBUG messages off by default, optional
+#              rotating log file (CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel, --logfile), needs ccdciel_log.py module
 # ---------------------------------------------------------------------------- #
 #
 
 from ccdciel import ccdciel
+from ccdciel_rpc import enable_metrics
+from ccdciel_log import enable_log_sink
 import sys
 
+# Enable RPC metrics when CCDCIEL_METRICS or --metrics <file> is provided
+ccdciel = enable_metrics(ccdciel)
+
+# Buffer logs, DEBUG level and local log file are enabled by CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel <level>, --logfile <file>
+ccdciel = enable_log_sink(ccdciel)
+
 connected = (ccdciel('Focuser_connected')['result'])
 if not connected :
    ccdciel('LogMsg','Focuser not connected!')
@@ -18,81 +18,52 @@
 #
 # List of changes:
 # [22-11-2025] Initial working version
+# [17-10-2026] Shared INDI client, device found by event instead of fixed 2s wait and polling, needs ccdciel_indi.py module
+# [17-10-2026] Optional per-method RPC metrics (CCDCIEL_METRICS or --metrics <file>), needs ccdciel_rpc.py module
+# [17-10-2026] Logs buffered and send in batches by background thread, DEBUG messages off by default, optional
+#              rotating log file (CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel, --logfile), needs ccdciel_log.py module
 # ---------------------------------------------------------------------------- #
 #
 
 from ccdciel import ccdciel
+from ccdciel_rpc import enable_metrics
+from ccdciel_log import enable_log_sink
+from ccdciel_indi import DEFAULT_INDI_PORT, disconnect_clients, get_client
 import PyIndi
 import sys
-import time
-
-# INDI CLIENT CLASS
-class IndiClient(PyIndi.BaseClient):
-    def __init__(self):
-        super(IndiClient, self).__init__()
-    def newDevice(self, d):
-        pass
-    def newProperty(self, p):
-        pass
-    def removeProperty(self, p):
-        pass
-    def newBLOB(self, bp):
-        global blobEvent
-        print("new BLOB ", bp.name)
-        blobEvent.set()
-        pass
-    def newSwitch(self, svp):
-        pass
-    def newNumber(self, nvp):
-        pass
-    def newText(self, tvp):
-        pass
-    def newLight(self, lvp):
-        pass
-    def newMessage(self, d, m):
-        pass
-    def serverConnected(self):
-        pass
-    def serverDisconnected(self, code):
-        pass
+
+# Enable RPC metrics when CCDCIEL_METRICS or --metrics <file> is provided
+ccdciel = enable_metrics(ccdciel)
+
+# Buffer logs, DEBUG level and local log file are enabled by CCDCIEL_LOG_LEVEL, CCDCIEL_LOG_FILE or --loglevel <level>, --logfile <file>
+ccdciel = enable_log_sink(ccdciel)
 
 def processing_indi_commands_pa_spb():
     # Monitore Pegasus Astro Saddle Power Box 'Pegasus SPB' manager
     pa_spb="Pegasus SPB"
     device_pa_spb=None
-    pa_spb_connected=None
 
     # Get INDI on port
-    default_indi_port=7625
-    indi_port=default_indi_port
+    indi_port=DEFAULT_INDI_PORT
     if len(sys.argv) > 1:
        indi_port=int(sys.argv[1])
 
-    # Trying connect to INDI
-    indiclient=IndiClient()
-    indiclient.setServer("localhost",indi_port)
+    # Trying connect to INDI, connection is shared by all INDI operations
+    indiclient=get_client(indi_port)
 
     # Check is INDI connected
-    sleep_time=2.0
-    if (not(indiclient.connectServer())):
+    if indiclient == None:
        ccdciel('LogMsg',"INDI client is not connected on port %d" %(indi_port))
        sys.exit(1)
     else:
        ccdciel('LogMsg',"INDI client is connected on port %d" %(indi_port))
-    time.sleep(sleep_time)
 
-    # Connect to 'Pegasus SPB' mount
+    # Wait for 'Pegasus SPB' and its DEWAUTO property
     max_time=30
-    cur_time=0
-    sleep_time=0.5
-    device_pa_spb=indiclient.getDevice(pa_spb)
-    while not(device_pa_spb):
-          if cur_time == max_time:
-               ccdciel('LogMsg',"Pegasus Astro Saddle Power Box mount not connected during %d, something goes wrong!!!" %(max_time))
-               sys.exit(1)
-          time.sleep(sleep_time)
-          device_pa_spb=indiclient.getDevice(pa_spb)
-          cur_time=cur_time+sleep_time
+    device_pa_spb=indiclient.wait_device(pa_spb,max_time,"DEWAUTO")
+    if not(device_pa_spb):
+       ccdciel('LogMsg',"Pegasus Astro Saddle Power Box mount not connected during %d, something goes wrong!!!" %(max_time))
+       sys.exit(1)
 
     print("Driver: %s" % str(device_pa_spb.getDriverName()))
     pa_spb_dew_operation_auto=device_pa_spb.getSwitch("DEWAUTO")
@@ -120,6 +91,8 @@ def processing_indi_commands_pa_spb():
     print("(0) Disabled: %s : %s" % (str(d), str(pa_spb_dew_operation_auto[1].getStateAsString())))
     #ccdciel('LogMsg',"Pegasus Astro Saddle Power Box DewAutoSP: %s" % (pa_spb_dew_operation_auto_str))
 
+    disconnect_clients()
+
 
 #
 # MAIN PROGRAM